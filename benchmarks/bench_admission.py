@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""准入控制（common.admission）的效果：一个失控的 key 狂发请求时，其他讲解机是否还能得到回答。
+
+在本地启动模拟的智谱流式接口，并模拟智谱的并发配额：同时最多处理 --capacity 条流，超出的请求在上游按先来后到排队。
+shimenguan 的 ASGI 服务（单个 uvicorn worker）配置 --kiosks + 1 个 key：
+    - flood：失控的客户端，--flood 个并发循环不停地发流式请求，收到 429 后不看 Retry-After，隔 0.05 秒立即重试；
+    - kiosk0 ~ kioskN：正常的讲解机，每台依次发流式请求，每次间隔 --think 秒。
+问题各不相同并带 no_cache，不命中缓存、也不会被合并。分别以三种方式运行 --duration 秒：
+    - off：关闭准入控制（ADMISSION_MAX_CONCURRENT=0），所有请求都直接发往上游；
+    - fair：服务端的上游并发上限等于配额，超出的请求在服务端按 key 轮转排队；
+    - fair+rate：再给 flood 配置令牌桶限速（--flood-rate 次/秒），超出的请求立即返回 429。
+统计讲解机的首片段延迟 p50 / p99 和完成的请求数，flood 完成的请求数和收到的 429 数（以及 Retry-After 的中位数），
+以及服务端 /stats 中 zhipuai 上游的平均排队时间。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_admission.py
+    python benchmarks/bench_admission.py --capacity 8 --flood 40 --kiosks 8 --duration 20 --flood-rate 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_async import StubUpstream, start_process
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+
+MODES = ('off', 'fair', 'fair+rate')
+
+
+class QuotaUpstream(StubUpstream):
+    """同时最多处理 capacity 条流的模拟智谱接口，超出的请求按到达顺序等待（模拟上游的并发配额）。"""
+
+    def __init__(self, chunks, interval, capacity):
+        self.capacity = asyncio.Semaphore(capacity)
+        super().__init__(chunks, interval)
+
+    async def _handle(self, reader, writer):
+        async with self.capacity:
+            await super()._handle(reader, writer)
+
+
+async def stream_once(port, key, query):
+    """发起一条流式请求并读完，返回 (状态码, 首片段延迟, Retry-After)。"""
+    # no_cache：相似的问题也不命中缓存，每个请求都要调用上游
+    body = json.dumps({'query': query, 'stream': True, 'no_cache': True}).encode('utf-8')
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'auth-key: Bearer {key}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                     .encode('ascii') + body)
+        await writer.drain()
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+        status = int(head.split()[1])
+        if status != 200:
+            retry_after = None
+            for line in head.split('\r\n'):
+                if line.startswith('retry-after:'):
+                    retry_after = int(line.split(':')[1])
+            return status, None, retry_after
+        if not await reader.read(1):
+            raise RuntimeError('empty response')
+        ttfb = time.perf_counter() - start
+        while await reader.read(65536):
+            pass
+        return status, ttfb, None
+    finally:
+        writer.close()
+
+
+async def run_load(port, args):
+    deadline = time.perf_counter() + args.duration
+    kiosk_ttfb, kiosk_rejected = [], 0
+    flood_done, flood_rejected, retry_after = 0, 0, []
+
+    async def flood(f):
+        nonlocal flood_done, flood_rejected
+        i = 0
+        while time.perf_counter() < deadline:
+            i += 1
+            status, _, wait = await stream_once(port, 'flood', f'失控客户端{f}的第{i}个问题')
+            if status == 200:
+                flood_done += 1
+            else:
+                flood_rejected += 1
+                if wait is not None:
+                    retry_after.append(wait)
+                await asyncio.sleep(0.05)
+
+    async def kiosk(k):
+        nonlocal kiosk_rejected
+        i = 0
+        while time.perf_counter() < deadline:
+            i += 1
+            status, ttfb, _ = await stream_once(port, f'kiosk{k}', f'第{k}台讲解机的第{i}个问题')
+            if status == 200:
+                kiosk_ttfb.append(ttfb)
+            else:
+                kiosk_rejected += 1
+            await asyncio.sleep(args.think)
+
+    await asyncio.gather(*(flood(f) for f in range(args.flood)), *(kiosk(k) for k in range(args.kiosks)))
+    retry_after.sort()
+    return (sorted(kiosk_ttfb), kiosk_rejected, flood_done, flood_rejected,
+            retry_after[len(retry_after) // 2] if retry_after else None)
+
+
+def percentile(values, p):
+    return values[max(0, int(len(values) * p) - 1)] if values else float('nan')
+
+
+def write_config(base, kiosks, flood_rate):
+    path = os.path.join(base, 'shimenguan', 'config.json')
+    with open(path, encoding='utf-8') as file:
+        config = json.load(file)
+    config['auth_keys'] = [AUTH_KEY, 'flood'] + [f'kiosk{k}' for k in range(kiosks)]
+    config.pop('admission', None)
+    if flood_rate:
+        config['admission'] = {'keys': {'flood': {'rate': flood_rate, 'burst': max(1, round(flood_rate * 2))}}}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(config, file, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--capacity', type=int, default=8, help='上游同时处理的流数（模拟的配额）')
+    parser.add_argument('--flood', type=int, default=40, help='失控客户端的并发请求数')
+    parser.add_argument('--kiosks', type=int, default=8, help='正常的讲解机数')
+    parser.add_argument('--think', type=float, default=0.2, help='讲解机两次请求之间的间隔（秒）')
+    parser.add_argument('--flood-rate', type=float, default=2.0, help='fair+rate 中 flood 的限速（次/秒）')
+    parser.add_argument('--chunks', type=int, default=10, help='每条上游流的片段数')
+    parser.add_argument('--interval', type=float, default=0.05, help='上游片段之间的间隔（秒）')
+    parser.add_argument('--duration', type=float, default=15.0, help='每种方式的压测时长（秒）')
+    args = parser.parse_args()
+
+    upstream = QuotaUpstream(args.chunks, args.interval, args.capacity)
+    print(f"upstream quota = {args.capacity} streams x {args.chunks * args.interval:.1f}s, "
+          f"flood = {args.flood} concurrent, {args.kiosks} kiosks (think {args.think}s), {args.duration:.0f}s per mode")
+    print(f"\n{'mode':11}{'kiosk p50':>11}{'kiosk p99':>11}{'kiosk ok':>10}{'kiosk 429':>11}"
+          f"{'flood ok':>10}{'flood 429':>11}{'Retry-After':>13}{'avg queue':>11}")
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        for mode in MODES:
+            write_config(base, args.kiosks, args.flood_rate if mode == 'fair+rate' else 0)
+            env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{upstream.port}', RELOAD_INTERVAL='0',
+                       SHIMENGUAN_DATA_DIR=os.path.join(base, 'shimenguan'), PYTHONWARNINGS='ignore',
+                       ADMISSION_MAX_CONCURRENT='0' if mode == 'off' else str(args.capacity),
+                       ADMISSION_QUEUE_SIZE=str(args.flood + args.kiosks), ADMISSION_MAX_WAIT='10',
+                       ADMISSION_RESERVED='0')
+            port = free_port()
+            process = start_process('asgi', port, env)
+            try:
+                kiosk_ttfb, kiosk_rejected, flood_done, flood_rejected, retry_after = asyncio.run(run_load(port, args))
+                stats = httpx.get(f'http://127.0.0.1:{port}/stats', headers={'auth-key': f'Bearer {AUTH_KEY}'}).json()
+            finally:
+                process.terminate()
+                process.wait()
+            zhipuai = stats['admission']['upstreams'].get('zhipuai', {})
+            queue = f"{zhipuai.get('avg_wait_ms', 0):.0f}ms" if mode != 'off' else '-'
+            print(f"{mode:11}{percentile(kiosk_ttfb, 0.5) * 1000:>9.0f}ms{percentile(kiosk_ttfb, 0.99) * 1000:>9.0f}ms"
+                  f"{len(kiosk_ttfb):>10}{kiosk_rejected:>11}{flood_done:>10}{flood_rejected:>11}"
+                  f"{(f'{retry_after}s' if retry_after is not None else '-'):>13}{queue:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""流式接口的并发压测：shimenguan 的 Flask 多线程服务 vs. ASGI 服务（shimenguan/asgi.py，单个 uvicorn worker）。
+
+在本地启动一个异步的模拟智谱接口：每个流式请求按 --interval 间隔输出 --chunks 个片段（模拟 5~20 秒的长回答），
+并统计同时进行中的上游流数量。对两种服务分别在 --ramp 秒内陆续发起 --streams 条流式请求（问题各不相同，不会命中缓存或被合并），
+统计：
+    - upstream peak：上游同时进行中的流的峰值，即服务实际能同时保持的流数；
+    - TTFB p50 / p99：从发出请求到收到第一个片段的时间（排队等待线程或连接的请求会明显变慢）；
+    - wall：全部流结束的总时间，以及失败的请求数；
+    - 服务进程的常驻内存和线程数峰值（读取 /proc，仅支持 Linux）。
+Flask 版本使用 zhipuai SDK，SDK 客户端到上游的连接数上限为 50；ASGI 版本使用 common.aio 的共享连接池。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --streams 100 1000 2000 --chunks 40 --interval 0.25 --ramp 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+
+
+class StubUpstream:
+    """在后台线程的事件循环中运行的模拟智谱接口（只实现流式 /chat/completions）。
+
+    pieces 为每个片段的内容，默认为 "第i句。"。
+    """
+
+    def __init__(self, chunks, interval, pieces=None):
+        self.chunks = len(pieces) if pieces else chunks
+        self.interval = interval
+        self.pieces = pieces or [f'第{i}句。' for i in range(chunks)]
+        self.active = 0
+        self.peak = 0
+        # 上游实际发出的片段数和各条流持续时间之和（客户端断开后上游是否及时停止）
+        self.sent = 0
+        self.stream_seconds = 0.0
+        self.port = free_port()
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+
+    def reset(self):
+        self.peak = self.active
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', self.port, backlog=4096))
+        self._ready.set()
+        loop.run_until_complete(server.serve_forever())
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await self._respond(await reader.readexactly(length), writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, body, writer):
+        """回复一个请求（body 为请求体）；不论请求内容都返回一条流。"""
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        start = time.perf_counter()
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n')
+            for i in range(self.chunks):
+                await asyncio.sleep(self.interval)
+                chunk = {'id': 'bench', 'created': 0, 'model': 'glm-4',
+                         'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': self.pieces[i]}}]}
+                writer.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                await writer.drain()
+                self.sent += 1
+            writer.write(b'data: [DONE]\n\n')
+            await writer.drain()
+        finally:
+            self.active -= 1
+            self.stream_seconds += time.perf_counter() - start
+
+
+def serve(target, port):
+    """子进程入口。"""
+    if target == 'asgi':
+        import uvicorn
+        uvicorn.run('shimenguan.asgi:app', host='127.0.0.1', port=port, log_level='warning', access_log=False,
+                    backlog=4096)
+    else:
+        from werkzeug.serving import make_server
+        from shimenguan.main import app
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def proc_status(pid):
+    """返回 (RSS MB, 线程数)。"""
+    rss = threads = 0
+    with open(f'/proc/{pid}/status', encoding='ascii') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+async def one_stream(port, i, delay, ttfb):
+    """用最简单的 HTTP/1.1 客户端发起一条流式请求（压测端本身的开销要远小于被测服务）。"""
+    await asyncio.sleep(delay)
+    body = json.dumps({'query': f'介绍一下第{i}个景点', 'stream': True}).encode('utf-8')
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'auth-key: Bearer {AUTH_KEY}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                     .encode('ascii') + body)
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        if not head.startswith(b'HTTP/1.1 200') and not head.startswith(b'HTTP/1.0 200'):
+            raise RuntimeError(head.split(b'\r\n', 1)[0].decode('ascii', 'replace'))
+        if not await reader.read(1):
+            raise RuntimeError('empty response')
+        ttfb.append(time.perf_counter() - start)
+        while await reader.read(65536):
+            pass
+    finally:
+        writer.close()
+
+
+async def run_load(port, streams, ramp, pid):
+    ttfb = []
+    peak_rss = peak_threads = 0
+    done = asyncio.Event()
+
+    async def sample():
+        nonlocal peak_rss, peak_threads
+        while not done.is_set():
+            rss, threads = proc_status(pid)
+            peak_rss, peak_threads = max(peak_rss, rss), max(peak_threads, threads)
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.ensure_future(sample())
+    start = time.perf_counter()
+    # 请求在 ramp 秒内均匀发出，模拟陆续到来的访客，而不是同一瞬间全部连接
+    results = await asyncio.gather(*(one_stream(port, i, ramp * i / streams, ttfb) for i in range(streams)),
+                                   return_exceptions=True)
+    wall = time.perf_counter() - start
+    done.set()
+    await sampler
+    errors = sum(isinstance(result, BaseException) for result in results)
+    ttfb.sort()
+    p50 = ttfb[len(ttfb) // 2] if ttfb else float('nan')
+    p99 = ttfb[max(0, int(len(ttfb) * 0.99) - 1)] if ttfb else float('nan')
+    return wall, p50, p99, errors, peak_rss, peak_threads
+
+
+def start_process(target, port, env):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', target, '--port', str(port)],
+                               env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{target} exited during startup (code {process.returncode})")
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/stats', timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit(f"{target} did not start within 60 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, nargs='+', default=[100, 1000], help='发起的流式请求数')
+    parser.add_argument('--chunks', type=int, default=20, help='每条上游流的片段数')
+    parser.add_argument('--interval', type=float, default=0.25, help='上游片段之间的间隔（秒）')
+    parser.add_argument('--ramp', type=float, default=2.0, help='在多少秒内陆续发出全部请求')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    upstream = StubUpstream(args.chunks, args.interval)
+    print(f"upstream stream = {args.chunks} chunks x {args.interval}s = {args.chunks * args.interval:.1f}s, "
+          f"requests ramped over {args.ramp}s")
+    print(f"\n{'server':8}{'streams':>8}{'upstream peak':>15}{'TTFB p50':>10}{'TTFB p99':>10}{'wall':>8}"
+          f"{'errors':>8}{'RSS':>9}{'threads':>9}")
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        # 测的是服务本身能同时保持多少条流，关闭上游并发上限（common.admission）
+        env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{upstream.port}', RELOAD_INTERVAL='0',
+                   SHIMENGUAN_DATA_DIR=os.path.join(base, 'shimenguan'), PYTHONWARNINGS='ignore',
+                   ADMISSION_MAX_CONCURRENT='0')
+        for target in ('flask', 'asgi'):
+            for streams in args.streams:
+                port = free_port()
+                process = start_process(target, port, env)
+                try:
+                    upstream.reset()
+                    wall, p50, p99, errors, rss, threads = asyncio.run(
+                        run_load(port, streams, args.ramp, process.pid))
+                finally:
+                    process.terminate()
+                    process.wait()
+                print(f"{target:8}{streams:>8}{upstream.peak:>15}{p50:>9.2f}s{p99:>9.2f}s{wall:>7.1f}s"
+                      f"{errors:>8}{rss:>7.0f}MB{threads:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""敏感词匹配基准：原来的逐词 any() 扫描 vs. Aho-Corasick 自动机（原样匹配 / 归一化匹配），
+以及模型输出流式过滤（BanwordStreamFilter）每个 chunk 的开销。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_banwords.py
+    python benchmarks/bench_banwords.py --sizes 10000 100000 --queries 2000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.banwords import BanwordMatcher, BanwordStreamFilter
+
+# 常用汉字区间，用来随机生成词表和查询
+CJK_START, CJK_END = 0x4E00, 0x4FFF
+
+
+def random_text(rng, length):
+    return ''.join(chr(rng.randint(CJK_START, CJK_END)) for _ in range(length))
+
+
+def make_banwords(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(random_text(rng, rng.randint(2, 6)))
+    return words
+
+
+def make_queries(rng, banwords, count, hit_ratio=0.1):
+    """生成典型长度（10~60 字）的查询，其中约 hit_ratio 比例包含一个敏感词。"""
+    pool = list(banwords)
+    queries = []
+    for _ in range(count):
+        query = random_text(rng, rng.randint(10, 60))
+        if rng.random() < hit_ratio:
+            pos = rng.randint(0, len(query))
+            query = query[:pos] + rng.choice(pool) + query[pos:]
+        queries.append(query)
+    return queries
+
+
+def bench(fn, queries):
+    start = time.perf_counter()
+    hits = 0
+    for query in queries:
+        if fn(query):
+            hits += 1
+    return (time.perf_counter() - start) / len(queries), hits
+
+
+def bench_stream(matcher, rng, chunks=20000):
+    """模拟模型逐 delta 输出（每个 delta 1~4 个字），返回每个 chunk 的平均过滤耗时。"""
+    deltas = [random_text(rng, rng.randint(1, 4)) for _ in range(chunks)]
+    stream_filter = BanwordStreamFilter(matcher)
+    start = time.perf_counter()
+    for delta in deltas:
+        stream_filter.feed(delta)
+        if stream_filter.match is not None:
+            stream_filter = BanwordStreamFilter(matcher)
+    return (time.perf_counter() - start) / chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'words':>8} {'build(ms)':>10} {'any() us/q':>12} {'AC us/q':>10} {'AC+norm us/q':>13} {'speedup':>8}")
+    stream_results = []
+    for size in args.sizes:
+        banwords = make_banwords(rng, size)
+        queries = make_queries(rng, banwords, args.queries)
+
+        start = time.perf_counter()
+        matcher = BanwordMatcher(banwords, normalize=False)
+        build_ms = (time.perf_counter() - start) * 1000
+        normalized = BanwordMatcher(banwords)
+
+        scan_time, scan_hits = bench(lambda q: any(w in q for w in banwords), queries)
+        ac_time, ac_hits = bench(matcher.search, queries)
+        norm_time, _ = bench(normalized.search, queries)
+        assert scan_hits == ac_hits, (scan_hits, ac_hits)
+
+        print(f"{size:>8} {build_ms:>10.1f} {scan_time * 1e6:>12.1f} {ac_time * 1e6:>10.2f} "
+              f"{norm_time * 1e6:>13.2f} {scan_time / ac_time:>7.0f}x")
+        stream_results.append((size, bench_stream(normalized, rng)))
+
+    print()
+    print(f"{'words':>8} {'stream filter us/chunk':>24}")
+    for size, per_chunk in stream_results:
+        print(f"{size:>8} {per_chunk * 1e6:>24.2f}")
+
+
+if __name__ == '__main__':
+    main()
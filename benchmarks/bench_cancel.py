@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""客户端中途断开时，上游流是否被及时取消。
+
+在本地启动模拟的智谱流式接口（每条流按 --interval 间隔输出 --chunks 个片段），以多线程 Flask 方式启动
+piaofutong 服务并连到它。先发 --warmup 条完整读完的流式请求（让服务有已完成流的平均长度，用于估算节省量），
+再发 --requests 条请求，每条读到 --read 个片段后直接断开连接（模拟游客离开讲解机），统计：
+    - 断开后上游多发出的片段数、上游流在断开后多持续的秒数（理想情况都接近 0）；
+    - 服务 /stats 中记录的取消次数，以及估算节省的 token 数和秒数。
+问题各不相同，不会命中缓存或被合并。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_cancel.py
+    python benchmarks/bench_cancel.py --requests 50 --chunks 60 --interval 0.05 --read 5
+"""
+import argparse
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_async import StubUpstream
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+
+
+def serve(port):
+    """子进程入口。"""
+    from werkzeug.serving import make_server
+    from piaofutong.main import app
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start_process(port, env):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+                               env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"piaofutong exited during startup (code {process.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    sys.exit("piaofutong did not start within 60 s")
+
+
+def stream(port, query, read):
+    """发起一条流式请求，读到 read 个片段后断开；read 为 None 时读完整条流。"""
+    body = json.dumps({'query': query, 'stream': True}).encode('utf-8')
+    with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+        sock.sendall(f'POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'auth-key: Bearer {AUTH_KEY}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                     .encode('ascii') + body)
+        received = b''
+        # 每个模拟片段以句号结尾，按句号计数
+        while read is None or received.count('。'.encode('utf-8')) < read:
+            data = sock.recv(65536)
+            if not data:
+                break
+            received += data
+        # 立即发送 RST，模拟客户端进程退出或网络断开
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+
+
+def stats(port):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/stats', headers={'auth-key': f'Bearer {AUTH_KEY}'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20, help='中途断开的请求数')
+    parser.add_argument('--warmup', type=int, default=5, help='完整读完的请求数')
+    parser.add_argument('--chunks', type=int, default=40, help='每条上游流的片段数')
+    parser.add_argument('--interval', type=float, default=0.1, help='上游片段之间的间隔（秒）')
+    parser.add_argument('--read', type=int, default=5, help='客户端读到多少个片段后断开')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port)
+        return
+
+    upstream = StubUpstream(args.chunks, args.interval)
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{upstream.port}', RELOAD_INTERVAL='0',
+                   PIAOFUTONG_DATA_DIR=os.path.join(base, 'piaofutong'), PYTHONWARNINGS='ignore')
+        port = free_port()
+        process = start_process(port, env)
+        try:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(lambda i: stream(port, f'完整问题{i}', None), range(args.warmup)))
+            sent, seconds = upstream.sent, upstream.stream_seconds
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(lambda i: stream(port, f'中途离开{i}', args.read), range(args.requests)))
+            # 等待仍在进行的上游流结束（未取消时最长为一整条流的时间）
+            deadline = time.monotonic() + args.chunks * args.interval + 5
+            while upstream.active and time.monotonic() < deadline:
+                time.sleep(0.05)
+            sent, seconds = upstream.sent - sent, upstream.stream_seconds - seconds
+            try:
+                cancellations = stats(port).get('cancellations')
+            except Exception:
+                cancellations = None
+        finally:
+            process.terminate()
+            process.wait()
+
+    full = args.chunks * args.interval
+    extra_chunks = sent / args.requests - args.read
+    extra_seconds = seconds / args.requests - args.read * args.interval
+    print(f"upstream stream = {args.chunks} chunks x {args.interval}s = {full:.1f}s, "
+          f"client leaves after {args.read} chunks, {args.requests} requests")
+    print(f"upstream chunks sent after disconnect: {extra_chunks:.1f} per request "
+          f"(of {args.chunks - args.read} remaining)")
+    print(f"upstream seconds after disconnect:     {extra_seconds:.2f}s per request "
+          f"(of {full - args.read * args.interval:.1f}s remaining)")
+    if cancellations is not None:
+        print(f"service /stats cancellations: {json.dumps(cancellations)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Coze /nav 等待方式对比：原来的固定 0.5 秒轮询、退避轮询、流式事件。
+
+在本地启动一个模拟 Coze 开放接口的 HTTP 服务，每轮对话在随机的生成时间后完成，
+回答完成后还会再过一段时间才推送推荐问题和对话完成事件（与线上的 nav bot 行为一致）。
+分别用三种方式等待同一批对话，统计从发起请求到拿到回答的耗时和发出的 HTTP 请求数。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_coze_nav.py
+    python benchmarks/bench_coze_nav.py --chats 30 --min-gen 0.2 --max-gen 2.0 --follow-up 0.4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cozepy import ChatStatus, Coze, Message, MessageRole, MessageType, TokenAuth
+from common.coze_chat import answer_via_polling, answer_via_stream
+
+ANSWER = '{"NEEDNAV":"Y","POI":"游客中心"}'
+
+
+class StubState:
+    def __init__(self, min_gen, max_gen, follow_up, seed):
+        self.rng = random.Random(seed)
+        self.min_gen = min_gen
+        self.max_gen = max_gen
+        self.follow_up = follow_up
+        self.chats = {}  # chat_id -> 完成时间
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def new_chat(self):
+        with self.lock:
+            self.requests += 1
+            chat_id = uuid.uuid4().hex
+            self.chats[chat_id] = time.monotonic() + self.rng.uniform(self.min_gen, self.max_gen)
+            return chat_id
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, data):
+            body = json.dumps({'code': 0, 'msg': '', 'data': data}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _chat(self, chat_id, status):
+            return {'id': chat_id, 'conversation_id': 'conv', 'bot_id': 'bot', 'status': status}
+
+        def _message(self, chat_id, content, type_='answer'):
+            return {'role': 'assistant', 'type': type_, 'content': content, 'content_type': 'text',
+                    'chat_id': chat_id, 'conversation_id': 'conv'}
+
+        def _event(self, event, data):
+            payload = f"event:{event}\ndata:{json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            chat_id = parse_qs(url.query)['chat_id'][0]
+            state.count()
+            self._json([self._message(chat_id, ANSWER)])
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if url.path == '/v3/chat/retrieve':
+                state.count()
+                chat_id = parse_qs(url.query)['chat_id'][0]
+                done = time.monotonic() >= state.chats[chat_id]
+                self._json(self._chat(chat_id, 'completed' if done else 'in_progress'))
+                return
+            chat_id = state.new_chat()
+            if not json.loads(body).get('stream'):
+                self._json(self._chat(chat_id, 'in_progress'))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self._event('conversation.chat.created', self._chat(chat_id, 'created'))
+            # 回答分两段增量推送，生成时间到达时推送回答完成事件
+            half = len(ANSWER) // 2
+            time.sleep(max(0.0, state.chats[chat_id] - time.monotonic()) / 2)
+            self._event('conversation.message.delta', self._message(chat_id, ANSWER[:half]))
+            time.sleep(max(0.0, state.chats[chat_id] - time.monotonic()))
+            self._event('conversation.message.delta', self._message(chat_id, ANSWER[half:]))
+            self._event('conversation.message.completed', self._message(chat_id, ANSWER))
+            try:
+                time.sleep(state.follow_up)
+                self._event('conversation.message.completed', self._message(chat_id, '还想去哪里？', 'follow_up'))
+                self._event('conversation.chat.completed', self._chat(chat_id, 'completed'))
+                self._event('done', '[DONE]')
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 客户端拿到回答后提前关闭了连接
+
+    return Handler
+
+
+def legacy_polling(coze_client, bot_id, user_id, messages):
+    """原 nav_endpoint 中的等待逻辑：每 0.5 秒 retrieve 一次。"""
+    chat = coze_client.chat.create(bot_id=bot_id, user_id=user_id, additional_messages=messages)
+    while chat.status == ChatStatus.IN_PROGRESS:
+        time.sleep(0.5)
+        chat = coze_client.chat.retrieve(conversation_id=chat.conversation_id, chat_id=chat.id)
+    content = ''
+    for message in coze_client.chat.messages.list(conversation_id=chat.conversation_id, chat_id=chat.id):
+        if message.role == MessageRole.ASSISTANT and message.type == MessageType.ANSWER:
+            content += message.content
+    return content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--min-gen', type=float, default=0.3, help='最短生成时间（秒）')
+    parser.add_argument('--max-gen', type=float, default=1.5, help='最长生成时间（秒）')
+    parser.add_argument('--follow-up', type=float, default=0.3, help='回答完成后推送推荐问题的延迟（秒）')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    strategies = [('fixed 0.5s poll', legacy_polling), ('backoff poll', answer_via_polling),
+                  ('stream events', answer_via_stream)]
+    messages = [Message.build_user_question_text('带我去游客中心')]
+    print(f"{'strategy':<16}{'mean':>10}{'p50':>10}{'max':>10}{'overhead':>10}{'requests':>10}")
+    for name, strategy in strategies:
+        # 每种方式使用相同种子，生成时间序列一致
+        state = StubState(args.min_gen, args.max_gen, args.follow_up, args.seed)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        coze_client = Coze(auth=TokenAuth('stub'), base_url=f'http://127.0.0.1:{server.server_port}')
+        latencies, overheads = [], []
+        for _ in range(args.chats):
+            start = time.monotonic()
+            content = strategy(coze_client, 'bot', 'bench_user', messages)
+            end = time.monotonic()
+            assert content == ANSWER, content
+            ready_at = list(state.chats.values())[-1]  # 刚发起的这一轮对话的完成时间
+            latencies.append(end - start)
+            overheads.append(end - ready_at)
+        server.shutdown()
+        latencies.sort()
+        print(f"{name:<16}{sum(latencies) / len(latencies) * 1000:>8.0f}ms"
+              f"{latencies[len(latencies) // 2] * 1000:>8.0f}ms{latencies[-1] * 1000:>8.0f}ms"
+              f"{sum(overheads) / len(overheads) * 1000:>8.0f}ms{state.requests:>10}")
+    print("overhead = 拿到回答的时刻 - 模拟对话实际完成的时刻（平均）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""网关（gateway.py，一个进程托管四个服务）与原来四个独立进程的内存和吞吐对比。
+
+在本地启动一个模拟智谱开放接口的 HTTP 服务（按 --upstream-latency 延迟后返回固定回答），
+各服务通过 ZHIPUAI_BASE_URL 连到它；每个服务使用临时目录中的示例配置，四个服务共用同一份
+--banwords 个词的敏感词表。分别以两种方式启动：
+    - separate：四个服务各自一个进程（与现在的部署方式相同）；
+    - gateway：一个网关进程，各服务挂载在 /<服务名> 前缀下。
+统计启动后和压测后所有服务进程的常驻内存（RSS，读取 /proc，仅支持 Linux），
+以及向 piaofutong / shuziren / shimenguan 的 / 接口并发发送请求的吞吐和延迟。
+coze 需要 Coze 开放接口，只计入内存，不参与压测。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_gateway.py
+    python benchmarks/bench_gateway.py --requests 3000 --concurrency 32 --upstream-latency 0.05 --banwords 20000
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SERVICES = ('piaofutong', 'shuziren', 'shimenguan', 'coze')
+LOADED_SERVICES = ('piaofutong', 'shuziren', 'shimenguan')
+AUTH_KEY = 'bench'
+QUERIES = ["门票多少钱", "景区几点开门", "厕所在哪里", "讲一下历史", "有什么好玩的", "今天人多吗", "停车场在哪",
+           "可以带宠物吗", "儿童票怎么买", "哪里可以吃饭"]
+# 常用汉字区间，用来随机生成敏感词表
+CJK_START, CJK_END = 0x4E00, 0x4FFF
+
+
+def write_fixtures(base, banword_count, seed=0):
+    """在 base 下为每个服务写入示例 config.json / banwords.txt（以及 poi.csv、私钥文件）。"""
+    rng = random.Random(seed)
+    banwords = {''.join(chr(rng.randint(CJK_START, CJK_END)) for _ in range(rng.randint(2, 6)))
+                for _ in range(banword_count)}
+    configs = {
+        'piaofutong': {'api_key': 'bench.key', 'knowledge_id': 'kb1', 'auth_keys': [AUTH_KEY]},
+        'shuziren': {'api_key': 'bench.key', 'auth_keys': [AUTH_KEY],
+                     'default': {'model': 'glm-4', 'default_prompt': '你是数字人导游。', 'knowledge_id': 'kb2'}},
+        'shimenguan': {'api_key': 'bench.key', 'knowledge_id': 'kb3', 'auth_keys': [AUTH_KEY], 'model': 'glm-4',
+                       'default_prompt': '你是导游。以下是正确的完整地点列表：重要别名对应：',
+                       'nav_prompt': '导航。这是可以作为目的地的完整地点列表。地点列表：重要别名对应：',
+                       'rejection_message': '对不起，我无法回答这个问题。', 'app_id': 'app'},
+        'coze': {'auth_keys': [AUTH_KEY], 'fast_bot_id': 'fast', 'nav_bot_id': 'nav',
+                 'rejection_message': '对不起，我无法回答这个问题。', 'private_key_file_path': 'private_key.pem',
+                 'public_key_id': 'pk', 'client_id': 'client'},
+    }
+    for name in SERVICES:
+        directory = os.path.join(base, name)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'config.json'), 'w', encoding='utf-8') as file:
+            json.dump(configs[name], file, ensure_ascii=False)
+        with open(os.path.join(directory, 'banwords.txt'), 'w', encoding='utf-8') as file:
+            file.write('\n'.join(sorted(banwords)))
+    with open(os.path.join(base, 'shimenguan', 'poi.csv'), 'w', encoding='utf-8') as file:
+        file.write('name,alias1,alias2\n东门,东大门,\n卫生间,厕所,洗手间\n游客中心,服务中心,\n')
+    with open(os.path.join(base, 'coze', 'private_key.pem'), 'w', encoding='utf-8') as file:
+        file.write('bench')
+
+
+def start_upstream(latency):
+    """模拟智谱的 /chat/completions（非流式），返回 (server, base_url)。"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+            body = json.dumps({
+                'id': 'bench', 'created': int(time.time()), 'model': 'glm-4',
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': '门票是100元。'}}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(target, port):
+    """子进程入口：target 为服务名（单独运行）或 gateway。"""
+    from werkzeug.serving import make_server
+    if target == 'gateway':
+        app = importlib.import_module('gateway').app
+    else:
+        app = importlib.import_module(f'{target}.main').app
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start_process(target, port, env):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', target, '--port', str(port)],
+                               env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{target} exited during startup (code {process.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    sys.exit(f"{target} did not start within 60 s")
+
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status', encoding='ascii') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def post(url, query):
+    request = urllib.request.Request(url, data=json.dumps({'query': query}).encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json', 'auth-key': f'Bearer {AUTH_KEY}'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+        return response.status
+
+
+def load_test(urls, requests, concurrency, seed):
+    rng = random.Random(seed)
+    # 每个问题带一个随机后缀，大部分请求会到达上游（模拟不重复的提问），少量重复问题命中缓存
+    work = [(rng.choice(urls), f"{rng.choice(QUERIES)}{rng.randint(0, requests // 2)}") for _ in range(requests)]
+    latencies = []
+    errors = 0
+
+    def one(item):
+        start = time.perf_counter()
+        status = post(*item)
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, status in executor.map(one, work):
+            latencies.append(latency)
+            errors += status != 200
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1], errors
+
+
+def run_mode(mode, base, upstream_url, args):
+    env = dict(os.environ, ZHIPUAI_BASE_URL=upstream_url, RELOAD_INTERVAL='0', PYTHONWARNINGS='ignore')
+    for name in SERVICES:
+        env[f'{name.upper()}_DATA_DIR'] = os.path.join(base, name)
+    processes = []
+    try:
+        if mode == 'separate':
+            urls = []
+            for name in SERVICES:
+                port = free_port()
+                processes.append(start_process(name, port, env))
+                if name in LOADED_SERVICES:
+                    urls.append(f'http://127.0.0.1:{port}/')
+        else:
+            port = free_port()
+            processes.append(start_process('gateway', port, env))
+            urls = [f'http://127.0.0.1:{port}/{name}/' for name in LOADED_SERVICES]
+        idle = sum(rss_mb(process.pid) for process in processes)
+        load_test(urls, min(200, args.requests), args.concurrency, args.seed + 1)  # 预热连接和代码路径
+        throughput, p50, p99, errors = load_test(urls, args.requests, args.concurrency, args.seed)
+        loaded = sum(rss_mb(process.pid) for process in processes)
+        return len(processes), idle, loaded, throughput, p50, p99, errors
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--upstream-latency', type=float, default=0.02, help='模拟上游每次调用的耗时（秒）')
+    parser.add_argument('--banwords', type=int, default=10000, help='敏感词表的词数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    upstream, upstream_url = start_upstream(args.upstream_latency)
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, args.banwords, args.seed)
+        print(f"requests={args.requests} concurrency={args.concurrency} upstream latency={args.upstream_latency}s "
+              f"banwords={args.banwords}")
+        print(f"\n{'mode':10}{'procs':>6}{'RSS idle':>11}{'RSS loaded':>12}{'req/s':>9}{'p50':>9}{'p99':>9}{'errors':>8}")
+        results = {}
+        for mode in ('separate', 'gateway'):
+            results[mode] = count, idle, loaded, throughput, p50, p99, errors = run_mode(mode, base, upstream_url, args)
+            print(f"{mode:10}{count:>6}{idle:>9.1f}MB{loaded:>10.1f}MB{throughput:>9.0f}"
+                  f"{p50 * 1000:>7.1f}ms{p99 * 1000:>7.1f}ms{errors:>8}")
+    upstream.shutdown()
+    separate, gateway = results['separate'], results['gateway']
+    print(f"\ngateway uses {gateway[2] / separate[2]:.0%} of the four-process RSS under load, "
+          f"throughput {gateway[3] / separate[3]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
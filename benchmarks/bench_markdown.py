@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""markdown 清理基准：原来的正则链与 common.markdown 的流式过滤器实现。
+
+1. 一致性：黄金语料（SAMPLES + EDGE_CASES）上 clean_markdown 的输出必须与原正则链完全相同，
+   否则直接报错退出；
+2. 整段清理：短回答、1~2KB 的长回答、病态输入（大量嵌套星号、未闭合的括号等）各自的耗时；
+3. 流式清理：把回答按 Coze 的增量大小（1~6 个字符）切成 chunk，比较对每个 chunk 单独跑正则链
+   （coze 原来的做法）与依次 feed 给同一个 MarkdownStripper 的每 chunk CPU 开销，
+   并统计逐 chunk 清理结果与整段清理结果不一致的回答数（跨 chunk 格式、chunk 间空格被吃掉）。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_markdown.py
+    python benchmarks/bench_markdown.py --rounds 200 --seed 1
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.markdown import MarkdownStripper, clean_markdown
+
+SAMPLES = [
+    "石门关景区的开放时间是**早上8:00到下午6:00**，请合理安排游览时间。",
+    "## 门票信息\n\n- **成人票**：120元\n- **儿童票**：60元（1.2米以下免票）\n- **老人票**：65岁以上凭身份证免票\n\n> 温馨提示：节假日需提前预约。",
+    "推荐您按以下路线游览：\n\n1. **游客中心**：领取导览图\n2. **石门关大峡谷**：步行约40分钟\n3. *观景台*：拍照打卡的好地方\n4. 最后乘坐__索道__下山。\n\n祝您游玩愉快！",
+    "| 项目 | 价格 |\n|---|---|\n| 索道单程 | 80元 |\n| 索道往返 | 150元 |\n\n以上价格仅供参考。",
+    "您可以查看[官方网站](https://example.com/shimenguan)了解更多信息，或拨打服务热线`0991-1234567`咨询。",
+    "### 交通指南\n\n***\n\n自驾：导航搜索“石门关景区”即可。\n\n公交：乘坐~~101路~~ 102路到终点站。\n\n---\n\n停车场位于东门，收费标准为10元/次。",
+    "The scenic area opens at **8:00 AM** and closes at *6:00 PM*. Tickets are available at the visitor center.",
+    "卫生间位于游客中心右侧约50米处，沿着指示牌走即可到达。",
+    "1. 首先\n2. 然后\n10. 最后\n\n2024年新开放了**玻璃栈道**，值得一去！",
+    "```\n这是一段不应该被朗读的代码\n```\n以上内容请忽略。![](https://example.com/map.png)请看地图。",
+]
+
+# 容易出错的格式组合，同样要求与原正则链输出一致
+EDGE_CASES = [
+    "***重要提示***：请勿攀爬护栏。",
+    "**1.** 门票\n**2.** 索道",
+    "# 标题\n## 子标题\n### 三级标题\n正文",
+    "#没有空格的标题\n#\n\n# \n内容",
+    "> 第一行引用\n> 第二行引用\n>> 嵌套引用",
+    "- 列表一\n+ 列表二\n* 列表三\n   - 缩进的子项",
+    "- - 双重列表\n-- 两个横线\n--- \n----\n- ---",
+    "1.第一项\n2. 第二项\n2024.10.1 国庆开放\n2024年",
+    "变量名 `snake_case_name` 和 __init__ 方法",
+    "~~原价200元~~ 现价150元，~单个波浪号~",
+    "```python\nprint('hello')\n```\n``````\n````四个反引号````\n```未闭合的代码块",
+    "[链接](http://example.com/a_b_c) 和 [空链接]() 以及 [](http://x) 和 [未闭合的链接",
+    "![](http://example.com/a.png) ![图片说明](http://example.com/b.png) !感叹号",
+    "| 景点 | 距离 |\n| :--- | ---: |\n| 东门 | 200米 |",
+    "**未闭合的粗体 和 *未闭合的斜体",
+    "   前后有空白\t\n\n\n  中间有多个换行   ",
+    "`a` `b` ``c`` 行内代码",
+    "Hello **world**! This is *English* text with `code`.",
+    "",
+    "\n\n\n",
+]
+
+# 整段清理的测试输入
+SHORT = SAMPLES[0]
+LONG = "\n\n".join(SAMPLES * 3)  # 约 2KB
+PATHOLOGICAL = {
+    'nested asterisks': "***a**b*c" * 300,
+    'unclosed brackets': "[" * 2000,
+    'unclosed images': "![" * 2000,
+    'unclosed links': "[a](" * 1000,
+    'many lines': "\n# - 1. > x" * 300,
+}
+
+
+def legacy_clean_markdown(text):
+    """coze/main.py 中原来的正则链实现。"""
+    if not isinstance(text, str):
+        return text
+    text = re.sub(r'^#+\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
+    text = re.sub(r'__([^_]+)__', r'\1', text)
+    text = re.sub(r'\*([^*]+)\*', r'\1', text)
+    text = re.sub(r'_([^_]+)_', r'\1', text)
+    text = re.sub(r'\*+', '', text)
+    text = re.sub(r'_+', '', text)
+    text = re.sub(r'~~([^~]+)~~', r'\1', text)
+    text = re.sub(r'~+', '', text)
+    text = re.sub(r'```[^`]*```', '', text, flags=re.DOTALL)
+    text = re.sub(r'`([^`]+)`', r'\1', text)
+    text = re.sub(r'`+', '', text)
+    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
+    text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', text)
+    text = re.sub(r'^>\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[-+*]\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^\d+\.\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\|', ' ', text)
+    text = re.sub(r'^[-*]{3,}\s*$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\s+', ' ', text)
+    text = text.strip()
+    return text
+
+
+def split_deltas(text, rng):
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = SAMPLES + EDGE_CASES
+    for text in corpus:
+        expected = legacy_clean_markdown(text)
+        actual = clean_markdown(text)
+        if actual != expected:
+            sys.exit(f"output mismatch for {text!r}:\n  regex chain: {expected!r}\n  filters: {actual!r}")
+    print(f"golden corpus: {len(corpus)} inputs, output identical to the regex chain")
+
+    print(f"\n{'full text':<22}{'chars':>7}{'regex chain':>14}{'filters':>14}{'speedup':>9}")
+    cases = [('short', SHORT), ('long', LONG)] + list(PATHOLOGICAL.items())
+    for name, text in cases:
+        repeat = max(1, 20000 // len(text))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            legacy_clean_markdown(text)
+        legacy_us = (time.perf_counter() - start) / repeat * 1e6
+        start = time.perf_counter()
+        for _ in range(repeat):
+            clean_markdown(text)
+        single_us = (time.perf_counter() - start) / repeat * 1e6
+        print(f"{name:<22}{len(text):>7}{legacy_us:>12.1f}us{single_us:>12.1f}us{legacy_us / single_us:>8.1f}x")
+
+    rng = random.Random(args.seed)
+    streams = [split_deltas(sample, rng) for sample in SAMPLES for _ in range(args.rounds)]
+    total_chunks = sum(len(chunks) for chunks in streams)
+
+    start = time.perf_counter()
+    for chunks in streams:
+        for chunk in chunks:
+            legacy_clean_markdown(chunk)
+    legacy_us = (time.perf_counter() - start) / total_chunks * 1e6
+
+    start = time.perf_counter()
+    for chunks in streams:
+        stripper = MarkdownStripper()
+        for chunk in chunks:
+            stripper.feed(chunk)
+        stripper.flush()
+    stripper_us = (time.perf_counter() - start) / total_chunks * 1e6
+
+    # 正确性：流式输出应与整段清理一致
+    legacy_broken = stripper_broken = 0
+    for chunks in streams:
+        expected = legacy_clean_markdown(''.join(chunks))
+        if ''.join(legacy_clean_markdown(chunk) for chunk in chunks) != expected:
+            legacy_broken += 1
+        stripper = MarkdownStripper()
+        streamed = ''.join(stripper.feed(chunk) for chunk in chunks) + stripper.flush()
+        if streamed != expected:
+            stripper_broken += 1
+
+    print(f"\nstreaming: chunks={total_chunks} (avg {sum(len(s) for s in SAMPLES) * args.rounds / total_chunks:.1f} chars)")
+    print(f"regex chain per chunk   {legacy_us:7.2f}us   streams differing from full-text clean: "
+          f"{legacy_broken}/{len(streams)}")
+    print(f"MarkdownStripper.feed   {stripper_us:7.2f}us   streams differing from full-text clean: "
+          f"{stripper_broken}/{len(streams)}")
+    print(f"speedup {legacy_us / stripper_us:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
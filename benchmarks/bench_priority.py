@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""上游名额的优先级调度（common.admission）：上游被长回答占满时 /nav 的延迟。
+
+在本地启动模拟的上游，并模拟上游的并发配额（同时最多处理 --capacity 个调用，超出的按先来后到排队），
+服务端的上游并发上限也设为 --capacity，持续保持饱和的混合负载 --duration 秒：
+    - shimenguan（ASGI 服务，单个 uvicorn worker，模拟智谱接口）：--streams 个客户端不停地发流式 /（每条流
+      --chunks x --interval 秒），--chats 个客户端不停地发非流式 /，--navs 台讲解机每隔 --think 秒发一次需要大模型判断的 /nav；
+    - coze（Flask 多线程服务，模拟 Coze 开放接口，与 bench_coze_nav.py 相同）：--streams 个客户端不停地发 /（快速回答 bot 的流），
+      --navs 台讲解机发 /nav（导航 bot）。
+每个客户端使用自己的 key，问题各不相同并带 no_cache，不命中缓存、也不会被合并。分别以三种方式运行：
+    - fifo：所有调用同一个优先级（config.json 的 admission.priorities 把各接口都设为 stream），不预留名额；
+    - priority：默认的优先级（nav > chat > stream），不预留名额（ADMISSION_RESERVED=0）；
+    - reserved：默认的优先级，再预留 --reserved 个名额只给导航判断。
+统计 /nav 的延迟 p50 / p99，非流式回答的延迟 p99，流式回答的首片段延迟 p99（低优先级没有被饿死），
+以及服务端 /stats 中因为排队太久被提前的调用数（aged）。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_priority.py
+    python benchmarks/bench_priority.py --services shimenguan --capacity 8 --streams 40 --navs 8 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_async import StubUpstream
+from bench_async import start_process as start_asgi
+from bench_coze_nav import StubState, make_handler
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+
+MODES = ('fifo', 'priority', 'reserved')
+NAV_ANSWER = '{"NEEDNAV":"N","POI":"NONE"}'
+
+
+class QuotaUpstream(StubUpstream):
+    """同时最多处理 capacity 个调用的模拟智谱接口：流式调用返回一条流，非流式调用 latency 秒后返回导航判断。"""
+
+    def __init__(self, chunks, interval, latency, capacity):
+        self.latency = latency
+        self.quota = asyncio.Semaphore(capacity)
+        super().__init__(chunks, interval)
+
+    async def _respond(self, body, writer):
+        async with self.quota:
+            if json.loads(body).get('stream'):
+                await super()._respond(body, writer)
+                return
+            await asyncio.sleep(self.latency)
+            reply = json.dumps({
+                'id': 'bench', 'created': 0, 'model': 'glm-4',
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': NAV_ANSWER}}],
+            }).encode('utf-8')
+            writer.write(f'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(reply)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode('ascii') + reply)
+            await writer.drain()
+
+
+def start_coze_upstream(capacity, follow_up):
+    """模拟 Coze 开放接口（bench_coze_nav.py），同时最多处理 capacity 轮对话；返回 base_url。"""
+    quota = threading.BoundedSemaphore(capacity)
+    # 每轮对话 0.3~1.5 秒生成回答，之后 follow_up 秒推送推荐问题（导航判断拿到回答就返回，快速回答的流要等到对话结束）
+    base = make_handler(StubState(0.3, 1.5, follow_up, 0))
+
+    class Handler(base):
+        def do_POST(self):
+            with quota:
+                super().do_POST()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def serve_coze(port, coze_url):
+    """子进程入口：coze 服务连到模拟的 Coze 开放接口（跳过 JWT 鉴权）。"""
+    from cozepy import Coze, TokenAuth
+    from werkzeug.serving import make_server
+    from coze import main as service
+    service.SETTINGS.current.coze_client = Coze(auth=TokenAuth('bench'), base_url=coze_url)
+    make_server('127.0.0.1', port, service.app, threaded=True).serve_forever()
+
+
+def start_coze(port, env, coze_url):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve-coze', coze_url, '--port', str(port)],
+                               env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"coze exited during startup (code {process.returncode})")
+        try:
+            stats(port)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit("coze did not start within 60 s")
+
+
+def stats(port):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/stats', headers={'auth-key': f'Bearer {AUTH_KEY}'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+async def call(port, path, key, payload):
+    """发起一个请求并读完，返回 (状态码, 首片段延迟, 总延迟)。"""
+    body = json.dumps(dict(payload, no_cache=True)).encode('utf-8')
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'auth-key: Bearer {key}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                     .encode('ascii') + body)
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        status = int(head.split()[1])
+        await reader.read(1)
+        first = time.perf_counter() - start
+        while await reader.read(65536):
+            pass
+        return status, first, time.perf_counter() - start
+    finally:
+        writer.close()
+
+
+async def run_load(port, args, chats):
+    deadline = time.perf_counter() + args.duration
+    latency = {'nav': [], 'chat': [], 'stream': []}
+    errors = 0
+
+    async def client(kind, k, path, stream, think):
+        nonlocal errors
+        i = 0
+        while time.perf_counter() < deadline:
+            i += 1
+            # 导航判断的问题要让大模型回答（不含地点名称，本地解析不了）
+            query = f'第{k}个客户端的第{i}个问题：附近有什么好吃的' if kind == 'nav' else f'第{k}个客户端的第{i}个问题'
+            status, first, total = await call(port, path, f'{kind}{k}', {'query': query, 'stream': stream})
+            if status == 200:
+                latency[kind].append(first if stream else total)
+            else:
+                errors += 1
+            await asyncio.sleep(think)
+
+    await asyncio.gather(*(client('stream', k, '/', True, 0) for k in range(args.streams)),
+                         *(client('chat', k, '/', False, 0) for k in range(chats)),
+                         *(client('nav', k, '/nav', False, args.think) for k in range(args.navs)))
+    return {kind: sorted(values) for kind, values in latency.items()}, errors
+
+
+def percentile(values, p):
+    return values[max(0, int(len(values) * p) - 1)] if values else float('nan')
+
+
+def write_config(directory, args, mode):
+    path = os.path.join(directory, 'config.json')
+    with open(path, encoding='utf-8') as file:
+        config = json.load(file)
+    config['auth_keys'] = [AUTH_KEY] + [f'{kind}{k}' for kind, count in
+                                        (('stream', args.streams), ('chat', args.chats), ('nav', args.navs))
+                                        for k in range(count)]
+    config.pop('admission', None)
+    if mode == 'fifo':
+        config['admission'] = {'priorities': {'/': 'stream', '/nav': 'stream'}}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(config, file, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', nargs='+', default=['shimenguan', 'coze'], choices=['shimenguan', 'coze'])
+    parser.add_argument('--capacity', type=int, default=8, help='上游同时处理的调用数（模拟的配额）')
+    parser.add_argument('--reserved', type=int, default=2, help='reserved 中只给导航判断的名额数')
+    parser.add_argument('--streams', type=int, default=24, help='不停发流式请求的客户端数')
+    parser.add_argument('--chats', type=int, default=4, help='不停发非流式请求的客户端数（只有 shimenguan）')
+    parser.add_argument('--navs', type=int, default=4, help='讲解机数')
+    parser.add_argument('--think', type=float, default=1.0, help='讲解机两次 /nav 之间的间隔（秒）')
+    parser.add_argument('--chunks', type=int, default=20, help='每条智谱上游流的片段数')
+    parser.add_argument('--interval', type=float, default=0.1, help='智谱上游流片段之间的间隔（秒）')
+    parser.add_argument('--latency', type=float, default=0.2, help='智谱非流式调用的耗时（秒）')
+    parser.add_argument('--duration', type=float, default=20.0, help='每种方式的压测时长（秒）')
+    parser.add_argument('--serve-coze', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_coze:
+        serve_coze(args.port, args.serve_coze)
+        return
+
+    print(f"upstream quota = {args.capacity} calls, load = {args.streams} streaming + {args.chats} non-stream clients "
+          f"+ {args.navs} kiosks (/nav every {args.think}s), {args.duration:.0f}s per mode")
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        zhipuai = QuotaUpstream(args.chunks, args.interval, args.latency, args.capacity)
+        coze_url = start_coze_upstream(args.capacity, 0.5) if 'coze' in args.services else None
+        for name in args.services:
+            chats = args.chats if name == 'shimenguan' else 0
+            print(f"\n{name}\n{'mode':10}{'nav p50':>10}{'nav p99':>10}{'chat p99':>10}{'stream p99':>12}"
+                  f"{'navs':>7}{'errors':>8}{'aged':>6}")
+            for mode in MODES:
+                write_config(os.path.join(base, name), args, mode)
+                env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{zhipuai.port}', RELOAD_INTERVAL='0',
+                           PYTHONWARNINGS='ignore', ADMISSION_MAX_CONCURRENT=str(args.capacity),
+                           ADMISSION_QUEUE_SIZE='1000', ADMISSION_MAX_WAIT='60',
+                           ADMISSION_RESERVED=str(args.reserved) if mode == 'reserved' else '0')
+                env[f'{name.upper()}_DATA_DIR'] = os.path.join(base, name)
+                port = free_port()
+                process = start_asgi('asgi', port, env) if name == 'shimenguan' else start_coze(port, env, coze_url)
+                try:
+                    latency, errors = asyncio.run(run_load(port, args, chats))
+                    upstream = stats(port)['admission']['upstreams']['zhipuai' if name == 'shimenguan' else 'coze']
+                finally:
+                    process.terminate()
+                    process.wait()
+                aged = sum(priority['aged'] for priority in upstream['priorities'].values())
+                chat = f"{percentile(latency['chat'], 0.99) * 1000:>8.0f}ms" if chats else f"{'-':>10}"
+                print(f"{mode:10}{percentile(latency['nav'], 0.5) * 1000:>8.0f}ms"
+                      f"{percentile(latency['nav'], 0.99) * 1000:>8.0f}ms{chat}"
+                      f"{percentile(latency['stream'], 0.99) * 1000:>10.0f}ms{len(latency['nav']):>7}{errors:>8}{aged:>6}")
+
+
+if __name__ == '__main__':
+    main()
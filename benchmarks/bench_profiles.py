@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""shuziren 每个请求准备上游参数的开销：原来按字典逐请求构造 vs. 加载时编译好的 ProfilePlan。
+
+两种方式都产出同样的 messages、tools 和缓存键：
+    - before：按名字查 profile 字典，构造系统消息、带检索模板的 tools 列表，make_cache_key 对系统提示词求哈希；
+    - after：与 shuziren 现在的做法相同，ProfileRegistry.get 取出 ProfilePlan，messages 只复制预先构造的系统消息并填入用户消息，
+      tools 为共享只读结构外面套一层 list，缓存键使用预先算好的提示词哈希。
+用 tracemalloc 统计每个请求新分配的字节数和块数，用 perf_counter 统计每个请求的耗时。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_profiles.py
+    python benchmarks/bench_profiles.py --requests 50000 --prompt-chars 4000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.cache import make_cache_key
+from common.profiles import ProfileRegistry
+
+RETRIEVAL_PROMPT_TEMPLATE = (
+    "从你的知识库\n\"\"\"\n{{knowledge}}\n\"\"\"\n中找问题\n\"\"\"\n{{question}}\n\"\"\"\n的答案，并参考知识库进行回答，"
+    "不要让用户知道有知识库的存在。知识库里找不到答案，就直接用自身知识回答。\n不要复述问题，直接开始回答。"
+)
+QUERIES = ["门票多少钱", "景区几点开门", "厕所在哪里", "讲一下石门关的历史", "有什么好玩的推荐", "今天人多吗"]
+
+
+def make_configs(profiles, prompt_chars):
+    configs = {'auth_keys': ['key'], 'api_key': 'id.secret'}
+    for i in range(profiles):
+        configs[f'profile{i}'] = {
+            'model': 'glm-4',
+            'default_prompt': ('你是景区的数字人导游，回答要简洁。' * prompt_chars)[:prompt_chars],
+            'knowledge_id': f'kb{i}',
+        }
+    return configs
+
+
+def before(configs, name, query):
+    """修改前 shuziren 每个请求的做法。"""
+    config = configs[name] if name in configs else None
+    model = config['model']
+    messages = [
+        {"role": "system", "content": config['default_prompt']},
+        {"role": "user", "content": query}
+    ]
+    tools_list = [
+        {
+            "type": "retrieval",
+            "retrieval": {
+                "knowledge_id": config['knowledge_id'],
+                "prompt_template": RETRIEVAL_PROMPT_TEMPLATE,
+            }
+        }
+    ]
+    cache_key = make_cache_key(name, model, config['default_prompt'], config['knowledge_id'], query)
+    return messages, tools_list, cache_key
+
+
+def after(registry, name, query):
+    """shuziren 现在每个请求的做法。"""
+    plan = registry.get(name)
+    return plan.messages(query), list(plan.tools), plan.cache_key(query, plan.model)
+
+
+def measure(prepare, source, names, requests):
+    """返回 (每个请求的耗时 µs, 每个请求分配的字节数, 每个请求分配的块数)。"""
+    work = [(names[i % len(names)], QUERIES[i % len(QUERIES)]) for i in range(requests)]
+    start = time.perf_counter()
+    for name, query in work:
+        prepare(source, name, query)
+    elapsed = time.perf_counter() - start
+
+    # 分配统计单独跑一遍（tracemalloc 本身会拖慢执行），保留结果避免被立即回收
+    kept = []
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for name, query in work:
+        kept.append(prepare(source, name, query))
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    diff = snapshot_after.compare_to(snapshot_before, 'filename')
+    size = sum(stat.size_diff for stat in diff)
+    blocks = sum(stat.count_diff for stat in diff)
+    # 减去保存结果的列表本身
+    size -= sys.getsizeof(kept)
+    return elapsed / requests * 1e6, size / requests, blocks / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--profiles', type=int, default=4)
+    parser.add_argument('--prompt-chars', type=int, default=1500, help='系统提示词长度（字符）')
+    args = parser.parse_args()
+
+    configs = make_configs(args.profiles, args.prompt_chars)
+    registry = ProfileRegistry(configs, lambda api_key: object(), RETRIEVAL_PROMPT_TEMPLATE)
+    names = registry.names()
+    for name in names:
+        for query in QUERIES:
+            assert before(configs, name, query) == after(registry, name, query)
+
+    print(f"requests={args.requests} profiles={args.profiles} prompt={args.prompt_chars} chars")
+    print(f"\n{'':8}{'time/req':>12}{'bytes/req':>12}{'blocks/req':>12}")
+    results = {}
+    for label, prepare, source in (('before', before, configs), ('after', after, registry)):
+        results[label] = measure(prepare, source, names, args.requests)
+        us, size, blocks = results[label]
+        print(f"{label:8}{us:>10.2f}µs{size:>12.0f}{blocks:>12.1f}")
+    (us_before, size_before, _), (us_after, size_after, _) = results['before'], results['after']
+    print(f"\nspeedup {us_before / us_after:.2f}x, allocated bytes per request -{1 - size_after / size_before:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""逐句输出（stream_mode: "sentence"）与原始 delta 输出的首句延迟对比。
+
+在本地启动模拟的智谱流式接口，把一段典型的讲解回答按 1~3 个字切成 delta，每 --interval 秒输出一个；
+以多线程 Flask 方式启动 piaofutong 服务并连到它，分别用两种方式请求 --requests 次（问题各不相同，不命中缓存）：
+    - raw：统计收到第一个字节的时间，以及客户端自己攒字、直到出现第一个句末标点（。！？）的时间，
+      即 TTS 客户端原来能开始合成第一句的时间；
+    - sentence：统计收到第一个 SSE 事件（第一个完整子句）的时间。
+同时统计 sentence 模式下每个回答的事件数和平均子句长度。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_sentence.py
+    python benchmarks/bench_sentence.py --requests 50 --interval 0.03
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_async import StubUpstream
+from bench_cancel import start_process
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+
+ANSWER = ('石门关景区位于湖北省恩施市，是国家4A级旅游景区，以峡谷、溶洞和土家族文化闻名。'
+          '景区门票成人60元，儿童和65岁以上老人免票；开放时间为每天8:30到17:30。'
+          '从东门进入后，沿栈道步行约20分钟可以到达观景台，天气好的时候能看到整条峡谷。'
+          '如果您带着小朋友，建议先去游客中心领取导览图，那里也可以租借儿童推车。'
+          '需要我带您去游客中心吗？')
+SENTENCE_END = tuple(mark.encode('utf-8') for mark in '。！？')
+
+
+def split_deltas(text, seed):
+    rng = random.Random(seed)
+    pieces = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 3)
+        pieces.append(text[i:i + size])
+        i += size
+    return pieces
+
+
+def dechunk(body):
+    """解码 chunked 编码的响应体。"""
+    out = b''
+    while body:
+        size, _, body = body.partition(b'\r\n')
+        size = int(size, 16)
+        if not size:
+            break
+        out += body[:size]
+        body = body[size + 2:]
+    return out
+
+
+def request(port, query, mode):
+    """发起一条流式请求，返回 (首字节时间, 首句时间, 响应体)。"""
+    payload = {'query': query, 'stream': True}
+    if mode == 'sentence':
+        payload['stream_mode'] = 'sentence'
+    body = json.dumps(payload).encode('utf-8')
+    start = time.perf_counter()
+    first_byte = first_sentence = None
+    with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+        sock.sendall(f'POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'auth-key: Bearer {AUTH_KEY}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                     .encode('ascii') + body)
+        received = b''
+        header_end = None
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            received += data
+            if header_end is None:
+                header_end = received.find(b'\r\n\r\n')
+                if header_end < 0:
+                    header_end = None
+                    continue
+                header_end += 4
+            content = received[header_end:]
+            if content and first_byte is None:
+                first_byte = time.perf_counter() - start
+            if first_sentence is None:
+                # raw 模式要等第一个句末标点；sentence 模式下第一个完整事件就是第一句
+                if (b'\n\n' in content if mode == 'sentence' else any(mark in content for mark in SENTENCE_END)):
+                    first_sentence = time.perf_counter() - start
+    return first_byte, first_sentence, received[header_end:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.04, help='上游 delta 之间的间隔（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pieces = split_deltas(ANSWER, args.seed)
+    upstream = StubUpstream(len(pieces), args.interval, pieces)
+    print(f"answer = {len(ANSWER)} chars in {len(pieces)} deltas x {args.interval}s = "
+          f"{len(pieces) * args.interval:.1f}s, {args.requests} requests per mode")
+    results = {}
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{upstream.port}', RELOAD_INTERVAL='0',
+                   PIAOFUTONG_DATA_DIR=os.path.join(base, 'piaofutong'), PYTHONWARNINGS='ignore')
+        port = free_port()
+        process = start_process(port, env)
+        try:
+            for mode in ('raw', 'sentence'):
+                results[mode] = [request(port, f'{mode}问题{i}', mode) for i in range(args.requests)]
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"\n{'mode':10}{'first byte p50':>16}{'first sentence p50':>20}{'p90':>9}")
+    for mode, rows in results.items():
+        first_bytes = sorted(row[0] for row in rows)
+        first_sentences = sorted(row[1] for row in rows)
+        print(f"{mode:10}{statistics.median(first_bytes) * 1000:>14.0f}ms"
+              f"{statistics.median(first_sentences) * 1000:>18.0f}ms"
+              f"{first_sentences[int(len(first_sentences) * 0.9) - 1] * 1000:>7.0f}ms")
+    events = dechunk(results['sentence'][0][2]).decode('utf-8').split('\n\n')
+    clauses = ['\n'.join(line[6:] for line in event.split('\n')) for event in events if event]
+    print(f"\nsentence mode: {len(clauses)} events per answer, "
+          f"{statistics.mean(len(clause) for clause in clauses):.1f} chars per clause")
+    print('first clauses: ' + ' | '.join(clauses[:3]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""近似问题缓存（MinHash + LSH）基准：在 N 条缓存下测量插入和查找耗时以及命中情况。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_similarity.py
+    python benchmarks/bench_similarity.py --entries 100000 --lookups 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.similarity import SimilarityCache
+
+SUBJECTS = ['卫生间', '游客中心', '停车场', '东门', '西门', '售票处', '餐厅', '索道', '观景台', '医务室',
+            '寄存处', '码头', '博物馆', '古塔', '湖心亭', '儿童乐园', '商店', '北门', '南门', '充电桩']
+TEMPLATES = ['{}在哪', '{}在哪里', '请问{}怎么走', '{}几点开门', '{}要收费吗', '去{}要多久',
+             '{}离这里远吗', '带我去{}', '{}有什么好玩的', '{}附近有吃的吗']
+CJK_START, CJK_END = 0x4E00, 0x9FA5
+
+
+def random_question(rng):
+    return ''.join(chr(rng.randint(CJK_START, CJK_END)) for _ in range(rng.randint(6, 20)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cache = SimilarityCache(max_size=args.entries)
+    context = ('default', 'glm-4')
+
+    # 先放入景区常见问题，再用随机问题把缓存填满
+    faq = [template.format(subject) for subject in SUBJECTS for template in TEMPLATES]
+    start = time.perf_counter()
+    for question in faq:
+        cache.add(context, question, f'answer:{question}')
+    for _ in range(args.entries - len(faq)):
+        cache.add(context, random_question(rng), 'random')
+    insert_us = (time.perf_counter() - start) / args.entries * 1e6
+
+    # 近似问法（加口头语/标点/改写尾字）和完全无关的问题各占一半
+    variants = []
+    for _ in range(args.lookups // 2):
+        question = rng.choice(faq)
+        variants.append(rng.choice(['请问', '你好，', '']) + question + rng.choice(['？', '呢', '啊', '']))
+    unrelated = [random_question(rng) for _ in range(args.lookups - len(variants))]
+
+    latencies = []
+    hits = 0
+    for question in variants + unrelated:
+        start = time.perf_counter()
+        match = cache.lookup(context, question)
+        latencies.append(time.perf_counter() - start)
+        if match is not None and match.value != 'random':
+            hits += 1
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6
+
+    print(f"entries={len(cache)} insert={insert_us:.1f}us/entry")
+    print(f"lookup p50={pct(0.5):.1f}us p99={pct(0.99):.1f}us max={latencies[-1] * 1e6:.1f}us")
+    print(f"near-duplicate hit rate={hits / len(variants):.2%} "
+          f"(unrelated false hits={sum(1 for q in unrelated if cache.lookup(context, q))})")
+
+
+if __name__ == '__main__':
+    main()
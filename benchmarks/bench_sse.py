@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""流式响应合并写出（common.sse）前后的 send 系统调用数和传输字节数。
+
+在本地启动模拟的智谱流式接口，把一段讲解回答按 1~3 个字切成 delta，每 --interval 秒输出一个；
+以多线程 Flask 方式启动 piaofutong 服务（子进程中统计服务端写 socket 的次数和字节数），
+用 --concurrency 个并发客户端各发 --requests 条流式请求，对比：
+    - raw, window=0：每个 delta 到达就单独写出，与原来逐个 delta 写出相同；
+    - raw：默认 30ms 窗口合并写出；
+    - sse：合并后按 SSE 的 data: 事件写出；
+    - sentence：逐句的 SSE 事件。
+每种方式统计每个回答的 send 次数、线上字节数（含分块编码）和首字节时间。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_sse.py
+    python benchmarks/bench_sse.py --requests 100 --concurrency 20 --interval 0.01
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_async import StubUpstream
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+from bench_sentence import ANSWER, split_deltas
+
+CONFIGS = (('raw, window=0', 'raw', '0'), ('raw', 'raw', None), ('sse', 'sse', None), ('sentence', 'sentence', None))
+
+
+def serve(port, counts_file):
+    """子进程入口：统计服务端写 socket 的次数和字节数，退出时写入 counts_file。"""
+    import socketserver
+    from werkzeug.serving import make_server
+    from piaofutong.main import app
+    counts = {'sends': 0, 'bytes': 0}
+    write = socketserver._SocketWriter.write
+
+    def counting_write(self, data):
+        counts['sends'] += 1
+        counts['bytes'] += len(data)
+        return write(self, data)
+
+    def report(*args):
+        with open(counts_file, 'w', encoding='utf-8') as file:
+            json.dump(counts, file)
+        os._exit(0)
+
+    socketserver._SocketWriter.write = counting_write
+    signal.signal(signal.SIGTERM, report)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start_process(port, env, counts_file):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+                                '--counts-file', counts_file],
+                               env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"piaofutong exited during startup (code {process.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    sys.exit("piaofutong did not start within 60 s")
+
+
+def request(port, query, mode):
+    """发起一条流式请求，返回 (首字节时间, 响应体字节数)。"""
+    body = json.dumps({'query': query, 'stream': True, 'stream_mode': mode}).encode('utf-8')
+    start = time.perf_counter()
+    first_byte = None
+    received = b''
+    with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+        sock.sendall(f'POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'auth-key: Bearer {AUTH_KEY}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                     .encode('ascii') + body)
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            received += data
+            if first_byte is None and b'\r\n\r\n' in received and not received.endswith(b'\r\n\r\n'):
+                first_byte = time.perf_counter() - start
+    return first_byte, len(received) - received.index(b'\r\n\r\n') - 4
+
+
+def run(label, mode, window, base, upstream, args):
+    env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{upstream.port}', RELOAD_INTERVAL='0',
+               PIAOFUTONG_DATA_DIR=os.path.join(base, 'piaofutong'), PYTHONWARNINGS='ignore')
+    if window is not None:
+        env['SSE_COALESCE_WINDOW'] = window
+    port = free_port()
+    counts_file = os.path.join(base, 'counts.json')
+    process = start_process(port, env, counts_file)
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            rows = list(executor.map(lambda i: request(port, f'{label}问题{i}', mode), range(args.requests)))
+    finally:
+        process.terminate()
+        process.wait()
+    with open(counts_file, encoding='utf-8') as file:
+        counts = json.load(file)
+    first_bytes = sorted(row[0] for row in rows)
+    return (counts['sends'] / args.requests, sum(row[1] for row in rows) / args.requests,
+            first_bytes[len(first_bytes) // 2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.01, help='上游 delta 之间的间隔（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--counts-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.counts_file)
+        return
+
+    pieces = split_deltas(ANSWER, args.seed)
+    upstream = StubUpstream(len(pieces), args.interval, pieces)
+    print(f"answer = {len(ANSWER)} chars in {len(pieces)} deltas x {args.interval}s, "
+          f"{args.requests} requests x {args.concurrency} concurrent per mode")
+    print(f"\n{'mode':16}{'sends/answer':>14}{'bytes/answer':>14}{'first byte p50':>16}")
+    results = {}
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        for label, mode, window in CONFIGS:
+            results[label] = sends, size, first_byte = run(label, mode, window, base, upstream, args)
+            print(f"{label:16}{sends:>14.1f}{size:>14.0f}{first_byte * 1000:>14.0f}ms")
+    before, after = results['raw, window=0'], results['raw']
+    print(f"\nraw coalescing: {1 - after[0] / before[0]:.0%} fewer sends, {1 - after[1] / before[1]:.0%} fewer bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""讲解机每轮对话的开销：每次一个 HTTP 请求 vs. WebSocket 长连接通道（shimenguan/asgi.py 的 /ws）。
+
+在本地启动模拟的智谱流式接口和 shimenguan 的 ASGI 服务（单个 uvicorn worker），--kiosks 台讲解机并发，
+每台连续进行 --turns 轮对话，每轮先发 /nav（"带我去东门"，本地解析，不经过大模型，测的就是每轮的固定开销），
+再发一条流式的 / 请求（问题各不相同，不命中缓存）。对比三种客户端：
+    - http：每个请求新建一个 TCP 连接，带 auth-key 请求头（讲解机原来的方式）；
+    - keep-alive：每台讲解机复用一个 HTTP/1.1 连接，每个请求仍带完整的请求头；
+    - ws：每台讲解机一条 WebSocket 连接，鉴权一次，请求和回答都是带请求 ID 的 JSON 消息。
+统计 /nav 的延迟 p50 / p99、流式回答的首片段延迟 p50，以及服务进程每轮消耗的 CPU 时间（读取 /proc，仅支持 Linux）。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_ws.py
+    python benchmarks/bench_ws.py --kiosks 50 --turns 40 --chunks 10 --interval 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_async import StubUpstream, start_process
+from bench_gateway import AUTH_KEY, free_port, write_fixtures
+
+NAV_QUERY = '带我去东门'
+
+
+def cpu_seconds(pid):
+    """服务进程累计的用户态 + 内核态 CPU 时间。"""
+    with open(f'/proc/{pid}/stat', encoding='ascii') as file:
+        fields = file.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class HttpKiosk:
+    """最简单的 HTTP/1.1 客户端；keep_alive 为 False 时每个请求新建连接。"""
+
+    def __init__(self, port, keep_alive):
+        self.port = port
+        self.keep_alive = keep_alive
+        self.reader = self.writer = None
+
+    async def request(self, path, payload, first_chunk=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        body = json.dumps(payload).encode('utf-8')
+        connection = 'keep-alive' if self.keep_alive else 'close'
+        self.writer.write(f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                          f'auth-key: Bearer {AUTH_KEY}\r\nContent-Length: {len(body)}\r\nConnection: {connection}\r\n\r\n'
+                          .encode('ascii') + body)
+        await self.writer.drain()
+        head = (await self.reader.readuntil(b'\r\n\r\n')).lower()
+        if not head.startswith(b'http/1.1 200'):
+            raise RuntimeError(head.split(b'\r\n', 1)[0].decode('ascii', 'replace'))
+        received = b''
+        if b'transfer-encoding: chunked' in head:
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).strip(), 16)
+                received += await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                if first_chunk is not None:
+                    first_chunk()
+                    first_chunk = None
+        else:
+            length = int(head.split(b'content-length:')[1].split(b'\r\n')[0])
+            received = await self.reader.readexactly(length)
+        if not self.keep_alive:
+            await self.close()
+        return received
+
+    async def nav(self, i):
+        return await self.request('/nav', {'query': NAV_QUERY})
+
+    async def stream(self, query, first_chunk):
+        await self.request('/', {'query': query, 'stream': True}, first_chunk)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class WsKiosk:
+    """WebSocket 通道的客户端：一条连接，请求按 ID 分发回答。"""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+        self.waiters = {}
+        self.next_id = 0
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+        self.connection = await connect(f'ws://127.0.0.1:{self.port}/ws',
+                                        additional_headers={'auth-key': f'Bearer {AUTH_KEY}'})
+        if json.loads(await self.connection.recv()).get('type') != 'ready':
+            raise RuntimeError('authentication failed')
+        self.reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        async for text in self.connection:
+            message = json.loads(text)
+            self.waiters[message['id']].put_nowait(message)
+
+    async def request(self, path, payload):
+        self.next_id += 1
+        request_id = str(self.next_id)
+        self.waiters[request_id] = messages = asyncio.Queue()
+        await self.connection.send(json.dumps(dict(payload, id=request_id, path=path)))
+        return request_id, messages
+
+    async def nav(self, i):
+        request_id, messages = await self.request('/nav', {'query': NAV_QUERY})
+        message = await messages.get()
+        del self.waiters[request_id]
+        if message['type'] != 'result':
+            raise RuntimeError(message.get('detail'))
+        return message['data']
+
+    async def stream(self, query, first_chunk):
+        request_id, messages = await self.request('/', {'query': query, 'stream': True})
+        while True:
+            message = await messages.get()
+            if message['type'] == 'delta' and first_chunk is not None:
+                first_chunk()
+                first_chunk = None
+            elif message['type'] == 'error':
+                raise RuntimeError(message.get('detail'))
+            elif message['type'] == 'end':
+                break
+        del self.waiters[request_id]
+
+    async def close(self):
+        self.reader.cancel()
+        await self.connection.close()
+
+
+async def kiosk(client, k, turns, nav_latency, first_chunk_latency):
+    if isinstance(client, WsKiosk):
+        await client.connect()
+    try:
+        for i in range(turns):
+            start = time.perf_counter()
+            await client.nav(i)
+            nav_latency.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await client.stream(f'第{k}台讲解机的第{i}个问题',
+                                lambda: first_chunk_latency.append(time.perf_counter() - start))
+    finally:
+        await client.close()
+
+
+async def run_load(mode, port, kiosks, turns):
+    clients = [WsKiosk(port) if mode == 'ws' else HttpKiosk(port, mode == 'keep-alive') for _ in range(kiosks)]
+    nav_latency, first_chunk_latency = [], []
+    await asyncio.gather(*(kiosk(client, k, turns, nav_latency, first_chunk_latency)
+                           for k, client in enumerate(clients)))
+    return sorted(nav_latency), sorted(first_chunk_latency)
+
+
+def percentile(values, p):
+    return values[max(0, int(len(values) * p) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kiosks', type=int, default=20, help='并发的讲解机数')
+    parser.add_argument('--turns', type=int, default=25, help='每台讲解机的对话轮数')
+    parser.add_argument('--chunks', type=int, default=10, help='每条上游流的片段数')
+    parser.add_argument('--interval', type=float, default=0.02, help='上游片段之间的间隔（秒）')
+    args = parser.parse_args()
+
+    upstream = StubUpstream(args.chunks, args.interval)
+    print(f"{args.kiosks} kiosks x {args.turns} turns (/nav + streamed /), "
+          f"upstream stream = {args.chunks} chunks x {args.interval}s")
+    print(f"\n{'client':12}{'nav p50':>10}{'nav p99':>10}{'first chunk p50':>17}{'server CPU/turn':>17}")
+    with tempfile.TemporaryDirectory() as base:
+        write_fixtures(base, 1000)
+        env = dict(os.environ, ZHIPUAI_BASE_URL=f'http://127.0.0.1:{upstream.port}', RELOAD_INTERVAL='0',
+                   SHIMENGUAN_DATA_DIR=os.path.join(base, 'shimenguan'), PYTHONWARNINGS='ignore')
+        for mode in ('http', 'keep-alive', 'ws'):
+            port = free_port()
+            process = start_process('asgi', port, env)
+            try:
+                cpu = cpu_seconds(process.pid)
+                nav_latency, first_chunk_latency = asyncio.run(run_load(mode, port, args.kiosks, args.turns))
+                cpu = cpu_seconds(process.pid) - cpu
+            finally:
+                process.terminate()
+                process.wait()
+            print(f"{mode:12}{percentile(nav_latency, 0.5) * 1000:>8.1f}ms{percentile(nav_latency, 0.99) * 1000:>8.1f}ms"
+                  f"{percentile(first_chunk_latency, 0.5) * 1000:>15.1f}ms"
+                  f"{cpu / (args.kiosks * args.turns) * 1000:>15.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
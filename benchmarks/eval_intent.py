@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""本地导航意图判断的评估：在带标注的问题集上交叉验证 IntentClassifier。
+
+每个问题标注是否需要导航（NEEDNAV Y/N）。按折交叉验证：用其余折训练线性模型，在留出的折上统计
+    - 线性模型本身（阈值 0.5）识别“需要导航”的 precision / recall；
+    - 本地判为不需要导航（规则 + 模型阈值）的 precision / recall，以及误判（本该导航却被本地拦下）的问题；
+    - 加上 PoiResolver 在本地直接给出目的地后，/nav 免去的大模型调用比例。
+没有指定数据时使用内置的示例问题集和 eval_poi_topk.py 中的示例景区。
+指定 --save 时用全部数据训练一个模型并保存，供 shimenguan 的 intent_model 配置使用。
+
+问题集为 JSONL，每行形如 {"query": "门票多少钱", "NEEDNAV": "N"}。
+
+用法（在仓库根目录执行）：
+    python benchmarks/eval_intent.py
+    python benchmarks/eval_intent.py --data labeled_intents.jsonl --poi shimenguan/poi.csv --save intent_model.json
+"""
+import argparse
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.intent import DEFAULT_THRESHOLD, IntentClassifier, IntentModel, load_examples
+from common.poi import PoiResolver, read_poi_csv
+from eval_poi_topk import SAMPLE_POI_CSV
+
+SAMPLE_NAV = [
+    "带我去游客中心", "售票处在哪里", "东大门怎么走", "西门在哪", "我要去停车场", "我的车停在东停车场，怎么回去",
+    "厕所在哪里", "我想上厕所", "最近的洗手间", "哪里可以吃饭", "我饿了，有吃饭的地方吗", "餐厅怎么走",
+    "想吃农家饭", "附近有咖啡厅吗", "哪里能买水", "渴了，哪有卖水的", "便利店在哪", "想买点特产带回去",
+    "带我去大峡谷", "石门关大峡谷怎么去", "我要去观景台拍照", "玻璃栈道入口在哪", "坐缆车在哪里",
+    "电瓶车在哪坐", "带我去看瀑布", "龙潭瀑布远吗", "古栈道怎么走", "带我去天桥", "石门寺在什么地方",
+    "哪里可以烧香", "有人受伤了，医务室在哪", "急救站", "哺乳室在哪", "哪里可以寄存行李", "失物招领处在哪",
+    "小孩想去游乐场", "营地在哪边", "附近有客栈吗", "导航到北门", "出口在哪里", "我要出去了，最近的门",
+    "帮我找一下卫生间", "带路去餐厅", "领我去游客中心", "索道下站", "我想去古寺", "观光车站怎么去",
+    "前往露营地", "去儿童乐园", "我要去玻璃栈道",
+]
+SAMPLE_CHAT = [
+    "门票多少钱", "景区几点开门", "几点关门", "今天天气怎么样", "讲个笑话", "石门关有什么历史",
+    "你叫什么名字", "你是机器人吗", "学生票有优惠吗", "老人免票吗", "儿童票怎么算", "可以带宠物进来吗",
+    "景区有多大", "最佳游玩时间是什么时候", "玻璃栈道有什么限制", "瀑布什么季节最好看", "这里海拔多少",
+    "大峡谷是怎么形成的", "石门关名字的由来", "有什么好玩的推荐", "一天能玩完吗", "缆车票价多少",
+    "电瓶车要钱吗", "可以用微信支付吗", "能开发票吗", "周末人多吗", "需要提前预约吗", "你好",
+    "谢谢你", "再见", "你会唱歌吗", "给我讲个故事", "这里有什么传说", "明天会下雨吗", "景区电话是多少",
+    "门票包含哪些项目", "有导游讲解吗", "可以无人机航拍吗", "古寺是哪个朝代的", "农家乐的菜好吃吗",
+    "民宿多少钱一晚", "露营需要自带帐篷吗", "景区有wifi吗", "手机没电了能充电吗", "今天是几号",
+    "你喜欢什么", "石门关在新疆哪里", "这里冬天冷吗", "适合带老人来吗", "夜间开放吗",
+]
+
+K_FOLDS = 5
+
+
+def sample_examples():
+    return [(query, True) for query in SAMPLE_NAV] + [(query, False) for query in SAMPLE_CHAT]
+
+
+def ratio(a, b):
+    return a / b if b else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='带标注的问题集 JSONL 路径，默认使用内置示例问题')
+    parser.add_argument('--poi', help='poi.csv 路径，默认使用内置示例景区')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='本地判为不需要导航的概率上限')
+    parser.add_argument('--save', help='用全部数据训练模型并保存到该路径')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    examples = load_examples(args.data) if args.data else sample_examples()
+    if args.poi:
+        with open(args.poi, 'r', encoding='utf-8') as file:
+            poi_mapping = read_poi_csv(file)[0]
+    else:
+        poi_mapping = read_poi_csv(io.StringIO(SAMPLE_POI_CSV))[0]
+    resolver = PoiResolver(poi_mapping)
+
+    rng = random.Random(args.seed)
+    shuffled = examples[:]
+    rng.shuffle(shuffled)
+    folds = [shuffled[i::K_FOLDS] for i in range(K_FOLDS)]
+
+    model_tp = model_fp = model_fn = 0
+    local_n = local_n_correct = local_y = local_y_correct = 0
+    reasons = {'rule': 0, 'model': 0}
+    wrongly_local = []
+    for i, test in enumerate(folds):
+        train = [example for j, fold in enumerate(folds) if j != i for example in fold]
+        model = IntentModel.train(train, seed=args.seed)
+        classifier = IntentClassifier(model, resolver, args.threshold)
+        for query, needs_nav in test:
+            predicted = model.probability(query) > 0.5
+            model_tp += predicted and needs_nav
+            model_fp += predicted and not needs_nav
+            model_fn += not predicted and needs_nav
+            # 与 shimenguan /nav 的顺序一致：先本地解析目的地，再本地判断是否需要导航
+            if resolver.resolve(query) is not None:
+                local_y += 1
+                local_y_correct += needs_nav
+                continue
+            reason = classifier.escalation_reason(query)
+            if reason is None:
+                local_n += 1
+                local_n_correct += not needs_nav
+                if needs_nav:
+                    wrongly_local.append(query)
+            else:
+                reasons[reason] += 1
+
+    total = len(examples)
+    chats = sum(not needs_nav for _, needs_nav in examples)
+    print(f"examples={total} (NEEDNAV Y {total - chats}, N {chats}), {K_FOLDS}-fold cross validation, "
+          f"threshold={args.threshold}")
+    print(f"\nlinear model alone (p > 0.5 => Y): precision {ratio(model_tp, model_tp + model_fp):.1%}  "
+          f"recall {ratio(model_tp, model_tp + model_fn):.1%}")
+    print(f"local NEEDNAV N: {local_n} answered locally, precision {ratio(local_n_correct, local_n):.1%}  "
+          f"recall {ratio(local_n_correct, chats):.1%}")
+    print(f"local NEEDNAV Y (PoiResolver): {local_y} answered locally, precision {ratio(local_y_correct, local_y):.1%}")
+    print(f"escalated to the model: {reasons['rule']} by keyword/POI rules, {reasons['model']} by the linear model")
+    print(f"/nav upstream calls avoided: {local_n + local_y}/{total} ({ratio(local_n + local_y, total):.1%})")
+    if wrongly_local:
+        print("navigation queries answered N locally:")
+        for query in wrongly_local:
+            print(f"  {query}")
+
+    if args.save:
+        IntentModel.train(examples, seed=args.seed).save(args.save)
+        print(f"\nmodel trained on all {total} examples saved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""提示词 POI 子集的评估：按问题检索 top-k 个 POI 时的召回率与提示词长度。
+
+对带标注的问题集（每个问题标注了应该去的标准 POI，与 POI 无关的问题标注为 null），
+分别取 k = 1, 2, 3, 5, 8, 10 以及全量，统计：
+    - recall：标注了 POI 的问题中，正确的 POI 出现在提示词里的比例（模型能答对的前提）；
+    - fallback：没有检索到任何相关 POI、退回到完整列表的问题比例；
+    - block：提示词中地点列表 + 别名对应部分的平均字符数，以及相对全量的比例。
+不调用大模型，只评估检索本身；没有指定数据时使用内置的示例景区和问题集。
+
+问题集为 JSONL，每行形如 {"query": "哪里可以吃饭", "poi": "游客餐厅"}。
+
+用法（在仓库根目录执行）：
+    python benchmarks/eval_poi_topk.py
+    python benchmarks/eval_poi_topk.py --poi shimenguan/poi.csv --queries labeled_queries.jsonl
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.poi import PoiIndex, format_aliases, format_poi_list, read_poi_csv
+
+# 内置示例景区：名称, 别名1, 别名2, 类别
+SAMPLE_POI_CSV = """name,alias1,alias2,category
+游客中心,服务中心,售票处,服务
+东门,东大门,东入口,出入口
+西门,西大门,西入口,出入口
+北门,北大门,后门,出入口
+南门停车场,停车场,南停车场,停车
+东门停车场,东停车场,,停车
+卫生间(游客中心),游客中心厕所,游客中心洗手间,厕所
+卫生间(观景台),观景台厕所,,厕所
+卫生间(峡谷口),峡谷口厕所,,厕所
+游客餐厅,餐厅,饭店,餐饮 吃饭
+农家乐,农家饭,土菜馆,餐饮 吃饭
+咖啡馆,咖啡厅,星巴克,饮品
+小卖部,便利店,商店,购物 买水
+纪念品商店,文创店,特产店,购物
+石门关大峡谷,大峡谷,峡谷,景点
+观景台,观景平台,看台,景点 拍照
+玻璃栈道,栈道,,景点
+索道上站,上站,缆车上站,交通
+索道下站,下站,缆车下站,交通
+观光车站,观光车,电瓶车站,交通
+瀑布,飞瀑,龙潭瀑布,景点 拍照
+古栈道,老栈道,,景点
+天桥,空中天桥,,景点
+石门关隘,关隘,石门,景点
+古寺,石门寺,寺庙,景点 烧香
+医务室,医疗点,急救站,医疗
+母婴室,哺乳室,,服务
+行李寄存处,寄存处,寄存,服务
+失物招领处,失物招领,,服务
+儿童乐园,游乐场,,娱乐 小孩
+露营地,营地,帐篷区,住宿
+民宿,客栈,酒店,住宿
+"""
+
+# 内置示例问题集
+SAMPLE_QUERIES = [
+    ("带我去游客中心", "游客中心"), ("售票处在哪里", "游客中心"), ("去服务中心怎么走", "游客中心"),
+    ("东大门怎么走", "东门"), ("我要从东入口出去", "东门"), ("西门在哪", "西门"),
+    ("带我去后门", "北门"), ("我的车停在停车场", "南门停车场"), ("东停车场怎么去", "东门停车场"),
+    ("游客中心的厕所在哪", "卫生间(游客中心)"), ("观景台附近有厕所吗", "卫生间(观景台)"),
+    ("峡谷口厕所", "卫生间(峡谷口)"), ("哪里可以吃饭", "游客餐厅"), ("餐厅在哪", "游客餐厅"),
+    ("想吃农家饭", "农家乐"), ("附近有咖啡厅吗", "咖啡馆"), ("哪里能买水", "小卖部"),
+    ("便利店在哪", "小卖部"), ("想买点特产", "纪念品商店"), ("文创店怎么走", "纪念品商店"),
+    ("带我去大峡谷", "石门关大峡谷"), ("石门关大峡谷有多远", "石门关大峡谷"), ("去看台拍照", "观景台"),
+    ("观景平台在哪里", "观景台"), ("玻璃栈道怎么走", "玻璃栈道"), ("我想坐缆车上山", "索道下站"),
+    ("缆车上站在哪", "索道上站"), ("电瓶车在哪坐", "观光车站"), ("带我去看瀑布", "瀑布"),
+    ("龙潭瀑布远吗", "瀑布"), ("古栈道开放吗", "古栈道"), ("空中天桥怎么走", "天桥"),
+    ("去关隘看看", "石门关隘"), ("石门寺怎么走", "古寺"), ("哪里可以烧香", "古寺"),
+    ("有人受伤了，医务室在哪", "医务室"), ("急救站在哪里", "医务室"), ("哺乳室在哪", "母婴室"),
+    ("哪里可以寄存行李", "行李寄存处"), ("我的包丢了", "失物招领处"), ("失物招领在哪", "失物招领处"),
+    ("小孩想去游乐场", "儿童乐园"), ("营地可以搭帐篷吗", "露营地"), ("附近有客栈吗", "民宿"),
+    ("门票多少钱", None), ("景区几点关门", None), ("今天天气怎么样", None), ("讲个笑话", None),
+    ("石门关有什么历史", None), ("你叫什么名字", None),
+]
+
+K_VALUES = (1, 2, 3, 5, 8, 10)
+
+
+def load_queries(path):
+    queries = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                queries.append((item['query'], item.get('poi')))
+    return queries
+
+
+def block_size(pois, alias_pairs):
+    return len(format_poi_list(pois)) + len(format_aliases(alias_pairs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--poi', help='poi.csv 路径，默认使用内置示例景区')
+    parser.add_argument('--queries', help='带标注的问题集 JSONL 路径，默认使用内置示例问题')
+    args = parser.parse_args()
+
+    if args.poi:
+        with open(args.poi, 'r', encoding='utf-8') as file:
+            poi_mapping, poi_list, poi_categories = read_poi_csv(file)
+    else:
+        poi_mapping, poi_list, poi_categories = read_poi_csv(io.StringIO(SAMPLE_POI_CSV))
+    queries = load_queries(args.queries) if args.queries else SAMPLE_QUERIES
+    unknown = {poi for _, poi in queries if poi is not None and poi not in poi_list}
+    if unknown:
+        sys.exit(f"labels not found in poi list: {sorted(unknown)}")
+
+    index = PoiIndex(poi_list, poi_mapping, poi_categories)
+    full_block = block_size(poi_list, index.alias_pairs(poi_list))
+    labeled = [(query, poi) for query, poi in queries if poi is not None]
+    print(f"pois={len(poi_list)} aliases={len(poi_mapping) - len(poi_list)} "
+          f"queries={len(queries)} (labeled {len(labeled)})")
+    print(f"\n{'k':>5}{'recall':>9}{'fallback':>10}{'block':>9}{'of full':>9}")
+    for k in K_VALUES + (None,):
+        hits = fallbacks = total_block = 0
+        for query, label in queries:
+            pois = index.top(query, k) if k else []
+            if not pois:
+                # 与 shimenguan 一致：没有相关 POI 时使用完整列表
+                fallbacks += k is not None
+                pois = poi_list
+            total_block += block_size(pois, index.alias_pairs(pois))
+            hits += label in pois
+        average = total_block / len(queries)
+        print(f"{k or 'all':>5}{hits / len(labeled):>9.1%}{fallbacks / len(queries):>10.1%}"
+              f"{average:>7.0f}ch{average / full_block:>9.1%}")
+    missed = [(query, label, index.top(query, 3)) for query, label in labeled]
+    missed = [(query, label, pois) for query, label, pois in missed if pois and label not in pois]
+    print(f"\nmissed at k=3: {len(missed)}")
+    for query, label, pois in missed:
+        print(f"  {query} -> expected {label}, got {pois}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""各景区服务（piaofutong / shuziren / shimenguan / coze）共享的工具模块。"""
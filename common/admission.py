@@ -0,0 +1,609 @@
+# -*- coding: utf-8 -*-
+"""大模型调用前的准入控制：按 key 限速、按上游限制并发、按优先级公平排队。
+
+任何持有 auth_keys 的客户端原来都可以同时发起任意多个上游调用，一台出问题的讲解机就能耗尽智谱或 Coze 的配额，
+让其他讲解机都排不上。需要调用大模型（没有命中缓存）的请求在调用前要通过两道检查：
+    - 令牌桶：每个 key 按 rate（次/秒）积累令牌，最多积累 burst 个，每次调用消耗一个；没有令牌时立即返回 429；
+    - 上游并发：每个上游（zhipuai、coze）同时进行的调用数不超过 max_concurrent（同一进程内的所有服务共用），
+      名额已满时进入等待队列。同一优先级的队列按 key 轮转：每空出一个名额就轮到下一个 key 中最早排队的请求，
+      同一个 key 排再多请求也只能轮到自己的那一份。队列中最多 queue_size 个请求，满了立即返回 429，
+      等待超过 max_wait 秒也返回 429。
+429 响应带 Retry-After：限速时为攒够一个令牌的秒数，排队时按名额的平均占用时间和队列长度估算。
+流式调用的名额一直占用到上游流结束或被关闭；并发的相同请求（SingleFlight）只有实际发起上游调用的请求占用名额。
+
+上游调用分三个优先级：nav（导航判断，游客在等机器人起步）> chat（非流式回答）> stream（流式回答）。
+名额空出时先给排队中优先级最高的请求；每个上游另外预留 reserved 个名额只给 nav，长回答占满其他名额时导航判断也不用排队。
+排队的请求每等待 aging 秒提升一级，持续的导航请求不会把流式回答饿死（stream 排队超过 3 个 aging 后排到新的 nav 前面）。
+
+限速在 config.json 的 "admission" 字段中配置，shuziren 的每个 profile 也可以有自己的 "admission"：
+    "admission": {"rate": 0.5, "burst": 5, "keys": {"<key>": {"rate": 2, "burst": 20}},
+                  "priorities": {"/bot": "stream"}}
+一个请求的限速依次取：profile 中该 key 的配置、顶层中该 key 的配置、profile 的 rate/burst、顶层的 rate/burst，
+都没有时使用 ADMISSION_RATE / ADMISSION_BURST 环境变量（默认不限速）；rate 为 0 表示不限速。
+配置了 admission 的 profile 使用独立的令牌桶。"priorities" 按接口覆盖默认的优先级（/nav 为 nav，
+其他接口非流式为 chat、流式为 stream）。上游的并发上限、队列、预留名额和 aging 由环境变量设置，
+ADMISSION_MAX_CONCURRENT_ZHIPUAI 等可以单独设置某个上游；max_concurrent 为 0 表示不限制。
+"""
+import asyncio
+from collections import OrderedDict, deque, namedtuple
+import math
+import os
+import threading
+import time
+
+# 每个上游同时进行的调用数（默认与 zhipuai SDK 客户端的连接数上限相同）、等待队列长度和最长等待秒数
+DEFAULT_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '50'))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', '100'))
+DEFAULT_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', '10'))
+# 没有在 config.json 中配置时每个 key 的限速
+DEFAULT_RATE = float(os.environ.get('ADMISSION_RATE', '0'))
+DEFAULT_BURST = int(os.environ.get('ADMISSION_BURST', '10'))
+# 令牌桶数量超过这个值时清理已经攒满（长时间没有请求）的桶
+MAX_BUCKETS = 4096
+# 上游调用的优先级，从高到低：导航判断、非流式回答、流式回答
+NAV, CHAT, STREAM = 'nav', 'chat', 'stream'
+PRIORITIES = (NAV, CHAT, STREAM)
+# 每个上游只留给导航判断的名额数，以及排队的请求每等待多少秒提升一级优先级
+DEFAULT_RESERVED = int(os.environ.get('ADMISSION_RESERVED', '2'))
+DEFAULT_AGING = float(os.environ.get('ADMISSION_AGING', '2'))
+
+RateLimit = namedtuple('RateLimit', 'rate burst')
+
+
+class AdmissionError(ValueError):
+    """config.json 中的 admission 配置不合法。"""
+
+
+class Rejected(Exception):
+    """请求未被准入，应返回 429；retry_after 为建议的重试等待秒数。"""
+
+    def __init__(self, reason, detail, retry_after):
+        super().__init__(f"{detail}, retry after {retry_after}s")
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self):
+        return {'Retry-After': str(self.retry_after)}
+
+
+def _parse_limit(value, where, default_burst=None):
+    if not isinstance(value, dict):
+        raise AdmissionError(f"{where} must be an object")
+    rate = value.get('rate')
+    if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate < 0:
+        raise AdmissionError(f"{where}.rate must be a non-negative number")
+    burst = value.get('burst', default_burst if default_burst is not None else max(1, math.ceil(rate)))
+    if isinstance(burst, bool) or not isinstance(burst, int) or burst < 1:
+        raise AdmissionError(f"{where}.burst must be a positive integer")
+    return RateLimit(float(rate), burst)
+
+
+class AdmissionPolicy:
+    """config.json 中一个 "admission" 字段解析出的限速和优先级配置（只读）。"""
+
+    def __init__(self, config=None, where='admission'):
+        self.default = None
+        self.keys = {}
+        self.priorities = {}
+        if config is None:
+            return
+        if not isinstance(config, dict):
+            raise AdmissionError(f"{where} must be an object")
+        if 'rate' in config:
+            self.default = _parse_limit(config, where)
+        keys = config.get('keys', {})
+        if not isinstance(keys, dict):
+            raise AdmissionError(f"{where}.keys must be an object")
+        self.keys = {key: _parse_limit(value, f"{where}.keys.{key[:4]}…") for key, value in keys.items()}
+        priorities = config.get('priorities', {})
+        if not isinstance(priorities, dict):
+            raise AdmissionError(f"{where}.priorities must be an object")
+        for endpoint, priority in priorities.items():
+            if priority not in PRIORITIES:
+                raise AdmissionError(f"{where}.priorities.{endpoint} must be one of {', '.join(PRIORITIES)}")
+        self.priorities = dict(priorities)
+
+    def limit(self, key, profile=None):
+        """key 的限速（RateLimit），不限速时返回 None；profile 为更具体的 AdmissionPolicy（如 shuziren 的 profile）。"""
+        policies = (profile, self) if profile is not None else (self,)
+        for policy in policies:
+            if key in policy.keys:
+                return policy.keys[key] if policy.keys[key].rate > 0 else None
+        for policy in policies:
+            if policy.default is not None:
+                return policy.default if policy.default.rate > 0 else None
+        return RateLimit(DEFAULT_RATE, DEFAULT_BURST) if DEFAULT_RATE > 0 else None
+
+    def priority(self, endpoint, default, profile=None):
+        """endpoint 上的上游调用的优先级：配置了时取配置（profile 优先），否则为 default。"""
+        for policy in (profile, self):
+            if policy is not None and endpoint in policy.priorities:
+                return policy.priorities[endpoint]
+        return default
+
+
+def client_label(client):
+    """统计中显示的客户端标识：key 只显示前 4 个字符。"""
+    if client is None or client.startswith('ip:'):
+        return client or 'anonymous'
+    return client[:4] + '***'
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'allowed', 'limited')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.allowed = 0
+        self.limited = 0
+
+
+class TokenBuckets:
+    """按 (范围, 客户端) 的令牌桶（线程安全）。"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.allowed = 0
+        self.limited = 0
+
+    def take(self, scope, client, limit):
+        """消耗一个令牌；没有令牌时抛出 Rejected。limit 为 None 时不限速。"""
+        if limit is None:
+            return
+        with self._lock:
+            now = self._clock()
+            bucket = self._buckets.get((scope, client))
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[(scope, client)] = _Bucket(limit.burst, now)
+            else:
+                # 按经过的时间补充令牌，配置热加载调小 burst 后立即生效
+                bucket.tokens = min(limit.burst, bucket.tokens + (now - bucket.updated) * limit.rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                bucket.allowed += 1
+                self.allowed += 1
+                return
+            bucket.limited += 1
+            self.limited += 1
+            retry_after = max(1, math.ceil((1 - bucket.tokens) / limit.rate))
+        raise Rejected('rate_limited', 'Rate limit exceeded', retry_after)
+
+    def _prune(self, now):
+        # 空闲超过 10 分钟的桶按已经攒满处理，删除后重新创建的效果相同
+        idle = [key for key, bucket in self._buckets.items() if now - bucket.updated > 600]
+        for key in idle:
+            del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            limited = {}
+            for (scope, client), bucket in self._buckets.items():
+                if bucket.limited:
+                    limited.setdefault(scope, {})[client_label(client)] = {
+                        'allowed': bucket.allowed, 'limited': bucket.limited}
+            return {'allowed': self.allowed, 'limited': self.limited, 'limited_clients': limited}
+
+
+class _Waiter:
+    """队列中的一个请求；granted 在持有 UpstreamLimit 的锁时修改。"""
+
+    __slots__ = ('client', 'rank', 'granted', 'event', 'loop', 'future', 'queued_at')
+
+    def __init__(self, client, rank, loop=None):
+        self.client = client
+        self.rank = rank
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+        self.queued_at = time.monotonic()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class Slot:
+    """一个并发名额；release() 可以重复调用，只归还一次。"""
+
+    __slots__ = ('_limit', 'client', 'rank', 'started', 'held', '_released')
+
+    def __init__(self, limit, client, rank):
+        self._limit = limit
+        self.client = client
+        self.rank = rank
+        self.started = time.monotonic()
+        self.held = False
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limit._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def hold(self, chunks):
+        """名额交给上游流，流读完、出错或关闭时归还。"""
+        self.held = True
+        return _HeldStream(iter(chunks), self)
+
+    def ahold(self, chunks):
+        """hold 的异步版本，chunks 为异步迭代器。"""
+        self.held = True
+        return _AsyncHeldStream(chunks, self)
+
+
+class _HeldStream:
+    # 不用生成器实现：生成器没开始迭代就被关闭时不会执行 finally，名额就无法归还
+
+    def __init__(self, chunks, slot):
+        self._chunks = chunks
+        self._slot = slot
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._slot.release()
+
+
+class _AsyncHeldStream:
+
+    def __init__(self, chunks, slot):
+        self._chunks = chunks
+        self._slot = slot
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        try:
+            aclose = getattr(self._chunks, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            self._slot.release()
+
+    def __del__(self):
+        # 拉取上游的 task 在开始前就被取消时不会调用 aclose，回收时归还名额
+        self._slot.release()
+
+
+class _ClassStats:
+    """一个优先级的计数（在持有 UpstreamLimit 的锁时修改）。"""
+
+    __slots__ = ('active', 'queued', 'admitted', 'waited', 'aged', 'wait_seconds')
+
+    def __init__(self):
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.waited = 0
+        self.aged = 0
+        self.wait_seconds = 0.0
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'waited': self.waited,
+            'aged': self.aged,
+            'avg_wait_ms': round(self.wait_seconds / self.waited * 1000, 1) if self.waited else 0.0,
+        }
+
+
+class UpstreamLimit:
+    """一个上游的并发上限和按优先级、按客户端轮转的有界等待队列（线程安全，同步和异步请求可以共用）。"""
+
+    def __init__(self, name, max_concurrent=DEFAULT_MAX_CONCURRENT, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT, reserved=DEFAULT_RESERVED, aging=DEFAULT_AGING):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        # 并发上限很小时至少留一个名额给其他调用
+        self.reserved = max(0, min(reserved, max_concurrent - 1)) if max_concurrent else 0
+        self.aging = aging
+        self._lock = threading.Lock()
+        self._active = {}
+        self.active = 0
+        # 每个优先级一个队列：客户端 → 排队的请求；取出一个请求后该客户端移到末尾，实现轮转
+        self._queues = [OrderedDict() for _ in PRIORITIES]
+        self._classes = [_ClassStats() for _ in PRIORITIES]
+        self.queued = 0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._wait_seconds = 0.0
+        self._hold_seconds = 0.0
+        self._released = 0
+
+    @staticmethod
+    def _rank(priority):
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        return PRIORITIES.index(priority)
+
+    def _room(self, rank):
+        # 在锁内调用：预留的名额只给最高优先级（导航判断）
+        if not self.max_concurrent:
+            return True
+        return self.active < self.max_concurrent - (self.reserved if rank else 0)
+
+    def _retry_after(self, rank):
+        # 在锁内调用：排在前面（同级和更高优先级）的请求按平均占用时间依次得到名额
+        hold = self._hold_seconds / self._released if self._released else self.max_wait
+        ahead = sum(self._classes[r].queued for r in range(rank + 1))
+        rounds = math.ceil((ahead + 1) / max(1, self.max_concurrent))
+        return max(1, math.ceil(hold * rounds))
+
+    def _enter(self, client, rank, waiter_factory):
+        """在锁内尝试直接取得名额；需要排队时返回 waiter，队列已满时抛出 Rejected。"""
+        # 有空余名额时不会有同级或更高优先级的请求在排队（名额空出时已经分给了它们）
+        if self._room(rank):
+            self._grant(client, rank)
+            return None
+        if self.queued >= self.queue_size:
+            self.rejected_full += 1
+            raise Rejected('queue_full', f'Too many requests waiting for {self.name}', self._retry_after(rank))
+        waiter = waiter_factory()
+        self._queues[rank].setdefault(client, deque()).append(waiter)
+        self.queued += 1
+        self.waited += 1
+        self._classes[rank].queued += 1
+        self._classes[rank].waited += 1
+        return waiter
+
+    def _grant(self, client, rank):
+        self.active += 1
+        self.admitted += 1
+        self._classes[rank].active += 1
+        self._classes[rank].admitted += 1
+        self._active[client] = self._active.get(client, 0) + 1
+
+    def _leave(self, waiter):
+        """在锁内处理等待结束的请求：已经分到名额时返回 True，否则把它移出队列。"""
+        waited = time.monotonic() - waiter.queued_at
+        self._wait_seconds += waited
+        self._classes[waiter.rank].wait_seconds += waited
+        if waiter.granted:
+            return True
+        queues = self._queues[waiter.rank]
+        queue = queues.get(waiter.client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            self._classes[waiter.rank].queued -= 1
+            if not queue:
+                del queues[waiter.client]
+        return False
+
+    def _next_rank(self):
+        """在锁内选出下一个得到名额的优先级，没有能得到名额的请求时返回 None。
+
+        比较各优先级中轮到的请求：每排队 aging 秒提升一级（防止低优先级被饿死），级别相同时原来的优先级高的先得到名额。
+        """
+        now = time.monotonic()
+        best = best_key = first = None
+        for rank, queues in enumerate(self._queues):
+            if not queues or not self._room(rank):
+                continue
+            if first is None:
+                first = rank
+            waiter = next(iter(queues.values()))[0]
+            key = (rank - int((now - waiter.queued_at) // self.aging) if self.aging > 0 else rank, rank)
+            if best_key is None or key < best_key:
+                best, best_key = rank, key
+        if best is not None and best != first:
+            self._classes[best].aged += 1
+        return best
+
+    def _dispatch(self):
+        # 在锁内调用：空出的名额直接交给排队的请求
+        while self.queued:
+            rank = self._next_rank()
+            if rank is None:
+                return
+            queues = self._queues[rank]
+            client, queue = next(iter(queues.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            self._classes[rank].queued -= 1
+            if queue:
+                queues.move_to_end(client)
+            else:
+                del queues[client]
+            waiter.granted = True
+            self._grant(client, rank)
+            waiter.wake()
+
+    def _release(self, slot):
+        with self._lock:
+            self._hold_seconds += time.monotonic() - slot.started
+            self._released += 1
+            count = self._active[slot.client] - 1
+            if count:
+                self._active[slot.client] = count
+            else:
+                del self._active[slot.client]
+            self.active -= 1
+            self._classes[slot.rank].active -= 1
+            self._dispatch()
+
+    def acquire(self, client, priority=CHAT):
+        """以 priority 优先级取得一个名额（需要时排队等待），返回 Slot；无法准入时抛出 Rejected。"""
+        rank = self._rank(priority)
+        with self._lock:
+            waiter = self._enter(client, rank, lambda: _Waiter(client, rank))
+        if waiter is not None:
+            waiter.event.wait(self.max_wait)
+            with self._lock:
+                if not self._leave(waiter):
+                    self.rejected_timeout += 1
+                    raise Rejected('queue_timeout', f'Timed out waiting for {self.name}', self._retry_after(rank))
+        return Slot(self, client, rank)
+
+    async def acquire_async(self, client, priority=CHAT):
+        """acquire 的异步版本：排队时不占线程；等待中被取消（客户端断开）时让出位置。"""
+        rank = self._rank(priority)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiter = self._enter(client, rank, lambda: _Waiter(client, rank, loop))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                with self._lock:
+                    granted = self._leave(waiter)
+                if granted:
+                    Slot(self, client, rank).release()
+                raise
+            with self._lock:
+                if not self._leave(waiter):
+                    self.rejected_timeout += 1
+                    raise Rejected('queue_timeout', f'Timed out waiting for {self.name}', self._retry_after(rank))
+        return Slot(self, client, rank)
+
+    def call(self, client, fn, priority=CHAT):
+        """在名额内执行 fn()。"""
+        with self.acquire(client, priority):
+            return fn()
+
+    async def call_async(self, client, fn, priority=CHAT):
+        """在名额内 await fn()。"""
+        with await self.acquire_async(client, priority):
+            return await fn()
+
+    def stream(self, client, fn, priority=STREAM):
+        """取得名额后用 fn() 打开上游流，名额占用到流结束。"""
+        slot = self.acquire(client, priority)
+        try:
+            return slot.hold(fn())
+        except BaseException:
+            slot.release()
+            raise
+
+    def stats(self):
+        with self._lock:
+            clients = {}
+            for client, count in self._active.items():
+                clients.setdefault(client_label(client), {'active': 0, 'queued': 0})['active'] += count
+            for queues in self._queues:
+                for client, queue in queues.items():
+                    clients.setdefault(client_label(client), {'active': 0, 'queued': 0})['queued'] += len(queue)
+            return {
+                'max_concurrent': self.max_concurrent,
+                'reserved': self.reserved,
+                'queue_size': self.queue_size,
+                'max_wait': self.max_wait,
+                'aging': self.aging,
+                'active': self.active,
+                'queued': self.queued,
+                'admitted': self.admitted,
+                'waited': self.waited,
+                'rejected_queue_full': self.rejected_full,
+                'rejected_timeout': self.rejected_timeout,
+                'avg_wait_ms': round(self._wait_seconds / self.waited * 1000, 1) if self.waited else 0.0,
+                'avg_hold_s': round(self._hold_seconds / self._released, 2) if self._released else 0.0,
+                'priorities': {name: stats.stats() for name, stats in zip(PRIORITIES, self._classes)},
+                'clients': clients,
+            }
+
+
+class Admission:
+    """进程内共享的准入控制：各上游的 UpstreamLimit 和所有服务的令牌桶。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._upstreams = {}
+        self.buckets = TokenBuckets()
+
+    def upstream(self, name):
+        """返回上游 name 的 UpstreamLimit，并发上限可由 ADMISSION_MAX_CONCURRENT_<NAME> 单独设置。"""
+        with self._lock:
+            limit = self._upstreams.get(name)
+            if limit is None:
+                max_concurrent = int(os.environ.get(f'ADMISSION_MAX_CONCURRENT_{name.upper()}', DEFAULT_MAX_CONCURRENT))
+                limit = self._upstreams[name] = UpstreamLimit(name, max_concurrent)
+            return limit
+
+    def check_rate(self, scope, client, limit):
+        """按 scope（服务或 profile）和客户端限速，没有令牌时抛出 Rejected。"""
+        self.buckets.take(scope, client, limit)
+
+    def stats(self):
+        with self._lock:
+            upstreams = list(self._upstreams.values())
+        return {'upstreams': {limit.name: limit.stats() for limit in upstreams}, 'rate_limits': self.buckets.stats()}
+
+
+# 进程内共享，网关中各服务共用同一组上游并发上限
+ADMISSION = Admission()
+
+
+def admit_stream(inflight, cache_key, limit, client, fn, priority=STREAM):
+    """打开 cache_key 对应的共享上游流（SingleFlight.stream），需要新的上游调用时先以 priority 取得 limit 的名额。
+
+    在登记共享流之前排队，排队失败时抛出 Rejected，调用方还没有开始响应，可以返回 429；
+    相同的流已经在进行时直接加入，不占名额。
+    """
+    if inflight.streaming(cache_key):
+        return inflight.stream(cache_key, lambda: limit.stream(client, fn, priority))
+    slot = limit.acquire(client, priority)
+    try:
+        return inflight.stream(cache_key, lambda: slot.hold(fn()))
+    finally:
+        # 排队期间相同的流已由其他请求发起，本请求加入了它，名额没有用上
+        if not slot.held:
+            slot.release()
+
+
+async def admit_astream(inflight, cache_key, limit, client, fn, priority=STREAM):
+    """admit_stream 的异步版本（AsyncSingleFlight），fn() 返回上游异步迭代器。"""
+    if inflight.streaming(cache_key):
+        return inflight.stream(cache_key, fn)
+    slot = await limit.acquire_async(client, priority)
+    if inflight.streaming(cache_key):
+        slot.release()
+        return inflight.stream(cache_key, fn)
+    return inflight.stream(cache_key, lambda: slot.ahold(fn()))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""ASGI 服务模式使用的异步上游客户端。
+
+Flask 服务中每个流式请求要占用一个线程，直到上游流结束（通常 5~20 秒），并发流的数量受线程数限制；
+zhipuai SDK 的客户端还把到上游的连接数限制在 50。ASGI 模式下请求是协程，等待上游时不占线程，
+上游调用通过共享的 httpx.AsyncClient 发出：
+    - AsyncZhipuAI：智谱 /chat/completions 的最小异步客户端，请求体和认证方式与 zhipuai SDK 相同，
+      流式响应按 SSE 解析，逐个产出 delta.content；
+    - new_http_client：按 ASYNC_HTTP_MAX_CONNECTIONS 等环境变量创建共享的连接池，超时与 common.httppool 一致。
+"""
+import json
+import os
+
+import httpx
+
+from common.httppool import DEFAULT_CONNECT_TIMEOUT, DEFAULT_POOL_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+# 与 zhipuai SDK 相同：可通过 ZHIPUAI_BASE_URL 环境变量指定上游地址
+DEFAULT_ZHIPUAI_BASE_URL = 'https://open.bigmodel.cn/api/paas/v4'
+# 到上游的最大连接数（即同时进行的上游调用数）和保持的空闲连接数
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', '1000'))
+DEFAULT_MAX_KEEPALIVE = int(os.environ.get('ASYNC_HTTP_MAX_KEEPALIVE', '100'))
+
+
+class UpstreamError(Exception):
+    """上游返回了非 200 的状态码。"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def new_http_client(max_connections=DEFAULT_MAX_CONNECTIONS, max_keepalive=DEFAULT_MAX_KEEPALIVE):
+    """创建共享的 httpx.AsyncClient，需在事件循环中使用并在关闭时 aclose()。"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        timeout=httpx.Timeout(DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT, pool=DEFAULT_POOL_TIMEOUT),
+    )
+
+
+async def aiter_sse_data(response):
+    """逐个产出 SSE 响应中 data: 行的内容，遇到 [DONE] 结束。"""
+    async for line in response.aiter_lines():
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
+        if data:
+            yield data
+
+
+class AsyncZhipuAI:
+    """智谱对话补全接口的异步客户端（无状态，可被所有请求共享）。"""
+
+    def __init__(self, http, api_key, base_url=None):
+        self.http = http
+        self.url = (base_url or os.environ.get('ZHIPUAI_BASE_URL') or DEFAULT_ZHIPUAI_BASE_URL).rstrip('/') + '/chat/completions'
+        self.headers = {'Authorization': f'Bearer {api_key}', 'x-source-channel': 'python-sdk'}
+
+    def _body(self, model, messages, tools, stream):
+        body = {'model': model, 'messages': messages, 'stream': stream}
+        if tools:
+            body['tools'] = tools
+        return body
+
+    async def complete(self, model, messages, tools=None):
+        """返回 choices[0].message.content。"""
+        response = await self.http.post(self.url, headers=self.headers, json=self._body(model, messages, tools, False))
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code, response.text)
+        return response.json()['choices'][0]['message'].get('content')
+
+    async def stream(self, model, messages, tools=None):
+        """逐个产出 choices[0].delta.content（可能为 None）；提前关闭时释放连接。"""
+        request = self.http.build_request('POST', self.url, headers=self.headers,
+                                          json=self._body(model, messages, tools, True))
+        response = await self.http.send(request, stream=True)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+                raise UpstreamError(response.status_code, response.text)
+            async for data in aiter_sse_data(response):
+                choices = json.loads(data).get('choices') or [{}]
+                yield choices[0].get('delta', {}).get('content')
+        finally:
+            await response.aclose()
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""各服务共用的 auth-key 校验。"""
+
+
+def bearer_key(auth_key):
+    """从请求头中的 ``Bearer <key>`` 取出 key，格式不对或缺少请求头时返回 None。"""
+    if not auth_key or not auth_key.startswith('Bearer '):
+        return None
+    return auth_key.split(' ')[1]
+
+
+def valid_auth_key(auth_key, auth_keys):
+    """auth_key 为请求头中的 ``Bearer <key>``，key 在 auth_keys 中时返回 True；缺少请求头时返回 False。"""
+    key = bearer_key(auth_key)
+    return key is not None and key in auth_keys
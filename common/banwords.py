@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""敏感词匹配。
+
+原来每个接口都用 ``any(banword in query for banword in BANWORDS)`` 逐个词做子串查找，
+词表有几千个词时每次请求的开销是 O(词数 × 查询长度)。这里把词表一次性编译成
+Aho-Corasick 自动机，之后对查询只需要线性扫描一遍，并返回命中的具体词。
+
+默认会把词表和查询都经过 common.normalize 的逐字符折叠（全角、大小写、繁简、
+去除分隔符），折叠和自动机跳转在同一遍扫描中完成，命中位置仍然对应原始查询。
+"""
+from collections import deque, namedtuple
+import sys
+import threading
+import weakref
+
+from common.cancel import closes_chunks
+from common.normalize import _FOLD_CACHE, fold_char, normalize as normalize_text
+
+# 命中结果：term 为词表中的原词，[start, end) 为命中片段在原始查询中的位置
+BanwordMatch = namedtuple('BanwordMatch', ['term', 'start', 'end'])
+
+
+class BanwordMatcher:
+    """由敏感词集合编译出的 Aho-Corasick 自动机（构建后只读，可在多线程间共享）。"""
+
+    __slots__ = ('_goto', '_fail', '_out', '_depth', '_size', 'normalize', '__weakref__')
+
+    def __init__(self, words=(), normalize=True):
+        self.normalize = normalize
+        goto = [{}]
+        # out[state] 为 (原词, 归一化后的长度)，表示在该状态结束的词
+        out = [None]
+        # depth[state] 为该状态对应的前缀长度（流式过滤时需要扣留的字符数）
+        depth = [0]
+        size = 0
+        for word in words:
+            word = word.strip() if isinstance(word, str) else ''
+            key = normalize_text(word)[0] if normalize else word
+            if not key:
+                continue
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(None)
+                    depth.append(depth[state] + 1)
+                state = nxt
+            if out[state] is None:
+                size += 1
+            out[state] = (word, len(key))
+
+        # 按 BFS 顺序计算失败指针；out 沿失败指针继承，
+        # 这样扫描时只需要看当前状态就能知道是否有词在此处结束
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                if out[nxt] is None:
+                    out[nxt] = out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+        self._depth = depth
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def search(self, text):
+        """单遍扫描 text，返回最先结束的命中（BanwordMatch），没有命中返回 None。"""
+        if not self._size or not isinstance(text, str):
+            return None
+        if not self.normalize:
+            return self._search_raw(text)
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        cache = _FOLD_CACHE
+        # offsets[i] 为第 i 个归一化字符在原文中的下标
+        offsets = []
+        state = 0
+        for i, raw in enumerate(text):
+            folded = cache.get(raw)
+            if folded is None:
+                folded = fold_char(raw)
+            for ch in folded:
+                offsets.append(i)
+                while True:
+                    nxt = goto[state].get(ch)
+                    if nxt is not None:
+                        state = nxt
+                        break
+                    if state == 0:
+                        break
+                    state = fail[state]
+                hit = out[state]
+                if hit is not None:
+                    return BanwordMatch(hit[0], offsets[len(offsets) - hit[1]], i + 1)
+        return None
+
+    def _search_raw(self, text):
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        root = goto[0]
+        state = 0
+        for i, ch in enumerate(text):
+            if state == 0:
+                state = root.get(ch, 0)
+                if not state:
+                    continue
+            else:
+                while True:
+                    nxt = goto[state].get(ch)
+                    if nxt is not None:
+                        state = nxt
+                        break
+                    if state == 0:
+                        break
+                    state = fail[state]
+            hit = out[state]
+            if hit is not None:
+                return BanwordMatch(hit[0], i + 1 - hit[1], i + 1)
+        return None
+
+    def __contains__(self, text):
+        return self.search(text) is not None
+
+
+# 同一进程中词表相同的服务共用一个自动机（网关托管多个服务时）；没有服务再引用时自动释放
+_SHARED_MATCHERS = weakref.WeakValueDictionary()
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_matcher(words, normalize=True):
+    """返回由 words 编译的 BanwordMatcher；词表相同时复用进程内已有的自动机。"""
+    key = (frozenset(word.strip() for word in words if isinstance(word, str) and word.strip()), normalize)
+    with _SHARED_LOCK:
+        matcher = _SHARED_MATCHERS.get(key)
+        if matcher is None:
+            matcher = BanwordMatcher(key[0], normalize)
+            _SHARED_MATCHERS[key] = matcher
+        return matcher
+
+
+class BanwordStreamFilter:
+    """对模型输出流做增量敏感词检查。
+
+    自动机状态跨 chunk 保留，因此被拆在两个 delta 里的敏感词也能命中。
+    每次 feed 只扣留当前可能构成敏感词前缀的最短尾部（即自动机状态的深度），
+    其余文本立即放行；命中后 match 被置位，之后的输入全部丢弃。
+    """
+
+    __slots__ = ('_matcher', '_state', '_buffer', '_starts', '_emitted', 'match')
+
+    def __init__(self, matcher):
+        self._matcher = matcher
+        self._state = 0
+        # 尚未放行的原文，以及其中每个归一化字符在 _buffer 内的下标
+        self._buffer = ''
+        self._starts = []
+        # 已放行的原文字符数，用来把命中位置换算成整段输出中的位置
+        self._emitted = 0
+        self.match = None
+
+    def feed(self, chunk):
+        """输入一个 chunk，返回可以安全放行的文本（可能为空串）。"""
+        if self.match is not None or not chunk:
+            return ''
+        matcher = self._matcher
+        if not matcher:
+            self._emitted += len(chunk)
+            return chunk
+        goto = matcher._goto
+        fail = matcher._fail
+        out = matcher._out
+        normalize = matcher.normalize
+        cache = _FOLD_CACHE
+        buffer = self._buffer + chunk
+        base = len(self._buffer)
+        starts = self._starts
+        state = self._state
+        for j, raw in enumerate(chunk):
+            if normalize:
+                folded = cache.get(raw)
+                if folded is None:
+                    folded = fold_char(raw)
+            else:
+                folded = raw
+            for ch in folded:
+                starts.append(base + j)
+                while True:
+                    nxt = goto[state].get(ch)
+                    if nxt is not None:
+                        state = nxt
+                        break
+                    if state == 0:
+                        break
+                    state = fail[state]
+                hit = out[state]
+                if hit is not None:
+                    self.match = BanwordMatch(hit[0], self._emitted + starts[len(starts) - hit[1]],
+                                              self._emitted + base + j + 1)
+                    self._buffer = ''
+                    self._starts = []
+                    return ''
+        self._state = state
+        # 只扣留自动机当前前缀对应的那段原文
+        depth = matcher._depth[state]
+        if depth:
+            cut = starts[len(starts) - depth]
+            self._starts = [s - cut for s in starts[len(starts) - depth:]]
+        else:
+            cut = len(buffer)
+            self._starts = []
+        self._buffer = buffer[cut:]
+        self._emitted += cut
+        return buffer[:cut]
+
+    def flush(self):
+        """流结束时放行剩余的扣留文本（它们最终没有构成敏感词）。"""
+        if self.match is not None:
+            return ''
+        rest = self._buffer
+        self._emitted += len(rest)
+        self._buffer = ''
+        self._starts = []
+        self._state = 0
+        return rest
+
+
+@closes_chunks
+def moderate_stream(chunks, matcher, rejection_message):
+    """包装一个文本 chunk 生成器：放行安全文本，命中敏感词时改为输出 rejection_message 并结束。"""
+    stream_filter = BanwordStreamFilter(matcher)
+    try:
+        for chunk in chunks:
+            text = stream_filter.feed(chunk)
+            if stream_filter.match is not None:
+                print(f"WARNING: Banned word '{stream_filter.match.term}' detected in model output, "
+                      f"stream cut at offset {stream_filter.match.start}.", file=sys.stderr)
+                yield rejection_message
+                return
+            if text:
+                yield text
+        rest = stream_filter.flush()
+        if rest:
+            yield rest
+    finally:
+        # 提前结束时关闭上游生成器，尽快释放上游连接
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+async def moderate_astream(chunks, matcher, rejection_message):
+    """moderate_stream 的异步版本，chunks 为异步迭代器（ASGI 服务模式使用）。"""
+    stream_filter = BanwordStreamFilter(matcher)
+    try:
+        async for chunk in chunks:
+            text = stream_filter.feed(chunk)
+            if stream_filter.match is not None:
+                print(f"WARNING: Banned word '{stream_filter.match.term}' detected in model output, "
+                      f"stream cut at offset {stream_filter.match.start}.", file=sys.stderr)
+                yield rejection_message
+                return
+            if text:
+                yield text
+        rest = stream_filter.flush()
+        if rest:
+            yield rest
+    finally:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""大模型回答的进程内缓存。
+
+景区里大部分提问是重复的常见问题（开放时间、门票价格、厕所在哪），
+对这些问题直接复用之前的回答，省掉一次完整的大模型 + 知识库检索往返。
+缓存按条数上限做 LRU 淘汰，并且每条记录有 TTL，过期后自动失效。
+
+流式请求同样可以命中：完整结束的流会把 chunk 序列记录下来（record_stream），
+之后的请求直接重放（replay_stream），可以立即全部输出，也可以按设定的速率重新切块输出，
+让数字人口型同步看起来仍然自然。缓存值为字符串（非流式回答）或 chunk 元组（流式回答），
+两种请求可以互相命中。
+"""
+from collections import OrderedDict
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+from common.cancel import closes_chunks
+from common.normalize import normalize
+
+# 默认容量与过期时间（秒），可通过环境变量调整
+DEFAULT_MAX_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '1024'))
+DEFAULT_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '600'))
+# 流式重放速率（字符/秒），0 表示立即输出全部缓存内容
+DEFAULT_REPLAY_RATE = float(os.environ.get('STREAM_REPLAY_RATE', '0'))
+# 按速率重放时每个 chunk 的字符数
+REPLAY_CHUNK_SIZE = 4
+
+
+def prompt_digest(system_prompt):
+    """系统提示词的哈希，作为缓存键的一部分；提示词不变时可以预先算好。"""
+    return hashlib.sha1((system_prompt or '').encode('utf-8')).hexdigest()
+
+
+def make_cache_key(profile, model, system_prompt, knowledge_id, query):
+    """生成缓存键：(配置名, 模型, 系统提示词哈希, 知识库ID, 归一化后的问题)。
+
+    问题经过 common.normalize 折叠（全半角、大小写、繁简、标点空白），
+    因此“门票多少钱？”和“门票 多少钱”会命中同一条缓存。
+    """
+    return (profile, model, prompt_digest(system_prompt), knowledge_id, normalize(query)[0])
+
+
+class ResponseCache:
+    """线程安全的 LRU + TTL 缓存，带命中/未命中计数。"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """返回缓存的值；不存在或已过期时返回 None。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def as_text(value):
+    """缓存值 → 完整回答文本。"""
+    return value if isinstance(value, str) else ''.join(value)
+
+
+@closes_chunks
+def record_stream(chunks, on_complete):
+    """透传上游 chunk 并记录下来；只有上游正常结束且内容非空时才调用 on_complete(chunk 元组)。
+
+    客户端断开、上游出错或被敏感词过滤截断（外层关闭本生成器）时都不会写入缓存。
+    """
+    recorded = []
+    try:
+        for chunk in chunks:
+            if chunk:
+                recorded.append(chunk)
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+    if recorded:
+        on_complete(tuple(recorded))
+
+
+def replay_stream(value, rate=DEFAULT_REPLAY_RATE, chunk_size=REPLAY_CHUNK_SIZE):
+    """把缓存的回答作为流重新输出。
+
+    rate <= 0 时立即输出（流式缓存按原 chunk 序列，非流式缓存整段输出）；
+    rate > 0 时按每 chunk_size 个字符重新切块，并限速为每秒 rate 个字符，第一块立即输出。
+    """
+    if rate <= 0:
+        if isinstance(value, str):
+            yield value
+        else:
+            yield from value
+        return
+    text = as_text(value)
+    start = time.monotonic()
+    sent = 0
+    for i in range(0, len(text), chunk_size):
+        delay = start + sent / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        piece = text[i:i + chunk_size]
+        yield piece
+        sent += len(piece)
+
+
+async def record_astream(chunks, on_complete):
+    """record_stream 的异步版本，chunks 为异步迭代器。"""
+    recorded = []
+    try:
+        async for chunk in chunks:
+            if chunk:
+                recorded.append(chunk)
+            yield chunk
+    finally:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+    if recorded:
+        on_complete(tuple(recorded))
+
+
+async def replay_astream(value, rate=DEFAULT_REPLAY_RATE, chunk_size=REPLAY_CHUNK_SIZE):
+    """replay_stream 的异步版本：限速时用 asyncio.sleep 等待，不占用线程。"""
+    if rate <= 0:
+        if isinstance(value, str):
+            yield value
+        else:
+            for chunk in value:
+                yield chunk
+        return
+    text = as_text(value)
+    start = time.monotonic()
+    sent = 0
+    for i in range(0, len(text), chunk_size):
+        delay = start + sent / rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        piece = text[i:i + chunk_size]
+        yield piece
+        sent += len(piece)
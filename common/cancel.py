@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""客户端断开时尽快取消上游流，并统计取消节省的 token 和时间。
+
+游客离开讲解机时客户端会断开连接，但流式接口原来会把上游流一直读到模型说完：
+生成器被关闭后 SDK 的 HTTP 响应没有关闭，上游仍在生成，worker 线程和 token 都被浪费。这里提供：
+    - client_disconnected / close_on_disconnect：每输出一个片段前检查客户端连接是否已关闭
+      （对连接做一次非阻塞的 MSG_PEEK，收到 FIN 或 RST 即为断开），不用等到写失败才发现；
+      不提供底层 socket 的 WSGI 服务器（如 waitress）仍在写失败时由服务器关闭生成器；
+    - UpstreamGuard：包在读取 SDK 流的循环外，生成器被提前关闭（GeneratorExit）时立即关闭上游 HTTP 响应，
+      并按已完整结束的上游流的平均片段数和耗时，估算这次取消节省的 token（以增量片段数近似）和秒数；
+    - closes_chunks / closing：生成器还没开始迭代就被关闭时不会执行 finally（客户端在第一个片段之前断开、
+      Response 没有被迭代），被包装的上游流、上游名额和共享流的订阅都不会释放。
+      包装上游迭代器的生成器函数用 closes_chunks 装饰，关闭时总会关闭被包装的迭代器；
+      stream_with_context 的生成器同样如此，用 closing 包一层；
+    - abort_response：从其他线程（超时定时器、取消）中断阻塞在读取上的 SDK 流；
+    - AbortScope：工作线程在 with 块内打开的上游流（UpstreamGuard）和共享流订阅（SingleFlight）登记到 scope，
+      其他线程调用 abort() 时立即中断它们，不用等到上游发来下一个片段。
+"""
+import functools
+import socket
+import sys
+import threading
+import time
+
+# 非阻塞地窥探连接上是否有数据（Windows 上没有 MSG_DONTWAIT，退回到写失败时才发现断开）
+_PEEK_FLAGS = socket.MSG_PEEK | socket.MSG_DONTWAIT if hasattr(socket, 'MSG_DONTWAIT') else None
+
+
+def client_disconnected(environ):
+    """客户端是否已关闭连接；服务器不提供 socket 或无法判断时返回 False。"""
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None or _PEEK_FLAGS is None:
+        return False
+    try:
+        # 流式响应期间客户端不会再发送数据，可读且读到 EOF 说明对端已关闭
+        return sock.recv(1, _PEEK_FLAGS) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except ConnectionError:
+        return True
+    except (OSError, ValueError):
+        # TLS socket 不支持 recv 标志等情况，无法判断
+        return False
+
+
+class ClosingIterator:
+    """包装生成器 gen：close() 时先关闭 gen，再调用 on_close（只调用一次），不论 gen 是否已经开始迭代。"""
+
+    __slots__ = ('_gen', '_on_close')
+
+    def __init__(self, gen, on_close):
+        self._gen = gen
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._gen)
+
+    def close(self):
+        try:
+            self._gen.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+def closing(gen, chunks):
+    """gen 为包装 chunks 的生成器：返回的迭代器关闭时总会关闭 chunks。"""
+    return ClosingIterator(gen, getattr(chunks, 'close', None))
+
+
+def closes_chunks(wrapper):
+    """装饰包装 chunks（第一个参数）的生成器函数：返回的迭代器关闭时总会关闭 chunks。"""
+    @functools.wraps(wrapper)
+    def wrapped(chunks, *args, **kwargs):
+        return closing(wrapper(chunks, *args, **kwargs), chunks)
+    return wrapped
+
+
+@closes_chunks
+def close_on_disconnect(chunks, environ):
+    """包装响应生成器：客户端断开后不再输出，关闭 chunks（进而关闭上游流）。"""
+    try:
+        for chunk in chunks:
+            if client_disconnected(environ):
+                print(f"INFO: Client {environ.get('REMOTE_ADDR')} disconnected, closing upstream stream",
+                      file=sys.stderr)
+                return
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _http_response(stream):
+    # cozepy 的 .response 是不带 close() 的包装，先取 ._raw_response
+    response = getattr(stream, '_raw_response', None)
+    if response is None:
+        response = getattr(stream, 'response', None)
+    return response
+
+
+def close_response(stream):
+    """关闭 SDK 流底层的 HTTP 响应（zhipuai 为 .response，cozepy 为 ._raw_response），释放上游连接。"""
+    response = _http_response(stream)
+    close = getattr(response, 'close', None) or getattr(stream, 'close', None)
+    if close is not None:
+        close()
+
+
+def abort_response(stream):
+    """从其他线程中断 SDK 流：另一个线程正阻塞在读取上时，只 close() 不会唤醒它（要等到上游发来数据或读超时），
+    先 shutdown httpx 响应底层的 socket，阻塞的读取立即出错返回，再关闭响应。
+
+    没有底层 HTTP 响应的迭代器（如生成器）正在其他线程中执行时不能关闭，此时什么也不做。
+    """
+    response = _http_response(stream)
+    if response is None:
+        return
+    extensions = getattr(response, 'extensions', None)
+    network_stream = extensions.get('network_stream') if isinstance(extensions, dict) else None
+    sock = network_stream.get_extra_info('socket') if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    close = getattr(response, 'close', None)
+    if close is not None:
+        close()
+
+
+class StreamAborted(Exception):
+    """上游流被其他线程通过 AbortScope.abort() 中断。"""
+
+
+_scopes = threading.local()
+
+
+def current_abort_scope():
+    """当前线程所在的最内层 AbortScope，不在任何 scope 中时返回 None。"""
+    stack = getattr(_scopes, 'stack', None)
+    return stack[-1] if stack else None
+
+
+class AbortScope:
+    """从其他线程中断一个工作线程正在读取的上游流：
+
+        scope = AbortScope()
+        with scope:               # 工作线程
+            for chunk in open_answer():
+                ...
+        scope.abort()             # 其他线程
+
+    with 块内（同一线程）打开的上游流登记一个中断回调，abort() 依次执行这些回调，阻塞在读取上的工作线程随即出错返回。
+    abort() 之后才登记的回调立即执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self.aborted = False
+
+    def __enter__(self):
+        if not hasattr(_scopes, 'stack'):
+            _scopes.stack = []
+        _scopes.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _scopes.stack.pop()
+        return False
+
+    def add(self, callback):
+        """登记 abort() 时执行的回调，返回用于 remove() 的 token。"""
+        token = object()
+        with self._lock:
+            if not self.aborted:
+                self._callbacks[token] = callback
+                return token
+        callback()
+        return token
+
+    def remove(self, token):
+        with self._lock:
+            self._callbacks.pop(token, None)
+
+    def abort(self):
+        with self._lock:
+            if self.aborted:
+                return
+            self.aborted = True
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+
+class CancelStats:
+    """上游流完成与取消的统计（线程安全）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.completed_chunks = 0
+        self.completed_seconds = 0.0
+        self.cancelled = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+
+    def record_complete(self, chunks, seconds):
+        with self._lock:
+            self.completed += 1
+            self.completed_chunks += chunks
+            self.completed_seconds += seconds
+
+    def record_cancel(self, chunks, seconds):
+        """记录一次取消，返回估算节省的 (token 数, 秒数)；还没有完成过的流时无法估算，记为 0。"""
+        with self._lock:
+            self.cancelled += 1
+            if not self.completed:
+                return 0, 0.0
+            tokens = max(0, round(self.completed_chunks / self.completed) - chunks)
+            saved = max(0.0, self.completed_seconds / self.completed - seconds)
+            self.tokens_saved += tokens
+            self.seconds_saved += saved
+            return tokens, saved
+
+    def stats(self):
+        with self._lock:
+            return {
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'tokens_saved': self.tokens_saved,
+                'seconds_saved': round(self.seconds_saved, 2),
+                'avg_tokens': round(self.completed_chunks / self.completed, 1) if self.completed else 0.0,
+                'avg_seconds': round(self.completed_seconds / self.completed, 2) if self.completed else 0.0,
+            }
+
+
+# 进程内共享的统计，网关中各服务共用
+CANCEL_STATS = CancelStats()
+
+
+class UpstreamGuard:
+    """读取一条上游流期间使用：
+
+        with UpstreamGuard(response, 'shuziren') as guard:
+            for chunk in response:
+                guard.tick()
+                yield ...
+
+    外层关闭生成器时在 with 处收到 GeneratorExit，随即关闭上游响应并记录取消；
+    在 AbortScope 内进入时，scope 被 abort() 会从其他线程中断上游响应，同样记录为取消；
+    上游出错时同样关闭响应，但不计入统计。
+    """
+
+    def __init__(self, stream, label, stats=None):
+        self.stream = stream
+        self.label = label
+        self.stats = stats or CANCEL_STATS
+        self.chunks = 0
+        self.start = time.monotonic()
+        self.aborted = False
+        self._scope = None
+        self._token = None
+
+    def tick(self, count=1):
+        self.chunks += count
+
+    def _abort(self):
+        self.aborted = True
+        abort_response(self.stream)
+
+    def __enter__(self):
+        self._scope = current_abort_scope()
+        if self._scope is not None:
+            self._token = self._scope.add(self._abort)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._scope is not None:
+            self._scope.remove(self._token)
+        elapsed = time.monotonic() - self.start
+        if exc_type is None:
+            self.stats.record_complete(self.chunks, elapsed)
+            return False
+        close_response(self.stream)
+        if issubclass(exc_type, GeneratorExit) or self.aborted:
+            tokens, seconds = self.stats.record_cancel(self.chunks, elapsed)
+            print(f"INFO: Upstream stream for {self.label} cancelled after {self.chunks} chunks / {elapsed:.2f}s, "
+                  f"saved ~{tokens} tokens / {seconds:.2f}s", file=sys.stderr)
+        return False
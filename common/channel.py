@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""讲解机的 WebSocket 长连接通道：鉴权一次，多个请求复用同一条连接。
+
+讲解机每说一句话都要向 /、/nav 或 /bot 发一个新的 HTTP 请求，每次都要建立连接、解析请求头、校验 auth-key。
+serve_channel 在一条 WebSocket 连接上承载任意多个请求，回答由服务端主动推送（每条消息是一个 JSON 对象）：
+    - 鉴权：握手请求带 auth-key 请求头（"Bearer <key>"），或者连接后发送的第一条消息为
+      {"type": "auth", "auth_key": "Bearer <key>"}；成功时服务端回复 {"type": "ready"}，
+      失败或 auth_timeout 秒内没有鉴权时以关闭码 4401 关闭连接。之后每个请求只检查 key 是否仍在当前的 auth_keys 中
+      （热加载删除的 key 会立即失效，连接随之关闭）；
+    - 请求：{"id": "<请求ID>", "path": "/" | "/nav" | "/bot", ...}，其余字段与对应 HTTP 接口的请求体相同；
+    - 取消：{"type": "cancel", "id": "<请求ID>"}，停止该请求并关闭它的上游流。
+服务端发出的消息都带有请求 ID，多个请求并发执行，各自的消息交错发送：
+    - {"id", "type": "result", "data"}：非流式请求的回答，或 /nav 的导航判断，data 与 HTTP 响应体相同；
+    - {"id", "type": "delta", "data"}：流式回答的片段；{"id", "type": "end"}：流式回答结束，
+      被客户端取消的请求以 {"id", "type": "end", "cancelled": true} 结束；
+    - {"id", "type": "error", "status", "detail"}：状态码和信息与 HTTP 接口相同；无法确定请求 ID 的消息（JSON 格式错误等）
+      的错误不带 id；限速或排队超时（common.admission）的 429 错误带 retry_after（秒）。
+每条连接同时进行的请求数不超过 max_inflight，超出时返回 429 错误。连接断开时取消所有进行中的请求并关闭上游流。
+"""
+import asyncio
+import json
+import os
+
+from common.admission import Rejected
+from common.auth import valid_auth_key
+
+# 每条连接同时进行的请求数上限，以及连接后等待鉴权消息的秒数
+DEFAULT_MAX_INFLIGHT = int(os.environ.get('CHANNEL_MAX_INFLIGHT', '16'))
+DEFAULT_AUTH_TIMEOUT = float(os.environ.get('CHANNEL_AUTH_TIMEOUT', '10'))
+# 鉴权失败时的关闭码（4000~4999 由应用自定义，对应 HTTP 的 401）
+CLOSE_UNAUTHORIZED = 4401
+
+
+class RequestError(Exception):
+    """请求无法处理：HTTP 接口返回 status_code 和 {"detail": detail}，通道返回 error 消息。"""
+
+    def __init__(self, detail, status_code):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class ChannelStats:
+    """通道的运行时统计（只在事件循环中更新，不需要加锁）。"""
+
+    def __init__(self):
+        self.connections = 0
+        self.open = 0
+        self.unauthorized = 0
+        self.requests = 0
+        self.cancelled = 0
+        self.errors = 0
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'open': self.open,
+            'unauthorized': self.unauthorized,
+            'requests': self.requests,
+            'requests_per_connection': round(self.requests / self.connections, 2) if self.connections else 0.0,
+            'cancelled': self.cancelled,
+            'errors': self.errors,
+        }
+
+
+# 进程内共享的统计
+CHANNEL_STATS = ChannelStats()
+
+
+class _Closed(Exception):
+    """连接已经断开，无法再发送消息。"""
+
+
+def _is_stream(reply):
+    return hasattr(reply, '__aiter__')
+
+
+class _Channel:
+
+    def __init__(self, websocket, handlers, auth_keys, max_inflight):
+        self.websocket = websocket
+        self.handlers = handlers
+        self.auth_keys = auth_keys
+        self.max_inflight = max_inflight
+        self.auth_key = None
+        self.closed = False
+        self.tasks = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message):
+        if self.closed:
+            raise _Closed()
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+            except Exception:
+                self.closed = True
+                raise _Closed()
+
+    async def error(self, request_id, status_code, detail, retry_after=None):
+        CHANNEL_STATS.errors += 1
+        message = {'type': 'error', 'status': status_code, 'detail': detail}
+        if request_id is not None:
+            message['id'] = request_id
+        if retry_after is not None:
+            message['retry_after'] = retry_after
+        await self.send(message)
+
+    async def receive(self):
+        """返回下一条消息的文本；连接断开时返回 None。"""
+        message = await self.websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            return None
+        if message.get('text') is not None:
+            return message['text']
+        return (message.get('bytes') or b'').decode('utf-8', 'replace')
+
+    async def authenticate(self, timeout):
+        auth_key = self.websocket.headers.get('auth-key')
+        if auth_key is None:
+            try:
+                text = await asyncio.wait_for(self.receive(), timeout)
+                message = json.loads(text) if text is not None else None
+            except (asyncio.TimeoutError, ValueError):
+                message = None
+            if isinstance(message, dict) and message.get('type') == 'auth':
+                auth_key = message.get('auth_key')
+        if not valid_auth_key(auth_key, self.auth_keys()):
+            return False
+        self.auth_key = auth_key
+        return True
+
+    async def run(self, request_id, handler, data):
+        try:
+            try:
+                reply = await handler(data, self.auth_key)
+            except RequestError as e:
+                return await self.error(request_id, e.status_code, e.detail)
+            except Rejected as e:
+                return await self.error(request_id, 429, e.detail, e.retry_after)
+            except Exception as e:
+                return await self.error(request_id, 500, str(e))
+            if not _is_stream(reply):
+                return await self.send({'id': request_id, 'type': 'result', 'data': reply or ''})
+            try:
+                async for chunk in reply:
+                    if chunk:
+                        await self.send({'id': request_id, 'type': 'delta', 'data': chunk})
+            except _Closed:
+                raise
+            except Exception as e:
+                return await self.error(request_id, 500, str(e))
+            finally:
+                # 提前结束（取消、断开、出错）时关闭上游流
+                await reply.aclose()
+            await self.send({'id': request_id, 'type': 'end'})
+        except asyncio.CancelledError:
+            if not self.closed:
+                CHANNEL_STATS.cancelled += 1
+                try:
+                    await self.send({'id': request_id, 'type': 'end', 'cancelled': True})
+                except _Closed:
+                    pass
+            raise
+        except _Closed:
+            pass
+        finally:
+            if self.tasks.get(request_id) is asyncio.current_task():
+                del self.tasks[request_id]
+
+    async def dispatch(self, text):
+        """处理一条客户端消息；key 已失效时返回 False。"""
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            await self.error(None, 400, 'Invalid message')
+            return True
+        request_id = message.get('id')
+        if not isinstance(request_id, (str, int)):
+            await self.error(None, 400, 'Missing request id')
+            return True
+        if message.get('type') == 'cancel':
+            task = self.tasks.get(request_id)
+            if task is not None:
+                task.cancel()
+            return True
+        if not valid_auth_key(self.auth_key, self.auth_keys()):
+            await self.error(request_id, 401, 'Invalid key')
+            return False
+        handler = self.handlers.get(message.get('path'))
+        if handler is None:
+            await self.error(request_id, 404, f"Unknown path '{message.get('path')}'")
+        elif request_id in self.tasks:
+            await self.error(request_id, 400, 'Duplicate request id')
+        elif len(self.tasks) >= self.max_inflight:
+            await self.error(request_id, 429, 'Too many requests in flight')
+        else:
+            CHANNEL_STATS.requests += 1
+            self.tasks[request_id] = asyncio.ensure_future(self.run(request_id, handler, message))
+        return True
+
+    async def reject(self):
+        CHANNEL_STATS.unauthorized += 1
+        self.closed = True
+        try:
+            await self.websocket.close(CLOSE_UNAUTHORIZED)
+        except Exception:
+            pass
+
+
+async def serve_channel(websocket, handlers, auth_keys, max_inflight=DEFAULT_MAX_INFLIGHT,
+                        auth_timeout=DEFAULT_AUTH_TIMEOUT):
+    """在一条 WebSocket 连接（starlette.websockets.WebSocket）上处理请求，直到连接断开。
+
+    handlers 为 {path: async handler(data, auth_key)}，auth_key 为连接鉴权时使用的 key；handler 返回回答的文本，
+    或者流式回答的异步生成器，无法处理时抛出 RequestError（未被准入时抛出 Rejected）；auth_keys() 返回当前接受的 key。
+    """
+    channel = _Channel(websocket, handlers, auth_keys, max_inflight)
+    await websocket.accept()
+    CHANNEL_STATS.connections += 1
+    CHANNEL_STATS.open += 1
+    try:
+        if not await channel.authenticate(auth_timeout):
+            await channel.reject()
+            return
+        await channel.send({'type': 'ready'})
+        while not channel.closed:
+            text = await channel.receive()
+            if text is None:
+                break
+            if not await channel.dispatch(text):
+                await channel.reject()
+    except _Closed:
+        pass
+    finally:
+        channel.closed = True
+        CHANNEL_STATS.open -= 1
+        tasks = list(channel.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
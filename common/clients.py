@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""进程内共享的大模型客户端。
+
+每个 ZhipuAI 客户端自带一个 httpx 连接池。原来每次加载（包括热加载）config.json 都会新建客户端，
+几个服务各自持有一份。这里按 api_key 复用客户端：热加载不再丢弃已建立的连接，
+网关在同一进程中托管多个服务时，api_key 相同的服务共用同一个连接池。
+"""
+import threading
+
+from zhipuai import ZhipuAI
+
+_CLIENTS = {}
+_LOCK = threading.Lock()
+
+
+def zhipuai_client(api_key):
+    """返回 api_key 对应的 ZhipuAI 客户端，同一个 api_key 只创建一次。"""
+    with _LOCK:
+        client = _CLIENTS.get(api_key)
+        if client is None:
+            client = _CLIENTS[api_key] = ZhipuAI(api_key=api_key)
+        return client
+
+
+def client_count():
+    with _LOCK:
+        return len(_CLIENTS)
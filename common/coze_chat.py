@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""等待 Coze 非流式对话完成并取回回答。
+
+原来的做法是 chat.create 之后每 0.5 秒 chat.retrieve 一次，对话完成后再 chat.messages.list，
+每个回答平均要多等约 250ms（最多 500ms），等待期间还一直占着 worker 线程。这里提供两种方式：
+    - answer_via_stream：改用流式事件接口，收到 CONVERSATION_CHAT_COMPLETED 立即返回所有回答消息拼接的文本，
+      不需要额外的 retrieve / list 请求；读取卡住时由定时器在 max_wait 到达时关闭底层响应，不等 SDK 的读超时；
+    - answer_via_polling：保留轮询作为兜底，但间隔从 50ms 起按倍数退避到 0.5s（不超过原来的固定间隔），
+      短回答能更早被发现，长回答也不会过于频繁地请求。
+两者都返回助手回答的完整文本；对话失败、超时或没有回答时抛出 ChatFailed。
+"""
+import threading
+import time
+
+from cozepy import ChatEventType, ChatStatus, MessageRole, MessageType
+
+from common.cancel import abort_response, close_response
+
+DEFAULT_MAX_WAIT = 60
+POLL_INITIAL_INTERVAL = 0.05
+POLL_MAX_INTERVAL = 0.5
+POLL_BACKOFF = 1.5
+
+
+class ChatFailed(Exception):
+    """对话没有正常产出回答；status 为建议返回给客户端的 HTTP 状态码。"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def _is_answer(message):
+    return (message is not None and message.role == MessageRole.ASSISTANT
+            and message.type == MessageType.ANSWER and message.content)
+
+
+def answer_via_stream(coze_client, bot_id, user_id, messages, max_wait=DEFAULT_MAX_WAIT, **kwargs):
+    """通过流式事件接口获取回答，对话完成时关闭流并返回所有回答消息拼接的文本。
+
+    收到第一个事件之前出错时原样抛出，调用方可以改用轮询；收到事件之后对话已经在服务端建立，
+    再新建对话会重复保存历史，因此出错时返回已经收到的回答，没有回答时抛出 ChatFailed。
+    """
+    deadline = time.monotonic() + max_wait
+    stream = coze_client.chat.stream(bot_id=bot_id, user_id=user_id, additional_messages=messages, **kwargs)
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        abort_response(stream)
+
+    # 到达 max_wait 时关闭底层响应，卡住的读取随之返回，不会一直占着 worker 和 Coze 名额
+    watchdog = threading.Timer(max(deadline - time.monotonic(), 0), expire)
+    watchdog.daemon = True
+    watchdog.start()
+    answers = []
+    deltas = []
+    received = False
+    completed = False
+    error = None
+    try:
+        for event in stream:
+            received = True
+            if event.event == ChatEventType.CONVERSATION_MESSAGE_COMPLETED and _is_answer(event.message):
+                answers.append(event.message.content)
+            elif event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA and _is_answer(event.message):
+                deltas.append(event.message.content)
+            elif event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
+                completed = True
+                break
+            elif event.event == ChatEventType.CONVERSATION_CHAT_FAILED:
+                last_error = event.chat.last_error if event.chat else None
+                raise ChatFailed(f"Chat failed: {last_error}")
+    except ChatFailed:
+        raise
+    except Exception as e:
+        if not received and not expired.is_set():
+            raise
+        error = e
+    finally:
+        watchdog.cancel()
+        # 提前返回时关闭底层 HTTP 响应，不再接收后续事件
+        close_response(stream)
+    if expired.is_set() and not completed:
+        raise ChatFailed(f"Chat timed out after {max_wait} seconds", 504)
+    # 没有收到回答消息的完成事件时退回到拼接增量内容
+    content = ''.join(answers) or ''.join(deltas)
+    if content:
+        return content
+    if error is not None:
+        raise ChatFailed(f"Chat stream interrupted: {error}", 502) from error
+    raise ChatFailed("No content received from bot")
+
+
+def answer_via_polling(coze_client, bot_id, user_id, messages, max_wait=DEFAULT_MAX_WAIT,
+                       initial_interval=POLL_INITIAL_INTERVAL, max_interval=POLL_MAX_INTERVAL, **kwargs):
+    """chat.create 后按退避间隔轮询对话状态，完成后取回助手的回答消息。"""
+    deadline = time.monotonic() + max_wait
+    chat = coze_client.chat.create(bot_id=bot_id, user_id=user_id, additional_messages=messages, **kwargs)
+    interval = initial_interval
+    while chat.status in (ChatStatus.CREATED, ChatStatus.IN_PROGRESS):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ChatFailed(f"Chat timed out after {max_wait} seconds", 504)
+        time.sleep(min(interval, remaining))
+        interval = min(interval * POLL_BACKOFF, max_interval)
+        chat = coze_client.chat.retrieve(conversation_id=chat.conversation_id, chat_id=chat.id)
+    if chat.status != ChatStatus.COMPLETED:
+        raise ChatFailed(f"Chat did not complete successfully. Final status: {chat.status}")
+    messages = coze_client.chat.messages.list(conversation_id=chat.conversation_id, chat_id=chat.id)
+    content = ''.join(message.content for message in messages if _is_answer(message))
+    if not content:
+        raise ChatFailed("No content received from bot")
+    return content
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""复用 TCP/TLS 连接的共享 HTTP 客户端。
+
+直接调用 requests.post 每次都会新建连接，到 open.bigmodel.cn 要重新做一次 TCP + TLS 握手。
+这里用一个进程内共享的 requests.Session 保持长连接：
+    - 每个主机的连接池大小固定（pool_block），超出时请求排队等待空闲连接，而不是无限新建；
+    - 默认带连接/读取超时，上游卡住时不会一直占着 worker；
+    - 统计连接复用率和排队等待情况，用来确定连接池大小。
+流式响应必须读完或显式 close() 才会把连接还回连接池，见 iter_stream_lines。
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 每个上游主机保持的连接数，以及连接、读取、等待空闲连接的超时（秒），可通过环境变量调整
+DEFAULT_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+DEFAULT_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '60'))
+DEFAULT_POOL_TIMEOUT = float(os.environ.get('HTTP_POOL_TIMEOUT', '30'))
+
+
+class PoolStats:
+    """连接池统计（线程安全）。"""
+
+    def __init__(self, pool_timeout):
+        self.pool_timeout = pool_timeout
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.reused = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def wait_begin(self):
+        with self._lock:
+            self.waiting += 1
+            self.waits += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def wait_end(self, seconds):
+        with self._lock:
+            self.waiting -= 1
+            self.wait_seconds += seconds
+
+    def checkout(self, reused):
+        with self._lock:
+            self.checkouts += 1
+            if reused:
+                self.reused += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'reused': self.reused,
+                'new_connections': self.checkouts - self.reused,
+                'reuse_rate': round(self.reused / self.checkouts, 4) if self.checkouts else 0.0,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'waits': self.waits,
+                'avg_wait_ms': round(self.wait_seconds / self.waits * 1000, 2) if self.waits else 0.0,
+            }
+
+
+class _CountingPoolMixin:
+    """在取连接时记录是否复用了已有连接、是否需要排队。"""
+
+    pool_stats = None
+
+    def _get_conn(self, timeout=None):
+        stats = self.pool_stats
+        if timeout is None:
+            timeout = stats.pool_timeout
+        # 阻塞模式下队列为空说明所有连接都被占用，本次需要排队
+        waiting = self.block and self.pool is not None and self.pool.empty()
+        if waiting:
+            stats.wait_begin()
+            start = time.monotonic()
+        try:
+            conn = super()._get_conn(timeout)
+        finally:
+            if waiting:
+                stats.wait_end(time.monotonic() - start)
+        # 新建或已断开重置的连接还没有 socket
+        stats.checkout(getattr(conn, 'sock', None) is not None)
+        return conn
+
+
+class _PooledAdapter(HTTPAdapter):
+
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {'pool_stats': self._stats}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CountingHTTPConnectionPool', (_CountingPoolMixin, HTTPConnectionPool), attrs),
+            'https': type('CountingHTTPSConnectionPool', (_CountingPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+
+class PooledSession(requests.Session):
+    """带连接池统计和默认超时的 requests.Session，可在多个线程间共享。
+
+    pool_size 为每个主机的最大连接数，所有连接都被占用时请求最多排队 pool_timeout 秒。
+    请求未显式传 timeout 时使用 (connect_timeout, read_timeout)。
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, pool_timeout=DEFAULT_POOL_TIMEOUT):
+        super().__init__()
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_stats = PoolStats(pool_timeout)
+        adapter = _PooledAdapter(self.pool_stats, pool_connections=pool_size,
+                                 pool_maxsize=pool_size, pool_block=True)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def stats(self):
+        stats = self.pool_stats.snapshot()
+        stats['pool_size'] = self.pool_size
+        stats['connect_timeout'], stats['read_timeout'] = self.timeout
+        return stats
+
+
+def iter_stream_lines(response):
+    """逐行读取流式响应，结束、出错或调用方提前关闭生成器时都会释放连接。"""
+    try:
+        for line in response.iter_lines():
+            yield line
+    finally:
+        response.close()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""导航意图的本地快速判断。
+
+数字人每轮对话都会先调用 /nav 判断是否需要导航（NEEDNAV），再调用 / 获取回答，一轮两次大模型调用。
+而大部分问题（“门票多少钱”“讲个故事”）显然不需要导航。IntentClassifier 在本地先判断一次：
+    - 关键词规则：问题里有导航相关的说法（“去”“在哪”“附近”等）或字面提到了某个 POI 时，一律交给大模型；
+    - 线性模型：对字符 1~3-gram 做逻辑回归，需要导航的概率不超过阈值时直接判为不需要导航。
+只会在本地给出“不需要导航”，拿不准的问题都交给大模型，宁可多调用也不误判。
+
+模型用带标注的 JSONL 训练（每行 {"query": "...", "NEEDNAV": "Y" 或 "N"}），
+保存为 JSON 的权重文件，训练和评估见 benchmarks/eval_intent.py。
+"""
+import json
+import math
+import random
+import threading
+
+from common.normalize import normalize
+
+DEFAULT_THRESHOLD = 0.2
+# 出现这些说法时不在本地判为不需要导航
+NAV_HINT_WORDS = ('去', '走', '在哪', '哪里', '哪儿', '哪边', '带我', '导航', '位置', '附近', '路线', '怎么到',
+                  '多远', '远吗', '方向', '找')
+
+
+def features(query):
+    """归一化后的字符 1~3-gram 集合。"""
+    text = normalize(query)[0]
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return grams
+
+
+def _sigmoid(z):
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def load_examples(path):
+    """读取带标注的 JSONL，返回 [(问题, 是否需要导航)]。"""
+    examples = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                examples.append((item['query'], str(item['NEEDNAV']).upper() == 'Y'))
+    return examples
+
+
+class IntentModel:
+    """字符 n-gram 的逻辑回归，输出问题需要导航的概率（构建后只读）。"""
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights or {}
+        self.bias = bias
+
+    def probability(self, query):
+        weights = self.weights
+        z = self.bias
+        for gram in features(query):
+            z += weights.get(gram, 0.0)
+        return _sigmoid(z)
+
+    @classmethod
+    def train(cls, examples, epochs=30, learning_rate=0.2, l2=1e-4, seed=0):
+        """用随机梯度下降训练，examples 为 [(问题, 是否需要导航)]。"""
+        samples = [(features(query), 1.0 if label else 0.0) for query, label in examples]
+        weights = {}
+        bias = 0.0
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(samples)
+            for grams, label in samples:
+                z = bias + sum(weights.get(gram, 0.0) for gram in grams)
+                gradient = _sigmoid(z) - label
+                bias -= learning_rate * gradient
+                for gram in grams:
+                    weight = weights.get(gram, 0.0)
+                    weights[gram] = weight - learning_rate * (gradient + l2 * weight)
+        return cls({gram: weight for gram, weight in weights.items() if abs(weight) > 1e-6}, bias)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'bias': self.bias, 'weights': self.weights}, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(data['weights'], data['bias'])
+
+
+class IntentClassifier:
+    """关键词规则 + 线性模型：判断问题是否明显不需要导航。"""
+
+    def __init__(self, model, poi_resolver=None, threshold=DEFAULT_THRESHOLD, hint_words=NAV_HINT_WORDS):
+        self.model = model
+        self.poi_resolver = poi_resolver
+        self.threshold = threshold
+        self.hint_words = tuple(normalize(word)[0] for word in hint_words)
+        self._counts = {'local': 0, 'rule': 0, 'model': 0}
+        self._lock = threading.Lock()
+
+    def escalation_reason(self, query):
+        """不能在本地判为不需要导航时返回原因（rule / model），否则返回 None。"""
+        if not isinstance(query, str):
+            return 'rule'
+        text = normalize(query)[0]
+        if any(word in text for word in self.hint_words):
+            return 'rule'
+        if self.poi_resolver is not None and self.poi_resolver.mentions(query):
+            return 'rule'
+        if self.model.probability(query) > self.threshold:
+            return 'model'
+        return None
+
+    def is_chat(self, query):
+        """问题明显不需要导航时返回 True；拿不准时返回 False，交给大模型判断。"""
+        reason = self.escalation_reason(query)
+        with self._lock:
+            self._counts[reason or 'local'] += 1
+        return reason is None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            'threshold': self.threshold,
+            'features': len(self.model.weights),
+            'local': counts['local'],
+            'escalated_by_rule': counts['rule'],
+            'escalated_by_model': counts['model'],
+            'local_rate': counts['local'] / total if total else 0.0,
+        }
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""去除大模型回答中的 markdown 格式符号。
+
+数字人直接朗读回答文本，"**"、"#"、"- " 之类的符号需要在输出前去掉。
+原来的 clean_markdown 对每个流式 delta 单独跑约 20 个 re.sub：
+    - 跨 chunk 的格式（"**加" + "粗**"）会漏删或删错；
+    - 每个 chunk 末尾的 strip() 会吃掉 chunk 之间的空格；
+    - 每个 chunk 都要把整条正则链重新跑一遍。
+
+去除规则与原正则链逐条一致。原正则链按顺序作用于整段文本，后面的规则作用在前面规则的结果上：
+    1. 原文行首的 "#" 连同之后的空白删除；
+    2. "*"、"_"、"~" 全部删除；
+    3. "```...```" 代码块整体删除，其余的 "`" 全部删除；
+    4. [文字](链接) 保留文字；
+    5. ![](图片) 删除；
+    6. 行首的 ">"、"-"/"+"、"1." 依次删除，连同之后的空白（可以跨行）；
+       "|" 视为空白；"-" 删除后仍有 3 个以上 "-" 的行（分割线）删除；
+    7. 连续空白合并成一个空格，首尾空白去掉。
+例如 "`1`. 第一步" 删除反引号后成为 "1. 第一步"，行首的 "1." 随后也会删除。
+
+MarkdownStripper 把每条规则实现为一个流式过滤器，按同样的顺序串起来：每个过滤器只暂存还不能确定的
+部分（行首的数字、可能的链接 "[..."、未闭合的代码块等），其余文本一确定就交给下一个过滤器。
+普通文本按段整体拷贝，只有遇到特殊字符时才逐字符处理，各条规则都是线性时间。
+与原正则链唯一的不同：流式处理时，超过 MAX_LINK_HOLD 个字符仍未闭合的链接或图片按普通文本输出，
+不再等待后续输入（clean_markdown 整段处理，没有这个限制）。
+"""
+import re
+
+from common.cancel import closes_chunks
+
+# 空白（"|" 已替换成空格）在每次输出上统一合并
+_WS = re.compile(r'\s+')
+_LINK_PREFIX = re.compile(r'\[(?:[^\]]+(?:\](?:\([^\)]*)?)?)?\Z')
+_IMAGE_PREFIX = re.compile(r'!(?:\[(?:[^\]]*(?:\](?:\([^\)]*)?)?)?)?\Z')
+# 可能以标记开头的行（普通的行整段跳过）
+_HEADING_LINE = re.compile(r'\n(?=#)')
+_MARKED_LINE = re.compile(r'\n(?=[>+\-\d])')
+# 常见的行首标记组合（不跨行）加上之后的普通字符，一次匹配；匹配不上时退回逐字符处理
+_PLAIN_PREFIX = re.compile(r'(?:>[^\S\n]*)?(?:[-+][^\S\n]*)?(?:\d+\.[^\S\n]*)?(?=[^\s>+\-\d])')
+
+# 未闭合的链接最多暂存的字符数，超过后按普通文本输出
+MAX_LINK_HOLD = 256
+
+# 行首依次尝试的格式：标题 "#"（只看原文）、引用 ">"、列表 "-"/"+"、有序列表 "1."、分割线 "---"，
+# 都不是时为普通文本；_EAT 为删除行首标记之后的空白
+_HEADING, _HASHES, _QUOTE, _LIST, _ORDERED, _RULE, _TEXT, _EAT = range(8)
+
+
+class _Headings:
+    """规则 1、2：原文行首的 "#" 连同之后的空白删除，"*"、"_"、"~" 全部删除；不需要暂存。"""
+
+    __slots__ = ('_stage', '_newline')
+
+    def __init__(self):
+        self._stage = _HEADING
+        self._newline = False  # 删除的空白是否以换行结尾（之后仍是原文的行首）
+
+    def feed(self, text):
+        out = []
+        i = 0
+        n = len(text)
+        stage = self._stage
+        while i < n:
+            if stage == _TEXT:
+                m = _HEADING_LINE.search(text, i)
+                if m is None:
+                    out.append(text[i:])
+                    if text.endswith('\n'):
+                        stage = _HEADING
+                    break
+                out.append(text[i:m.end()])
+                stage = _HEADING
+                i = m.end()
+            elif stage == _HEADING:
+                if text[i] == '#':
+                    stage = _HASHES
+                    i += 1
+                else:
+                    stage = _TEXT
+            elif stage == _HASHES:
+                if text[i] == '#':
+                    i += 1
+                else:
+                    stage = _EAT
+                    self._newline = False
+            else:  # _EAT
+                c = text[i]
+                if c.isspace():
+                    self._newline = c == '\n'
+                    i += 1
+                else:
+                    stage = _HEADING if self._newline else _TEXT
+        self._stage = stage
+        return _drop(''.join(out))
+
+
+class _Code:
+    """规则 3：删除代码块和反引号。"""
+
+    __slots__ = ('_pending',)
+
+    def __init__(self):
+        self._pending = ''
+
+    def feed(self, text, final):
+        text = self._pending + text
+        self._pending = ''
+        if '`' not in text:
+            return text
+        out = []
+        i = 0
+        n = len(text)
+        while True:
+            j = text.find('`', i)
+            if j == -1:
+                out.append(text[i:])
+                break
+            out.append(text[i:j])
+            k = _backticks(text, j, n, final)
+            if k is None:
+                self._pending = text[j:]
+                break
+            i = k
+        return ''.join(out)
+
+
+class _Links:
+    """规则 4、5：marker 为 "[" 时把 [文字](链接) 换成文字；为 "!" 时把 ![文字](图片) 换成文字
+    （此时文字总是为空，非空的已经按链接处理过）。"""
+
+    __slots__ = ('_pending', '_marker', '_prefix', '_skip', '_min_text')
+
+    def __init__(self, marker):
+        self._pending = ''
+        self._marker = marker
+        if marker == '[':
+            self._prefix, self._skip, self._min_text = _LINK_PREFIX, 1, 1
+        else:
+            self._prefix, self._skip, self._min_text = _IMAGE_PREFIX, 2, 0
+
+    def feed(self, text, final):
+        text = self._pending + text
+        self._pending = ''
+        marker = self._marker
+        if marker not in text:
+            return text
+        out = []
+        i = 0
+        n = len(text)
+        found = {}  # 查找 "]"、")" 的结果缓存，避免大量 "[" 时反复扫描到文本末尾
+        while True:
+            j = text.find(marker, i)
+            if j == -1:
+                out.append(text[i:])
+                break
+            out.append(text[i:j])
+            start = j + self._skip
+            if text.startswith('[', start - 1):
+                # 文字到第一个 "]" 为止，链接到第一个 ")" 为止，链接不能为空
+                close = _find(text, ']', start, found)
+                if close - start >= self._min_text and text.startswith('(', close + 1):
+                    end = _find(text, ')', close + 2, found)
+                    if end > close + 2:
+                        out.append(text[start:close])
+                        i = end + 1
+                        continue
+            if not final and n - j <= MAX_LINK_HOLD and self._prefix.match(text, j):
+                self._pending = text[j:]
+                break
+            out.append(marker)
+            i = j + 1
+        return ''.join(out)
+
+
+class _Lines:
+    """规则 6：行首的 ">"、"-"/"+"、"1." 和分割线。"""
+
+    __slots__ = ('_pending', '_stage', '_eat_next', '_newline')
+
+    def __init__(self):
+        self._pending = ''
+        self._stage = _QUOTE
+        self._eat_next = _TEXT  # 删除行首标记之后的空白后进入的阶段
+        self._newline = False  # 删除的空白是否以换行结尾（之后是新的一行）
+
+    def feed(self, text, final):
+        text = self._pending + text
+        out = []
+        stop = self._scan(text, final, out)
+        self._pending = text[stop:]
+        return ''.join(out)
+
+    def _eat(self, next_stage):
+        self._stage = _EAT
+        self._eat_next = next_stage
+        self._newline = False
+
+    def _scan(self, text, final, out):
+        """处理 text，返回处理到的位置；之后的内容需要更多输入才能确定（final 为真时总是处理完）。"""
+        i = 0
+        n = len(text)
+        while i < n:
+            stage = self._stage
+            if stage == _TEXT:
+                m = _MARKED_LINE.search(text, i)
+                if m is None:
+                    out.append(text[i:])
+                    if text.endswith('\n'):
+                        self._stage = _QUOTE
+                    return n
+                out.append(text[i:m.end()])
+                self._stage = _QUOTE
+                i = m.end()
+                continue
+            c = text[i]
+            if stage == _EAT:
+                if c.isspace():
+                    self._newline = c == '\n'
+                    i += 1
+                else:
+                    # 删除的空白以换行结尾时，后面的内容是新的一行
+                    self._stage = _QUOTE if self._newline else self._eat_next
+            elif stage == _QUOTE:
+                m = _PLAIN_PREFIX.match(text, i)
+                if m is not None:
+                    self._stage = _TEXT
+                    i = m.end()
+                elif c == '>':
+                    self._eat(_LIST)
+                    i += 1
+                elif c == '-' or c == '+' or c.isdecimal():
+                    self._stage = _LIST
+                else:
+                    # 其余格式都以 "-"、"+" 或数字开头
+                    self._stage = _TEXT
+            elif stage == _LIST:
+                if c == '-' or c == '+':
+                    self._eat(_ORDERED)
+                    i += 1
+                else:
+                    self._stage = _ORDERED
+            elif stage == _ORDERED:
+                if c.isdecimal():
+                    j = i + 1
+                    while j < n and text[j].isdecimal():
+                        j += 1
+                    if j == n and not final:
+                        return i
+                    if j < n and text[j] == '.':
+                        self._eat(_RULE)
+                        i = j + 1
+                    else:
+                        self._stage = _TEXT
+                        out.append(text[i:j])
+                        i = j
+                else:
+                    self._stage = _RULE
+            else:  # _RULE
+                self._stage = _TEXT
+                if c == '-':
+                    j = i + 1
+                    while j < n and text[j] == '-':
+                        j += 1
+                    k = j
+                    while k < n and text[k] != '\n' and (text[k].isspace() or text[k] == '|'):
+                        k += 1
+                    if k == n and not final:
+                        self._stage = _RULE
+                        return i
+                    if j - i >= 3 and (k == n or text[k] == '\n'):
+                        # 整行都是分割线，删除
+                        i = k
+        return n
+
+
+class MarkdownStripper:
+    """流式去除 markdown 格式：feed(chunk) 返回可以确定输出的文本，结束时调用 flush()。"""
+
+    __slots__ = ('_headings', '_code', '_links', '_images', '_lines', '_space', '_started')
+
+    def __init__(self):
+        self._headings = _Headings()
+        self._code = _Code()
+        self._links = _Links('[')
+        self._images = _Links('!')
+        self._lines = _Lines()
+        self._space = False  # 上次输出之后是否出现过空白
+        self._started = False  # 是否已经输出过非空白字符
+
+    def feed(self, chunk):
+        return self._collapse(self._filter(chunk, False))
+
+    def flush(self):
+        # 末尾的空白不再输出
+        return self._collapse(self._filter('', True))
+
+    def _filter(self, text, final):
+        text = self._headings.feed(text)
+        text = self._code.feed(text, final)
+        text = self._links.feed(text, final)
+        text = self._images.feed(text, final)
+        return self._lines.feed(text, final)
+
+    def _collapse(self, text):
+        """合并空白；首尾的空白记在 _space 上，等到下一段非空白输出时才补一个空格。"""
+        if '|' in text:
+            text = text.replace('|', ' ')
+        text = _WS.sub(' ', text)
+        if not text:
+            return text
+        if text[0] == ' ':
+            self._space = True
+            text = text[1:]
+        trailing = text.endswith(' ')
+        if trailing:
+            text = text[:-1]
+        if text:
+            if self._space and self._started:
+                text = ' ' + text
+            self._started = True
+            self._space = trailing
+        return text
+
+
+def _backticks(text, i, n, final):
+    """处理从 i 开始的一串反引号，返回之后的位置；需要更多输入时返回 None。"""
+    j = i
+    while j < n and text[j] == '`':
+        j += 1
+    if j == n and not final:
+        return None
+    # 每 6 个连续反引号本身就是一个空代码块；剩下不足 3 个时直接删除
+    if (j - i) % 6 < 3:
+        return j
+    # 剩下的最后 3 个反引号开始一个代码块，找下一个 "```" 结束
+    end = text.find('`', j)
+    if end == -1:
+        return j if final else None
+    if text.startswith('```', end):
+        return end + 3
+    if not final and '```'.startswith(text[end:]):
+        return None
+    # 代码块没有闭合：开头的反引号删除，内容按普通文本处理
+    return j
+
+
+def _drop(text):
+    """规则 2：删除 "*"、"_"、"~"。"""
+    if '*' in text:
+        text = text.replace('*', '')
+    if '_' in text:
+        text = text.replace('_', '')
+    if '~' in text:
+        text = text.replace('~', '')
+    return text
+
+
+def _find(text, char, start, found):
+    """text.find(char, start)，结果按字符缓存：之前从更靠前的位置找到的结果仍在 start 之后时直接复用。"""
+    cached = found.get(char)
+    if cached is not None and cached[0] <= start and (cached[1] == -1 or cached[1] >= start):
+        return cached[1]
+    pos = text.find(char, start)
+    found[char] = (start, pos)
+    return pos
+
+
+def clean_markdown(text):
+    """整段去除 markdown 格式，结果与原来的正则链一致；非字符串原样返回。"""
+    if not isinstance(text, str):
+        return text
+    stripper = MarkdownStripper()
+    text = stripper._filter(text, True)
+    if '|' in text:
+        text = text.replace('|', ' ')
+    return _WS.sub(' ', text).strip()
+
+
+@closes_chunks
+def strip_stream(chunks):
+    """包装一个文本 chunk 生成器，流式去除 markdown 格式。"""
+    stripper = MarkdownStripper()
+    try:
+        for chunk in chunks:
+            if chunk:
+                text = stripper.feed(chunk)
+                if text:
+                    yield text
+        rest = stripper.flush()
+        if rest:
+            yield rest
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+async def strip_astream(chunks):
+    """strip_stream 的异步版本，chunks 为异步迭代器。"""
+    stripper = MarkdownStripper()
+    try:
+        async for chunk in chunks:
+            if chunk:
+                text = stripper.feed(chunk)
+                if text:
+                    yield text
+        rest = stripper.flush()
+        if rest:
+            yield rest
+    finally:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""敏感词匹配前的文本归一化。
+
+用户常用全角字符、在词中间插空格/标点、或改用繁体字来绕过敏感词过滤。
+这里把每个字符折叠成统一形式：
+    - 宽度：NFKC（全角 ＡＢＣ１２３ → ABC123，半角片假名 → 全角）
+    - 大小写：casefold
+    - 繁简：繁体 → 简体（安装了 opencc 时使用 opencc，否则使用内置常用字表）
+    - 分隔符：空白、标点、符号、控制/零宽字符直接丢弃
+
+折叠是逐字符进行的，因此可以和 Aho-Corasick 自动机在同一遍扫描里完成，
+并且能记录每个归一化字符对应的原文位置。
+"""
+import unicodedata
+
+try:
+    import opencc
+    _T2S = opencc.OpenCC('t2s')
+except Exception:  # opencc 是可选依赖
+    _T2S = None
+
+# 内置的常用繁体 → 简体对照表（每两个字一组：繁体在前，简体在后）
+_TRAD_SIMP_PAIRS = (
+    "這这個个們们來来時时會会說说對对國国學学過过後后開开關关門门問问間间長长東东車车"
+    "發发現现點点頭头體体機机動动還还進进見见覺觉電电話话語语讓让認认識识應应當当從从"
+    "無无與与為为兩两樣样麼么實实際际經经濟济歷历產产業业華华黨党軍军區区縣县鄉乡鎮镇"
+    "廣广場场報报紙纸書书寫写讀读聽听買买賣卖錢钱貨货價价費费貴贵賤贱藥药醫医遠远處处"
+    "飛飞鳥鸟魚鱼馬马龍龙鳳凤雞鸡鴨鸭豬猪貓猫愛爱戀恋歡欢樂乐聲声氣气風风雲云雙双裡里"
+    "裏里邊边號号碼码線线網网絡络連连運运達达選选擇择變变轉转輕轻親亲戰战爭争殺杀槍枪"
+    "彈弹賭赌穢秽黃黄傳传統统權权鬥斗獨独臺台灣湾習习總总結结組组織织團团隊队員员領领"
+    "導导師师歲岁萬万億亿數数據据題题顏颜圖图畫画藝艺術术劇剧園园遊游覽览館馆廳厅樓楼"
+    "橋桥廁厕衛卫務务飯饭麵面燒烧飲饮湯汤雜杂誌志記记憶忆錄录證证護护險险檢检驗验測测"
+    "試试課课練练眾众議议論论討讨訪访談谈謝谢請请該该誰谁給给錯错誤误紅红綠绿藍蓝銀银"
+    "鐵铁鋼钢鐘钟錶表鏡镜闆板壞坏舊旧薦荐燈灯熱热溫温濕湿滿满漢汉貝贝財财貸贷質质購购"
+    "貿贸資资賓宾寶宝觀观視视頁页順顺須须預预頻频類类顯显願愿飄飘餘余駐驻髮发鬧闹鮮鲜"
+    "鳴鸣麗丽齊齐齒齿龜龟傷伤儀仪優优償偿兒儿內内則则剛刚劃划劑剂勞劳勢势勵励勸劝協协"
+    "單单參参嚴严圍围塊块壓压壯壮夢梦奪夺奮奋婦妇孫孙寧宁審审將将專专尋寻層层島岛帥帅"
+    "帶带幫帮幾几廟庙廠厂張张彎弯徑径復复徵征態态懷怀戲戏戶户擁拥擊击擔担擴扩攝摄敵敌"
+    "斷断暫暂曆历曉晓條条極极構构標标橫横檔档歸归殘残決决沒没況况淚泪淺浅準准滅灭漁渔"
+    "潔洁澤泽災灾烏乌煙烟營营爺爷牆墙狀状獎奖獲获環环畢毕異异療疗盡尽監监盤盘礎础確确"
+    "禮礼禱祷種种稱称穩稳窮穷競竞筆笔節节範范築筑簡简糧粮約约級级紀纪細细終终綜综緊紧"
+    "縮缩績绩續续罰罚聖圣聯联職职腦脑臉脸興兴舉举艦舰莊庄葉叶蓋盖蘇苏蘭兰蟲虫裝装製制"
+    "複复襲袭規规計计訂订訓训設设許许評评詞词詢询誠诚詳详調调講讲讚赞豐丰負负責责貧贫"
+    "趙赵趕赶躍跃軟软較较載载輔辅輛辆輸输辦办農农迴回遞递遲迟適适遺遗郵邮鄰邻醜丑釋释"
+    "針针鈔钞銷销鋒锋鍵键鎖锁閉闭閱阅闊阔陣阵陰阴陳陈陸陆陽阳隨随隱隐雖虽難难離离靜静"
+    "響响項项頓顿養养驅驱驚惊鬆松麥麦獄狱屍尸幣币")
+TRAD_TO_SIMP = dict(zip(_TRAD_SIMP_PAIRS[::2], _TRAD_SIMP_PAIRS[1::2]))
+
+# 归一化后会被丢弃的 Unicode 类别：分隔符(Z*)、标点(P*)、符号(S*)、控制/格式字符(C*)
+_DROP_CATEGORIES = ('Z', 'P', 'S', 'C')
+
+# 字符 → 折叠结果的缓存，折叠结果可能是空串（被丢弃）或多个字符（如 NFKC 展开）
+_FOLD_CACHE = {}
+# 缓存上限，防止恶意构造的生僻字符把缓存撑大
+_FOLD_CACHE_LIMIT = 65536
+
+
+def _to_simplified(ch):
+    if _T2S is not None:
+        return _T2S.convert(ch)
+    return TRAD_TO_SIMP.get(ch, ch)
+
+
+def fold_char(ch):
+    """把单个字符折叠成归一化形式，返回字符串（可能为空或多于一个字符）。"""
+    folded = _FOLD_CACHE.get(ch)
+    if folded is not None:
+        return folded
+    parts = []
+    for c in unicodedata.normalize('NFKC', ch).casefold():
+        if unicodedata.category(c)[0] in _DROP_CATEGORIES:
+            continue
+        parts.append(_to_simplified(c))
+    folded = ''.join(parts)
+    if len(_FOLD_CACHE) < _FOLD_CACHE_LIMIT:
+        _FOLD_CACHE[ch] = folded
+    return folded
+
+
+def normalize(text):
+    """归一化整段文本。
+
+    返回 (normalized, offsets)：offsets[i] 是 normalized[i] 在原文中的下标，
+    用于把命中位置映射回原始查询以便记录日志。
+    """
+    chars = []
+    offsets = []
+    for i, ch in enumerate(text):
+        folded = _FOLD_CACHE.get(ch)
+        if folded is None:
+            folded = fold_char(ch)
+        for c in folded:
+            chars.append(c)
+            offsets.append(i)
+    return ''.join(chars), offsets
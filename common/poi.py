@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""导航问题的本地 POI 解析。
+
+/nav 的每个问题原来都要调用一次大模型来判断是否需要导航、目的地是哪里，耗时约 1 秒。
+而游客的导航问题大多是“带我去X”“X在哪里”这类固定说法，X 就是 poi.csv 里的某个名称或别名。
+PoiResolver 把别名、导航意图词和口头语放进同一棵字典树，对归一化后的问题做正向最长匹配切分：
+只有出现了导航意图词、恰好命中一个 POI、并且没有剩下任何无法识别的字时才直接给出目的地，
+其余情况（没有意图词、提到多个 POI、带有否定或其他内容等）都交给大模型判断。
+字面没有命中 POI 时依次尝试：
+    - 拼音：同音错别字（“游克中心”）按拼音音节切分后命中，需要安装 pypinyin，未安装时跳过；
+    - 编辑距离：剩下的唯一一段文字与某个至少 3 个字的别名只差一个字，并且只对应一个 POI；
+      差的字是数字或方位（东南西北）时不纠正，“二号停车场”“南广场”往往是另一个地点，交给大模型判断。
+
+PoiIndex 用于缩短提示词：系统提示词原来附带全部 POI 和别名，景区越大预填充越慢。
+这里按名称、别名和类别建立字符 n-gram 的 BM25 索引，每个问题只取最相关的 k 个 POI 放进提示词。
+"""
+from collections import Counter, namedtuple
+import csv
+import math
+import threading
+
+from common.normalize import normalize
+
+try:
+    from pypinyin import lazy_pinyin
+except Exception:  # pypinyin 是可选依赖
+    lazy_pinyin = None
+
+# 表示要去某个地方的说法
+NAV_INTENT_WORDS = ('带我去', '领我去', '我要去', '我想去', '想去', '要去', '去', '导航到', '导航去', '前往',
+                    '怎么走', '怎么去', '在哪', '在哪里', '在哪儿', '在什么地方')
+# 不影响判断的口头语
+FILLER_WORDS = ('请问', '你好', '请', '帮我', '麻烦', '一下', '我', '的', '吗', '呢', '吧', '啊', '呀', '哦', '嘛',
+                '可以', '能', '现在')
+# 编辑距离兜底只用于足够长的别名，避免“南门”被纠正成“东门”
+MIN_FUZZY_LENGTH = 3
+# 编辑距离兜底不纠正的字（另有阿拉伯数字）：只差这些字的往往是另一个地点，如“二号停车场”和“一号停车场”
+ANCHOR_CHARS = frozenset('零〇一二三四五六七八九十百千万两东南西北')
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 解析结果：poi 为标准名称，method 为 exact / pinyin / edit
+PoiMatch = namedtuple('PoiMatch', ['poi', 'method'])
+
+# 字典树中词的种类；同一个词有多种身份时 POI 优先
+_FILLER, _INTENT, _POI = range(3)
+
+
+def _insert(trie, units, kind, value):
+    node = trie
+    for unit in units:
+        node = node.setdefault(unit, {})
+    term = node.get(None)
+    if term is None or kind >= term[0]:
+        node[None] = (kind, value)
+
+
+def _segment(trie, units):
+    """正向最长匹配切分，返回 (命中的 POI 标准名称集合, 是否有导航意图词, 未识别的片段列表 [(start, end)])。"""
+    pois = set()
+    intent = False
+    residual = []
+    run_start = None
+    i = 0
+    n = len(units)
+    while i < n:
+        node = trie
+        best = None
+        j = i
+        while j < n:
+            node = node.get(units[j])
+            if node is None:
+                break
+            j += 1
+            term = node.get(None)
+            if term is not None:
+                best = (j, term)
+        if best is None:
+            if run_start is None:
+                run_start = i
+            i += 1
+            continue
+        if run_start is not None:
+            residual.append((run_start, i))
+            run_start = None
+        i, (kind, value) = best
+        if kind == _POI:
+            pois.add(value)
+        elif kind == _INTENT:
+            intent = True
+    if run_start is not None:
+        residual.append((run_start, n))
+    return pois, intent, residual
+
+
+def _is_anchor(char):
+    return char.isdecimal() or char in ANCHOR_CHARS
+
+
+def _within_one_edit(a, b):
+    """a 与 b 的编辑距离是否不超过 1，并且不同的字都不是数字或方位字。"""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if la > lb:
+        a, b, la, lb = b, a, lb, la
+    if lb - la > 1:
+        return False
+    i = 0
+    while i < la and a[i] == b[i]:
+        i += 1
+    if _is_anchor(b[i]):
+        return False
+    if la == lb:
+        return not _is_anchor(a[i]) and a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class PoiResolver:
+    """由 poi.csv 的别名映射编译出的本地导航解析器（构建后只读，可在多线程间共享）。"""
+
+    def __init__(self, poi_mapping, intent_words=NAV_INTENT_WORDS, filler_words=FILLER_WORDS):
+        self._trie = {}
+        self._pinyin_trie = {} if lazy_pinyin is not None else None
+        # 别名长度 → [(归一化后的别名, 标准名称)]，编辑距离兜底时只比较长度相差不超过 1 的别名
+        self._fuzzy = {}
+        words = [(word, _FILLER, None) for word in filler_words]
+        words += [(word, _INTENT, None) for word in intent_words]
+        words += [(alias, _POI, standard) for alias, standard in poi_mapping.items()]
+        self.size = 0
+        for word, kind, value in words:
+            key = normalize(word)[0]
+            if not key:
+                continue
+            _insert(self._trie, key, kind, value)
+            if self._pinyin_trie is not None:
+                _insert(self._pinyin_trie, lazy_pinyin(key), kind, value)
+            if kind == _POI:
+                self.size += 1
+                if len(key) >= MIN_FUZZY_LENGTH:
+                    self._fuzzy.setdefault(len(key), []).append((key, value))
+        self._counts = {'exact': 0, 'pinyin': 0, 'edit': 0, 'deferred': 0}
+        self._lock = threading.Lock()
+
+    def resolve(self, query):
+        """问题明确要去唯一的 POI 时返回 PoiMatch，否则返回 None（交给大模型判断）。"""
+        match = self._resolve(query) if isinstance(query, str) else None
+        with self._lock:
+            self._counts[match.method if match is not None else 'deferred'] += 1
+        return match
+
+    def mentions(self, query):
+        """问题中字面提到的 POI 标准名称集合。"""
+        if not isinstance(query, str):
+            return set()
+        return _segment(self._trie, normalize(query)[0])[0]
+
+    def _resolve(self, query):
+        text = normalize(query)[0]
+        pois, intent, residual = _segment(self._trie, text)
+        if not intent:
+            return None
+        if pois:
+            if len(pois) == 1 and not residual:
+                return PoiMatch(pois.pop(), 'exact')
+            return None
+        if self._pinyin_trie is not None:
+            pinyin_pois, pinyin_intent, pinyin_residual = _segment(self._pinyin_trie, lazy_pinyin(text))
+            if pinyin_intent and len(pinyin_pois) == 1 and not pinyin_residual:
+                return PoiMatch(pinyin_pois.pop(), 'pinyin')
+        if len(residual) == 1:
+            start, end = residual[0]
+            candidate = text[start:end]
+            standards = set()
+            for length in range(len(candidate) - 1, len(candidate) + 2):
+                for alias, standard in self._fuzzy.get(length, ()):
+                    if _within_one_edit(candidate, alias):
+                        standards.add(standard)
+            if len(standards) == 1:
+                return PoiMatch(standards.pop(), 'edit')
+        return None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        resolved = total - counts['deferred']
+        return {
+            'aliases': self.size,
+            'pinyin_enabled': self._pinyin_trie is not None,
+            **counts,
+            'resolve_rate': resolved / total if total else 0.0,
+        }
+
+
+# poi.csv 中表头为这些名称的列是 POI 的类别（如“餐饮”“厕所”），只用于检索，其余列都是别名
+CATEGORY_COLUMNS = ('category', '类别', '分类')
+
+
+def read_poi_csv(file):
+    """读取 poi.csv（第一列为标准名称，其余列为别名或类别），
+    返回 (别名→标准名称的映射, 标准名称列表, 标准名称→类别列表)。"""
+    poi_mapping = {}
+    poi_list = []
+    poi_categories = {}
+    reader = csv.reader(file)
+    header = next(reader, None) or []  # 跳过标题行
+    category_columns = {i for i, title in enumerate(header) if title.strip().lower() in CATEGORY_COLUMNS}
+    for row in reader:
+        if row and len(row) > 0:
+            standard_name = row[0].strip()
+            poi_list.append(standard_name)
+            # 将标准名称映射到自身
+            poi_mapping[standard_name] = standard_name
+            # 将所有别名映射到标准名称
+            for i, alias in enumerate(row[1:], 1):
+                if not alias.strip():
+                    continue
+                if i in category_columns:
+                    poi_categories.setdefault(standard_name, []).append(alias.strip())
+                else:
+                    poi_mapping[alias.strip()] = standard_name
+    return poi_mapping, poi_list, poi_categories
+
+
+def format_poi_list(pois):
+    """提示词中的地点列表：\"东门\", \"卫生间\"。"""
+    return ", ".join([f'"{poi}"' for poi in pois])
+
+
+def format_aliases(alias_pairs):
+    """提示词中的别名对应：东大门=东门 厕所=卫生间。"""
+    return " ".join([f"{alias}={standard}" for alias, standard in alias_pairs])
+
+
+def _terms(text):
+    """归一化后的单字和相邻双字。"""
+    text = normalize(text)[0]
+    terms = list(text)
+    terms.extend(text[i:i + 2] for i in range(len(text) - 1))
+    return terms
+
+
+class PoiIndex:
+    """POI 的 BM25 检索索引：每个 POI 的名称、别名和类别组成一篇文档（构建后只读）。"""
+
+    def __init__(self, poi_list, poi_mapping, poi_categories=None, k1=BM25_K1, b=BM25_B):
+        self.poi_list = list(poi_list)
+        self._aliases = {poi: [] for poi in self.poi_list}
+        for alias, standard in poi_mapping.items():
+            if alias != standard and standard in self._aliases:
+                self._aliases[standard].append(alias)
+        poi_categories = poi_categories or {}
+        # 词 → [(POI 下标, 词频)]；n-gram 不跨越名称、别名和类别的边界
+        self._postings = {}
+        lengths = []
+        for i, poi in enumerate(self.poi_list):
+            counts = Counter()
+            for text in [poi, *self._aliases[poi], *poi_categories.get(poi, ())]:
+                counts.update(_terms(text))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((i, tf))
+            lengths.append(sum(counts.values()))
+        n = len(self.poi_list)
+        average = sum(lengths) / n if n else 0.0
+        self._idf = {term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                     for term, postings in self._postings.items()}
+        # 文档长度归一化项 k1 * (1 - b + b * len / avg) 预先算好
+        self._norms = [k1 * (1 - b + b * length / average) for length in lengths]
+        self._k1 = k1
+
+    def aliases(self, poi):
+        return self._aliases.get(poi, [])
+
+    def alias_pairs(self, pois):
+        """pois 的全部 (别名, 标准名称)。"""
+        return [(alias, poi) for poi in pois for alias in self._aliases.get(poi, ())]
+
+    def top(self, query, k):
+        """返回与 query 最相关的至多 k 个 POI（按得分从高到低，同分按 poi.csv 中的顺序），没有任何相关的 POI 时返回空列表。"""
+        if not isinstance(query, str):
+            return []
+        scores = {}
+        k1 = self._k1
+        norms = self._norms
+        for term in set(_terms(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            idf = self._idf[term]
+            for i, tf in postings:
+                scores[i] = scores.get(i, 0.0) + idf * tf * (k1 + 1) / (tf + norms[i])
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))[:k]
+        return [self.poi_list[i] for i in ranked]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""多套配置（profile）的加载校验与预编译。
+
+shuziren 的 config.json 里每个 profile 是一个字典（模型、系统提示词、知识库 ID）。原来每个请求都要
+按名字查字典、重新构造 messages 和带长检索模板的 tools 列表，再对系统提示词算一次哈希作为缓存键；
+配置写错（缺字段、字段为空）要等请求用到这个 profile 时才以 KeyError 的形式暴露出来。
+
+ProfileRegistry 在加载时校验全部 profile（一次列出所有问题），并把每个 profile 编译成不可变的
+ProfilePlan：系统消息和 tools 预先构造成只读结构，缓存键前缀（含提示词哈希）预先算好，
+请求时只需填入用户消息。
+profile 可以单独配置 api_key 使用自己的上游客户端，api_key 相同的 profile 共享同一个客户端；
+也可以单独配置 admission（调用大模型的限速，见 common.admission）。
+"""
+from types import MappingProxyType
+
+from common.admission import AdmissionError, AdmissionPolicy
+from common.cache import prompt_digest
+from common.normalize import normalize
+
+# profile 必须配置的非空字符串字段
+REQUIRED_FIELDS = ('model', 'default_prompt', 'knowledge_id')
+# 值为字典但不是 profile 的顶层字段
+GLOBAL_FIELDS = ('admission',)
+
+
+class ProfileError(ValueError):
+    """config.json 中有不合法的 profile。"""
+
+
+class ProfilePlan:
+    """一个 profile 编译后的请求模板（不可变，可在多线程间共享）。
+
+    system_message 和 tools 在加载时构造一次，所有请求共享同一份只读结构（MappingProxyType 和 tuple），
+    只在交给 SDK 时复制：
+        - messages() 返回新的列表，系统消息是 system_message 的副本：zhipuai SDK 会就地改写每条消息的 content；
+        - tools 以 list(plan.tools) 传入即可：SDK 只读取 tools，发请求前自己用 deepcopy_minimal
+          把其中的 Mapping 复制成普通字典（不复制 tuple，外层要是 list）。
+    """
+
+    __slots__ = ('name', 'model', 'knowledge_id', 'clean_output', 'client', 'admission', 'prompt',
+                 'retrieval_template', 'system_message', 'tools', '_prompt_hash')
+
+    def __init__(self, name, config, client, retrieval_template, admission=None):
+        init = object.__setattr__
+        init(self, 'name', name)
+        init(self, 'model', config['model'])
+        init(self, 'knowledge_id', config['knowledge_id'])
+        init(self, 'clean_output', config.get('clean_output', False))
+        init(self, 'client', client)
+        # profile 自己的限速配置，没有配置时为 None（使用顶层的配置）
+        init(self, 'admission', admission)
+        init(self, 'prompt', config['default_prompt'])
+        init(self, 'retrieval_template', retrieval_template)
+        init(self, 'system_message', MappingProxyType({"role": "system", "content": self.prompt}))
+        init(self, 'tools', (MappingProxyType({
+            "type": "retrieval",
+            "retrieval": MappingProxyType({
+                "knowledge_id": self.knowledge_id,
+                "prompt_template": retrieval_template,
+            }),
+        }),))
+        init(self, '_prompt_hash', prompt_digest(config['default_prompt']))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"ProfilePlan '{self.name}' is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"ProfilePlan '{self.name}' is immutable")
+
+    def messages(self, query):
+        return [dict(self.system_message), {"role": "user", "content": query}]
+
+    def cache_key(self, query, model=None):
+        """与 common.cache.make_cache_key(name, model, 系统提示词, knowledge_id, query) 相同，提示词哈希已预先算好。"""
+        return (self.name, model or self.model, self._prompt_hash, self.knowledge_id, normalize(query)[0])
+
+
+class ProfileRegistry:
+    """config.json 中全部 profile 编译后的只读注册表。
+
+    值为字典的顶层字段是 profile（GLOBAL_FIELDS 除外），其余（auth_keys、api_key 等）是全局配置。
+    client_factory(api_key) 创建上游客户端；profile 没有配置 api_key 时使用全局的 api_key。
+    """
+
+    def __init__(self, configs, client_factory, retrieval_template):
+        problems = []
+        clients = {}
+        plans = {}
+        for name, config in configs.items():
+            if not isinstance(config, dict) or name in GLOBAL_FIELDS:
+                continue
+            missing = [field for field in REQUIRED_FIELDS if not isinstance(config.get(field), str) or not config[field]]
+            if missing:
+                problems.append(f"profile '{name}': missing or empty {', '.join(missing)}")
+                continue
+            api_key = config.get('api_key', configs.get('api_key'))
+            if not isinstance(api_key, str) or not api_key:
+                problems.append(f"profile '{name}': no api_key (neither in the profile nor at the top level)")
+                continue
+            if not isinstance(config.get('clean_output', False), bool):
+                problems.append(f"profile '{name}': clean_output must be true or false")
+                continue
+            try:
+                admission = AdmissionPolicy(config['admission'], f"profile '{name}': admission") if 'admission' in config else None
+            except AdmissionError as e:
+                problems.append(str(e))
+                continue
+            if api_key not in clients:
+                clients[api_key] = client_factory(api_key)
+            plans[name] = ProfilePlan(name, config, clients[api_key], retrieval_template, admission)
+        if not plans and not problems:
+            problems.append("no profile defined")
+        if problems:
+            raise ProfileError("; ".join(problems))
+        self._plans = plans
+        self.client_count = len(clients)
+
+    def get(self, name):
+        """返回 name 对应的 ProfilePlan，没有时返回 None。"""
+        return self._plans.get(name)
+
+    def names(self):
+        return list(self._plans)
+
+    def __len__(self):
+        return len(self._plans)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""banwords.txt / poi.csv / config.json 的热加载。
+
+每份数据由一个 Reloadable 持有：loader 负责从文件构建出完整的只读快照，
+后台线程按 mtime 轮询文件，发现变化后在后台重新构建，成功后一次性替换引用。
+请求在开始时读取一次 ``.current`` 并在整个请求内使用同一份快照，
+因此不会看到加载到一半的状态；加载失败时保留旧快照。
+"""
+import os
+import sys
+import threading
+import time
+
+# 轮询间隔（秒），设置为 0 关闭热加载
+DEFAULT_INTERVAL = float(os.environ.get('RELOAD_INTERVAL', '2'))
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class Reloadable:
+    """由若干文件构建的快照，文件变化时整体重建并原子替换。"""
+
+    def __init__(self, paths, loader, initial=None):
+        """paths 为依赖的文件列表；initial 不为 None 时跳过首次加载，直接使用该值。"""
+        self.paths = list(paths)
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._signature = self._signatures()
+        self.current = loader() if initial is None else initial
+        self.loaded_at = time.time()
+        self.reloads = 0
+
+    def _signatures(self):
+        return tuple(_file_signature(path) for path in self.paths)
+
+    def changed(self):
+        return self._signatures() != self._signature
+
+    def reload(self, force=False):
+        """文件有变化（或 force）时重新加载，返回是否替换了快照。"""
+        with self._lock:
+            signature = self._signatures()
+            if not force and signature == self._signature:
+                return False
+            # 先记下签名，加载失败时不会对同一个坏文件反复重试
+            self._signature = signature
+            start = time.perf_counter()
+            try:
+                value = self._loader()
+            except Exception as e:
+                print(f"ERROR: Failed to reload {', '.join(self.paths)}, keeping previous version: {e}",
+                      file=sys.stderr)
+                return False
+            self.current = value
+            self.loaded_at = time.time()
+            self.reloads += 1
+        print(f"INFO: Reloaded {', '.join(self.paths)} in {(time.perf_counter() - start) * 1000:.1f} ms.",
+              file=sys.stderr)
+        return True
+
+
+class ReloadWatcher(threading.Thread):
+    """后台轮询线程，依次检查每个 Reloadable。"""
+
+    def __init__(self, reloadables, interval=DEFAULT_INTERVAL):
+        super().__init__(name='reload-watcher', daemon=True)
+        self.reloadables = list(reloadables)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            for reloadable in self.reloadables:
+                if reloadable.changed():
+                    reloadable.reload()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_watcher(*reloadables, interval=DEFAULT_INTERVAL):
+    """为给定的 Reloadable 启动后台轮询线程；interval 为 0 时不启动并返回 None。"""
+    if interval <= 0:
+        return None
+    watcher = ReloadWatcher(reloadables, interval)
+    watcher.start()
+    return watcher
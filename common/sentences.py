@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""按句子（子句）切分流式回答，供数字人的 TTS 逐句合成。
+
+上游的流式 delta 可能只有一个字，也可能是 None，TTS 客户端原来要自己攒字、猜句子在哪里结束才能开始合成。
+stream_mode 为 "sentence" 时，服务端用 SentenceSegmenter 把 delta 流切成子句，每个子句一结束就作为一个
+SSE 事件发出：
+    - 。！？；!?; … 和换行总是断句；英文句点只在后面跟空白时断句（"3.5"、"e.g." 不断）；
+    - ，、：,: 在子句已有至少 min_chars 个字时断句，避免 "嗯，" 这样过短的片段；英文的 , : 后面是数字时不断（"1,000"、"8:30"）；
+    - 紧跟的标点、右引号、右括号和空白（"。”"、"？！"、"……"）归入前一句，只有标点的片段并入下一句；
+    - 缓冲的文字等待超过 max_latency 秒仍没有断句时整体发出，长句不会一直憋着。
+所有子句按顺序拼接后与原回答完全相同。
+
+max_latency 不是定时器：等待时间只在下一个 delta（包括空 delta 和 None）到达时检查。断句在读取上游的一侧进行
+（framed_writes 的后台线程中），common.sse.coalesce 的定时写出只作用于已经断好的子句。
+模型生成期间 delta 间隔只有几十毫秒，缓冲的文字最晚在 max_latency 加一个 delta 间隔后发出；
+上游停顿时，已缓冲的文字要等到下一个 delta 或流结束才发出。
+"""
+import os
+import time
+
+from common.cancel import closes_chunks
+from common.sse import format_event
+
+DEFAULT_MAX_LATENCY = float(os.environ.get('SENTENCE_MAX_LATENCY', '1.0'))
+DEFAULT_MIN_CHARS = int(os.environ.get('SENTENCE_MIN_CHARS', '4'))
+
+_STRONG = frozenset('。！？；!?;…\n')
+_WEAK = frozenset('，、：,:')
+# 要看到下一个字符才能确定是否断句的标点
+_LOOKAHEAD = frozenset('.,:…')
+# 断句标点之后仍归入本句的字符
+_TRAILING = frozenset('。！？；!?;…，、：,:.”’」』）)】》"\'')
+
+
+def _has_speech(text):
+    return any(c.isalnum() for c in text)
+
+
+def _length(text):
+    return sum(not c.isspace() for c in text)
+
+
+class SentenceSegmenter:
+    """流式断句器：feed() 返回已经完整的子句，流结束时调用 flush() 取出剩余文本。
+
+    feed() 调用时才检查 max_latency，没有新文字时可以 feed(None) 让超时的缓冲发出。
+    """
+
+    def __init__(self, max_latency=DEFAULT_MAX_LATENCY, min_chars=DEFAULT_MIN_CHARS, clock=time.monotonic):
+        self.max_latency = max_latency
+        self.min_chars = min_chars
+        self._clock = clock
+        self._buffer = ''
+        # _buffer 中已扫描过、确认不含断点的前缀长度
+        self._scanned = 0
+        # 缓冲中最早的文字到达的时间
+        self._since = None
+
+    def feed(self, text):
+        now = self._clock()
+        if text:
+            if not self._buffer:
+                self._since = now
+            self._buffer += text
+        buffer = self._buffer
+        n = len(buffer)
+        out = []
+        start = 0
+        i = self._scanned
+        while i < n:
+            c = buffer[i]
+            if c in _LOOKAHEAD and i + 1 == n:
+                # 后面的字符还没到（小数点、"8:30"、"……"），等下一个 delta 再判断
+                break
+            if c == '.':
+                cut = buffer[i + 1].isspace()
+            elif c in _STRONG:
+                cut = True
+            else:
+                cut = (c in _WEAK and _length(buffer[start:i]) >= self.min_chars
+                       and not (c in ',:' and buffer[i + 1].isdigit()))
+            i += 1
+            if not cut:
+                continue
+            while i < n and (buffer[i] in _TRAILING or buffer[i].isspace()):
+                i += 1
+            if _has_speech(buffer[start:i]):
+                out.append(buffer[start:i])
+                start = i
+        if start:
+            self._buffer = buffer = buffer[start:]
+            self._since = now
+        self._scanned = i - start
+        if buffer and now - self._since >= self.max_latency and _has_speech(buffer):
+            out.append(buffer)
+            self._buffer = ''
+            self._scanned = 0
+        return out
+
+    def flush(self):
+        rest = self._buffer
+        self._buffer = ''
+        self._scanned = 0
+        return [rest] if rest else []
+
+
+@closes_chunks
+def sentence_stream(chunks, max_latency=DEFAULT_MAX_LATENCY, min_chars=DEFAULT_MIN_CHARS):
+    """包装一个文本 chunk 生成器（可含 None），逐个产出子句。"""
+    segmenter = SentenceSegmenter(max_latency, min_chars)
+    try:
+        for chunk in chunks:
+            yield from segmenter.feed(chunk)
+        yield from segmenter.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+@closes_chunks
+def sentence_events(chunks, max_latency=DEFAULT_MAX_LATENCY, min_chars=DEFAULT_MIN_CHARS):
+    """同 sentence_stream，但每个子句编码成一个 SSE 事件。"""
+    sentences = sentence_stream(chunks, max_latency, min_chars)
+    try:
+        for sentence in sentences:
+            yield format_event(sentence)
+    finally:
+        sentences.close()
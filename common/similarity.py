@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""近似问题缓存。
+
+游客会用不同说法问同一件事（“厕所在哪”“洗手间在哪里”），精确匹配的缓存几乎命中不了。
+这里对问题做字符 n-gram（单字 + 双字）切分，用 MinHash 签名 + LSH 分桶建立纯 CPU 的本地索引：
+查找时只比较同桶的候选，再用精确的 Jaccard 相似度确认，超过阈值即返回缓存的回答。
+字面很接近的问题可能只差一个数字或方位（“一号停车场”“二号停车场”，“东门停车场”“西门停车场”），
+回答却完全不同，因此问题中的数字、序数和方位字（锚点）必须完全一致才会互相命中。
+不依赖 GPU 和网络，10 万条缓存下单次查找在亚毫秒级。
+"""
+from collections import OrderedDict, namedtuple
+import os
+import random
+import re
+import threading
+import time
+
+from common.normalize import normalize
+
+DEFAULT_THRESHOLD = float(os.environ.get('SIMILAR_CACHE_THRESHOLD', '0.7'))
+DEFAULT_MAX_SIZE = int(os.environ.get('SIMILAR_CACHE_SIZE', '100000'))
+DEFAULT_TTL = float(os.environ.get('SIMILAR_CACHE_TTL', '600'))
+
+# 对语义几乎没有贡献的口头语，切分前去掉
+FILLER_WORDS = ('请问', '你好', '一下', '我想', '的', '了', '吗', '呢', '吧', '啊', '呀', '哦', '嘛')
+
+# 锚点：数字（含中文数字，“第三”“2号”）和方位字，相似的问题只在锚点完全一致时才算同一个问题
+_ANCHOR_RE = re.compile(r'[0-9零〇一二三四五六七八九十百千万两]+|[东南西北]')
+
+# MinHash 使用的梅森素数模
+_PRIME = (1 << 31) - 1
+
+# 查找结果：value 为缓存的回答，query 为命中的近邻问题，score 为 Jaccard 相似度
+SimilarMatch = namedtuple('SimilarMatch', ['value', 'query', 'score'])
+
+
+def _strip(text):
+    text = normalize(text)[0]
+    for word in FILLER_WORDS:
+        text = text.replace(word, '')
+    return text
+
+
+def anchors(text):
+    """归一化并去掉口头语后，问题中依次出现的数字和方位字。"""
+    return tuple(_ANCHOR_RE.findall(_strip(text)))
+
+
+def shingles(text):
+    """归一化并去掉口头语后，返回单字和相邻双字组成的集合。"""
+    text = _strip(text)
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ('context', 'query', 'value', 'anchors', 'bands', 'expires_at')
+
+    def __init__(self, context, query, value, anchors, bands, expires_at):
+        self.context = context
+        self.query = query
+        self.value = value
+        self.anchors = anchors
+        self.bands = bands
+        self.expires_at = expires_at
+
+
+class SimilarityCache:
+    """MinHash + LSH 的近似问题缓存（线程安全，LRU + TTL 淘汰）。
+
+    context 用来区分不同的调用上下文（配置、模型、提示词等），只有 context 相同、锚点相同的问题才会互相命中。
+    放入与已有问题近似的问题时替换掉旧的条目，同一个问题的不同说法只保留最新的回答。
+    默认 32 个哈希分成 8 个桶、每桶 4 行，Jaccard 约 0.6 以上的问题大概率落入同一桶。
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL,
+                 num_perm=32, bands=8, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self._entries = OrderedDict()  # id -> _Entry
+        self._buckets = {}  # 桶键 -> {id}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _band_keys(self, context, grams):
+        hashes = [hash(g) & _PRIME for g in grams]
+        signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms]
+        rows = self.rows
+        return tuple(hash((context, i, tuple(signature[i * rows:(i + 1) * rows]))) for i in range(self.bands))
+
+    def lookup(self, context, query, threshold=None):
+        """返回最相似且相似度不低于阈值的 SimilarMatch，没有则返回 None。"""
+        threshold = self.threshold if threshold is None else threshold
+        grams = shingles(query)
+        if not grams:
+            return None
+        band_keys = self._band_keys(context, grams)
+        best = None
+        with self._lock:
+            for score, entry_id, entry in self._similar(context, grams, anchors(query), band_keys, threshold):
+                if best is None or score > best[0]:
+                    best = (score, entry_id, entry)
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best[1])
+            self.hits += 1
+        score, _, entry = best
+        return SimilarMatch(entry.value, entry.query, score)
+
+    def add(self, context, query, value, ttl=None, threshold=None):
+        """放入问题的回答；与它相似度不低于阈值的旧问题（lookup 会命中的）被替换掉。"""
+        threshold = self.threshold if threshold is None else threshold
+        grams = shingles(query)
+        if not grams or self.max_size <= 0:
+            return
+        query_anchors = anchors(query)
+        band_keys = self._band_keys(context, grams)
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            for _, entry_id, _ in list(self._similar(context, grams, query_anchors, band_keys, threshold)):
+                self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(context, query, value, query_anchors, band_keys, expires_at)
+            for key in band_keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _similar(self, context, grams, query_anchors, band_keys, threshold):
+        """同桶、同 context、同锚点且相似度不低于阈值的 (score, id, _Entry)；顺带清理过期的候选。需持有锁。"""
+        now = time.monotonic()
+        candidates = set()
+        for key in band_keys:
+            ids = self._buckets.get(key)
+            if ids:
+                candidates.update(ids)
+        for entry_id in candidates:
+            entry = self._entries.get(entry_id)
+            if entry is None or entry.context != context:
+                continue
+            if entry.expires_at <= now:
+                self._remove(entry_id)
+                continue
+            if entry.anchors != query_anchors:
+                continue
+            score = jaccard(grams, shingles(entry.query))
+            if score >= threshold:
+                yield score, entry_id, entry
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for key in entry.bands:
+            ids = self._buckets.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._buckets[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""相同上游请求的合并（single-flight）。
+
+旅行团到达时，几十台讲解机会在一秒内问同一个问题，每台都单独调用一次大模型。
+这里让同一时刻相同的请求只发起一次上游调用：
+    - 非流式：第一个请求执行调用，其余请求等待并拿到同一个结果（或同一个异常）；
+    - 流式：所有订阅者共享同一条上游流，每个订阅者都从第一个 chunk 开始收到完整内容，
+      即使是中途才加入的。上游由当前读到末尾的订阅者负责拉取，不需要额外线程，
+      任意订阅者断开都不影响其他人；所有订阅者都离开时关闭上游。
+      在 AbortScope（见 common.cancel）内订阅时，scope 被 abort() 即退订，等待中的订阅者立即返回；
+      最后一个订阅者离开时如果另一个线程正阻塞在拉取上，中断上游的读取。
+AsyncSingleFlight 是供 ASGI 服务模式使用的异步版本，语义相同。
+"""
+import asyncio
+import logging
+import threading
+
+from common.cancel import AbortScope, ClosingIterator, StreamAborted, current_abort_scope
+
+# 每个加入共享流的请求都会记录一次，只在调试时输出
+_log = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Flight:
+    __slots__ = ('cond', 'upstream', 'chunks', 'done', 'error', 'pulling', 'subscribers', 'aborts')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.upstream = None
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.pulling = False
+        self.subscribers = 0
+        # 拉取上游期间打开的上游流登记在这里，所有订阅者离开时从其他线程中断
+        self.aborts = AbortScope()
+
+
+class SingleFlight:
+    """按 key 合并并发的相同调用。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """执行 fn()；若相同 key 的调用正在进行，则等待并返回它的结果。"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.leaders += 1
+            else:
+                leader = False
+                self.followers += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stream(self, key, fn):
+        """订阅 key 对应的共享流；没有进行中的流时用 fn() 创建上游迭代器。
+
+        返回一个迭代器，从第一个 chunk 开始产出完整内容；没开始迭代就被关闭时同样退订。
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+                self.leaders += 1
+            else:
+                leader = False
+                self.followers += 1
+            with flight.cond:
+                flight.subscribers += 1
+        if leader:
+            # 上游迭代器立即创建，之后任何一个订阅者都可以负责拉取
+            try:
+                upstream = iter(fn())
+            except BaseException as e:
+                with flight.cond:
+                    flight.error = e
+                    flight.done = True
+                    flight.cond.notify_all()
+                self._finish(key, flight)
+                raise
+            with flight.cond:
+                flight.upstream = upstream
+                flight.cond.notify_all()
+        else:
+            _log.debug("Joined in-flight upstream stream for %r", key)
+        left = []
+        scope = current_abort_scope()
+        if scope is not None:
+            scope.add(lambda: self._leave(key, flight, left))
+        return ClosingIterator(self._subscribe(key, flight, left), lambda: self._leave(key, flight, left))
+
+    def streaming(self, key):
+        """key 对应的共享流是否正在进行（此时 stream() 会直接加入，不调用 fn）。"""
+        with self._lock:
+            return key in self._flights
+
+    def _finish(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, key, flight, left):
+        """订阅者离开（left 记录是否已经离开，只处理一次）；所有订阅者都已离开时关闭上游并让后来的请求重新发起。"""
+        if left:
+            return
+        left.append(True)
+        with flight.cond:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned:
+                flight.done = True
+            pulling = flight.pulling
+            # 被 AbortScope 退订时本订阅者可能正在其他线程中等待
+            flight.cond.notify_all()
+        if abandoned:
+            self._finish(key, flight)
+            if pulling:
+                # 上游正在其他线程中执行，不能 close()；中断读取后由拉取的线程结束上游
+                flight.aborts.abort()
+                return
+            close = getattr(flight.upstream, 'close', None)
+            if close is not None:
+                close()
+
+    def _subscribe(self, key, flight, left):
+        cond = flight.cond
+        index = 0
+        try:
+            while True:
+                with cond:
+                    while True:
+                        if left:
+                            raise StreamAborted('Unsubscribed from the shared stream')
+                        if index < len(flight.chunks):
+                            chunk = flight.chunks[index]
+                            index += 1
+                            pull = False
+                            break
+                        if flight.done:
+                            if flight.error is not None:
+                                raise flight.error
+                            return
+                        if not flight.pulling and flight.upstream is not None:
+                            flight.pulling = True
+                            pull = True
+                            break
+                        cond.wait()
+                if not pull:
+                    yield chunk
+                    continue
+                # 当前订阅者已读到末尾，由它负责从上游再拉一个 chunk
+                try:
+                    with flight.aborts:
+                        chunk = next(flight.upstream)
+                except StopIteration:
+                    with cond:
+                        flight.done = True
+                        flight.pulling = False
+                        cond.notify_all()
+                    self._finish(key, flight)
+                    continue
+                except BaseException as e:
+                    with cond:
+                        flight.error = e
+                        flight.done = True
+                        flight.pulling = False
+                        cond.notify_all()
+                    self._finish(key, flight)
+                    raise
+                with cond:
+                    flight.chunks.append(chunk)
+                    flight.pulling = False
+                    cond.notify_all()
+                    # 拉取期间所有订阅者都已离开（_leave 不能关闭正在执行的上游），由拉取的线程关闭
+                    abandoned = flight.done
+                if abandoned:
+                    close = getattr(flight.upstream, 'close', None)
+                    if close is not None:
+                        close()
+        finally:
+            self._leave(key, flight, left)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'in_flight': len(self._calls) + len(self._flights),
+            }
+
+
+class _AsyncFlight:
+    __slots__ = ('cond', 'chunks', 'done', 'error', 'task', 'subscribers')
+
+    def __init__(self):
+        self.cond = asyncio.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self.subscribers = 0
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的异步版本，只能在一个事件循环中使用。
+
+    协程不占线程，因此上游调用和上游流都放在独立的 task 中执行：发起请求的客户端断开不会取消其他等待者
+    正在等待的调用；共享流由后台 task 拉取，所有订阅者都离开时取消该 task 并关闭上游。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, fn):
+        """await fn()；若相同 key 的调用正在进行，则等待并返回它的结果。"""
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+            self.leaders += 1
+        else:
+            self.followers += 1
+        # shield：当前请求被取消（客户端断开）时调用继续进行，结果仍交给其他等待者
+        return await asyncio.shield(task)
+
+    def stream(self, key, fn):
+        """订阅 key 对应的共享流；没有进行中的流时用 fn() 创建上游异步迭代器。
+
+        返回一个异步生成器，从第一个 chunk 开始产出完整内容。
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            flight.task = asyncio.ensure_future(self._pump(key, flight, fn))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            _log.debug("Joined in-flight upstream stream for %r", key)
+        flight.subscribers += 1
+        return self._subscribe(key, flight)
+
+    def streaming(self, key):
+        """key 对应的共享流是否正在进行（此时 stream() 会直接加入，不调用 fn）。"""
+        return key in self._flights
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _pump(self, key, flight, fn):
+        upstream = None
+        try:
+            upstream = fn()
+            async for chunk in upstream:
+                async with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(key, flight)
+            aclose = getattr(upstream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            async with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    async def _subscribe(self, key, flight):
+        index = 0
+        try:
+            while True:
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: index < len(flight.chunks) or flight.done)
+                    chunks = flight.chunks[index:]
+                    done = flight.done
+                for chunk in chunks:
+                    index += 1
+                    yield chunk
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 所有订阅者都已离开，取消拉取并关闭上游，让后来的请求重新发起
+                self._finish(key, flight)
+                flight.task.cancel()
+
+    def stats(self):
+        return {
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'in_flight': len(self._calls) + len(self._flights),
+        }
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Server-Sent Events 的编码，以及流式响应的合并写出。
+
+原有接口的流式响应直接输出文本片段；需要在同一条流里区分多种事件（如 /turn 的导航判断和回答）时，
+按 SSE 格式编码：可选的 "event:" 行，加上每行数据一个 "data:" 行，以空行结束一个事件。
+
+上游的 delta 往往只有一两个字，原来每个 delta 都单独写一次响应（Flask 开发服务器的分块编码下是 4 次 send），
+代理也要为每个 delta 刷新一次。coalesce 把短时间内到达的 delta 合并成一次写出：
+    - 距上次写出已超过 window 秒时，新到的 delta 立即写出（稀疏的流不增加延迟），
+      否则先缓存起来，最晚在上次写出 window 秒后写出（即使上游在此期间停顿），
+      合并的文字超过 max_chars 或上游结束时提前写出；
+    - 空的 delta（None 或 ""）丢弃；
+    - SSE 流超过 heartbeat 秒没有写出时发出注释行 ": keep-alive"（上游完全没有输出时也会发），避免代理因超时断开连接。
+上游由每条流一个的后台线程读取，经有界队列交给响应的生成器，生成器按截止时间带超时地等待，
+到期时写出缓存或发出心跳。响应被关闭时读取线程在上游下一个 chunk 返回后退出并关闭上游。
+text_writes 用于原始文本流，event_writes 把每次合并的文字编码成一个 SSE 事件，framed_writes 用于已经编码好的事件流。
+"""
+import os
+import queue
+import threading
+import time
+
+from common.cancel import ClosingIterator, closes_chunks
+
+# 流式接口支持的输出方式：raw 为原始文本，sse 为合并后的 SSE 事件，sentence 为逐句的 SSE 事件
+STREAM_MODES = ('raw', 'sse', 'sentence')
+DEFAULT_COALESCE_WINDOW = float(os.environ.get('SSE_COALESCE_WINDOW', '0.03'))
+DEFAULT_MAX_BATCH_CHARS = int(os.environ.get('SSE_MAX_BATCH_CHARS', '1024'))
+DEFAULT_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', '15'))
+HEARTBEAT = ': keep-alive\n\n'
+# 读取上游的线程与消费方之间的队列长度，以及队列满时检查是否已停止的间隔（秒）
+DEFAULT_PUMP_QUEUE_SIZE = int(os.environ.get('SSE_PUMP_QUEUE_SIZE', '256'))
+_PUT_POLL = 0.1
+
+_CHUNK, _END, _ERROR = range(3)
+
+
+def format_event(data, event=None):
+    """把一段文本编码成一个 SSE 事件；多行文本拆成多个 data 行，客户端会用换行重新拼接。"""
+    lines = [f"event: {event}"] if event else []
+    for line in data.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        lines.append(f"data: {line}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class WriteStats:
+    """合并写出的统计（线程安全）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.deltas = 0
+        self.empty = 0
+        self.writes = 0
+        self.heartbeats = 0
+
+    def add(self, deltas=0, empty=0, writes=0, heartbeats=0):
+        with self._lock:
+            self.deltas += deltas
+            self.empty += empty
+            self.writes += writes
+            self.heartbeats += heartbeats
+
+    def stats(self):
+        with self._lock:
+            return {
+                'deltas': self.deltas,
+                'empty_deltas': self.empty,
+                'writes': self.writes,
+                'deltas_per_write': round(self.deltas / self.writes, 2) if self.writes else 0.0,
+                'heartbeats': self.heartbeats,
+            }
+
+
+# 进程内共享的统计，网关中各服务共用
+WRITE_STATS = WriteStats()
+
+
+class _Pump:
+    """在后台线程里读取上游 chunks，放进有界队列，消费方可以带超时地等待下一个 chunk。
+
+    线程在第一次 get() 时才启动，之后上游只由这个线程读取和关闭：close() 通知线程停止，
+    线程在当前的 next(chunks) 返回后（或队列有空位时）退出并关闭上游；线程还没启动时 close() 直接关闭上游。
+    """
+
+    def __init__(self, chunks, size=DEFAULT_PUMP_QUEUE_SIZE):
+        self._chunks = chunks
+        self._queue = queue.Queue(size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self, timeout):
+        """返回 (种类, 值)；timeout 秒内没有 chunk 时抛出 queue.Empty（timeout 为 None 时一直等待）。"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sse-pump', daemon=True)
+            self._thread.start()
+        return self._queue.get(timeout=timeout)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is None:
+            _close(self._chunks)
+
+    def _put(self, item):
+        # 消费方停止读取后不再阻塞在满的队列上
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=_PUT_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            for chunk in self._chunks:
+                if not self._put((_CHUNK, chunk)):
+                    return
+            self._put((_END, None))
+        except Exception as e:
+            self._put((_ERROR, e))
+        finally:
+            _close(self._chunks)
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+def coalesce(chunks, window=DEFAULT_COALESCE_WINDOW, max_chars=DEFAULT_MAX_BATCH_CHARS, idle=None):
+    """按时间窗口合并 chunks，产出非空的文本列表；idle 不为 None 时，超过 idle 秒没有写出则产出空列表（心跳）。
+
+    上游由后台线程读取（_Pump），合并和心跳由超时驱动，不依赖下一个 delta 的到达；
+    返回的迭代器被关闭时停止读取并关闭 chunks（没开始迭代时同样关闭）。
+    """
+    pump = _Pump(chunks)
+    return ClosingIterator(_coalesce(pump, window, max_chars, idle), pump.close)
+
+
+def _coalesce(pump, window, max_chars, idle):
+    last_write = float('-inf')
+    last_sent = time.monotonic()
+    batch = []
+    size = 0
+    error = None
+    while True:
+        now = time.monotonic()
+        # 等到缓存的文字该写出，或者该发心跳为止
+        deadline = last_write + window if batch else None
+        if idle is not None and not batch:
+            deadline = last_sent + idle
+        try:
+            kind, value = pump.get(None if deadline is None else max(0.0, deadline - now))
+        except queue.Empty:
+            if batch:
+                WRITE_STATS.add(deltas=len(batch), writes=1)
+                yield batch
+                batch = []
+                size = 0
+                last_write = last_sent = time.monotonic()
+            else:
+                WRITE_STATS.add(heartbeats=1)
+                last_sent = time.monotonic()
+                yield []
+            continue
+        if kind == _END:
+            break
+        if kind == _ERROR:
+            error = value
+            break
+        if not value:
+            WRITE_STATS.add(empty=1)
+            continue
+        batch.append(value)
+        size += len(value)
+        if size >= max_chars or time.monotonic() >= last_write + window:
+            WRITE_STATS.add(deltas=len(batch), writes=1)
+            yield batch
+            batch = []
+            size = 0
+            last_write = last_sent = time.monotonic()
+    # 先写出已经合并的内容，再结束（或抛出上游的异常）
+    if batch:
+        WRITE_STATS.add(deltas=len(batch), writes=1)
+        yield batch
+    if error is not None:
+        raise error
+
+
+@closes_chunks
+def _writes(batches, encode):
+    try:
+        for batch in batches:
+            yield encode(batch)
+    finally:
+        batches.close()
+
+
+def text_writes(chunks, window=DEFAULT_COALESCE_WINDOW, max_chars=DEFAULT_MAX_BATCH_CHARS):
+    """原始文本流：合并后的文字直接写出。"""
+    return _writes(coalesce(chunks, window, max_chars), ''.join)
+
+
+def event_writes(chunks, window=DEFAULT_COALESCE_WINDOW, max_chars=DEFAULT_MAX_BATCH_CHARS,
+                 heartbeat=DEFAULT_HEARTBEAT_INTERVAL):
+    """SSE 流：每次合并的文字编码成一个 data 事件，空闲时发出心跳注释。"""
+    return _writes(coalesce(chunks, window, max_chars, heartbeat),
+                   lambda batch: format_event(''.join(batch)) if batch else HEARTBEAT)
+
+
+def framed_writes(events, window=DEFAULT_COALESCE_WINDOW, max_chars=DEFAULT_MAX_BATCH_CHARS,
+                  heartbeat=DEFAULT_HEARTBEAT_INTERVAL):
+    """已经编码好的 SSE 事件流：短时间内的多个事件合并成一次写出，空闲时发出心跳注释。"""
+    return _writes(coalesce(events, window, max_chars, heartbeat), lambda batch: ''.join(batch) if batch else HEARTBEAT)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""一轮对话的导航判断与回答并发执行。
+
+讲解机每轮对话先调用 /nav 判断是否需要导航，再调用 / 获取回答，一轮的耗时是两次大模型调用之和。
+TurnRunner 在线程池里同时发起两个上游调用，把结果合并成一条 SSE 流：
+    - 回答片段一到就作为 answer 事件发出；
+    - 导航判断一完成就作为 nav 事件发出，不用等回答结束；
+    - 导航判断表明这一轮要改为导航（由调用方判断）时，停止转发回答并关闭回答的上游流；
+    - 最后发出 done 事件，cancelled 表示回答是否被提前取消。
+客户端断开时同样会关闭回答的上游流；已经发出的导航判断请求会执行完（结果仍可进入缓存）。
+回答线程在 AbortScope 内打开并读取回答，取消时从当前线程直接中断上游响应（或退订共享流），
+即使第一个片段还没到，回答线程和上游连接也立即释放。
+
+线程池大小固定，同时进行的轮数超过 max_workers // 2 时 run() 抛出 Rejected（返回 429），不在线程池里无限排队；
+超过 timeout 秒没有等到导航判断或回答片段时发出 error 事件并结束这一轮（回答的上游流随之关闭）。
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import queue
+import threading
+
+from common.admission import Rejected
+
+from common.cancel import AbortScope, ClosingIterator
+from common.sse import format_event
+
+# 每轮对话占用两个线程，直到回答结束
+DEFAULT_TURN_WORKERS = int(os.environ.get('TURN_WORKERS', '32'))
+# 等待下一个事件（导航判断或回答片段）的最长秒数
+DEFAULT_TURN_TIMEOUT = float(os.environ.get('TURN_TIMEOUT', '60'))
+# 线程池已满时建议客户端的重试等待秒数
+TURN_RETRY_AFTER = 1
+
+_NAV, _CHUNK, _END = range(3)
+
+
+class TurnRunner:
+    """在共享的线程池上并发执行导航判断和回答（线程安全）。"""
+
+    def __init__(self, max_workers=DEFAULT_TURN_WORKERS, timeout=DEFAULT_TURN_TIMEOUT):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='turn')
+        self._lock = threading.Lock()
+        self.max_turns = max(1, max_workers // 2)
+        self.timeout = timeout
+        self.active = 0  # 还占用着线程的轮数
+        self.turns = 0
+        self.cancelled = 0
+        self.nav_first = 0  # 导航判断先于第一个回答片段到达的轮数
+        self.rejected = 0
+        self.timed_out = 0
+
+    def run(self, decide_nav, open_answer, replaces_answer):
+        """返回 SSE 事件（字符串）的迭代器。
+
+        decide_nav() 返回导航判断的文本；open_answer() 返回回答片段的迭代器；
+        replaces_answer(nav) 为真时取消回答。线程池已满时抛出 Rejected。
+        """
+        with self._lock:
+            if self.active >= self.max_turns:
+                self.rejected += 1
+                raise Rejected('turns_full', 'Too many concurrent turns', TURN_RETRY_AFTER)
+            self.active += 1
+            self.turns += 1
+        events = queue.Queue()
+        cancel = threading.Event()
+        scope = AbortScope()
+        # 两个任务都结束后这一轮才归还线程
+        remaining = [2]
+
+        def task_done():
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    self.active -= 1
+
+        def nav_task():
+            try:
+                events.put((_NAV, decide_nav(), None))
+            except Exception as e:
+                events.put((_NAV, None, e))
+            finally:
+                task_done()
+
+        def answer_task():
+            chunks = None
+            error = None
+            try:
+                with scope:
+                    chunks = open_answer()
+                    for chunk in chunks:
+                        if cancel.is_set():
+                            break
+                        if chunk:
+                            events.put((_CHUNK, chunk, None))
+            except Exception as e:
+                error = e
+            finally:
+                # 提前结束时关闭上游生成器，尽快释放上游连接
+                close = getattr(chunks, 'close', None)
+                if close is not None:
+                    close()
+                events.put((_END, None, error))
+                task_done()
+
+        def cancel_answer():
+            cancel.set()
+            # 回答线程可能正阻塞在等待上游的下一个片段上，直接中断上游
+            scope.abort()
+
+        self._executor.submit(nav_task)
+        self._executor.submit(answer_task)
+        # 没开始迭代就被关闭时同样取消回答
+        return ClosingIterator(self._merge(events, cancel, cancel_answer, replaces_answer), cancel_answer)
+
+    def _merge(self, events, cancel, cancel_answer, replaces_answer):
+        nav_done = answer_done = answered = False
+        try:
+            while not (nav_done and answer_done):
+                try:
+                    kind, value, error = events.get(timeout=self.timeout)
+                except queue.Empty:
+                    # 上游迟迟没有结果：结束这一轮并中断回答的上游
+                    cancel_answer()
+                    with self._lock:
+                        self.timed_out += 1
+                    waiting = 'navigation' if not nav_done else 'answer'
+                    yield format_event(json.dumps({'detail': f'Timed out waiting for {waiting}'}), 'error')
+                    break
+                if kind == _NAV:
+                    nav_done = True
+                    if error is not None:
+                        yield format_event(json.dumps({'detail': str(error)}, ensure_ascii=False), 'error')
+                        continue
+                    if not answered:
+                        with self._lock:
+                            self.nav_first += 1
+                    yield format_event(value, 'nav')
+                    if not answer_done and replaces_answer(value):
+                        # 不再等待回答，中断回答的上游
+                        cancel_answer()
+                        answer_done = True
+                        with self._lock:
+                            self.cancelled += 1
+                elif kind == _CHUNK:
+                    if not cancel.is_set():
+                        answered = True
+                        yield format_event(value, 'answer')
+                else:
+                    answer_done = True
+                    if error is not None:
+                        yield format_event(json.dumps({'detail': str(error)}, ensure_ascii=False), 'error')
+            yield format_event(json.dumps({'cancelled': cancel.is_set()}), 'done')
+        finally:
+            cancel_answer()
+
+    def stats(self):
+        with self._lock:
+            return {'turns': self.turns, 'active': self.active, 'max_turns': self.max_turns,
+                    'answers_cancelled': self.cancelled, 'nav_first': self.nav_first,
+                    'rejected': self.rejected, 'timed_out': self.timed_out}
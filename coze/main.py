@@ -6,8 +6,21 @@ import os
 import traceback
 import sys 
 import logging
-import time
-import re
+from types import SimpleNamespace
+
+# 将仓库根目录加入模块搜索路径，以便导入各服务共享的 common 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.admission import ADMISSION, NAV, STREAM, AdmissionPolicy, Rejected, admit_stream
+from common.auth import bearer_key, valid_auth_key as check_auth_key
+from common.banwords import BanwordMatcher, moderate_stream, shared_matcher
+from common.cancel import CANCEL_STATS, ClosingIterator, UpstreamGuard, close_on_disconnect, close_response, closing
+from common.coze_chat import ChatFailed, answer_via_polling, answer_via_stream
+from common.markdown import MarkdownStripper
+from common.normalize import normalize
+from common.reload import Reloadable, start_watcher
+from common.singleflight import SingleFlight
+from common.sentences import sentence_events
+from common.sse import STREAM_MODES, WRITE_STATS, event_writes, framed_writes, text_writes
 
 # 从 cozepy 导入必要的类
 from cozepy import (
@@ -26,44 +39,44 @@ logging.getLogger('werkzeug').setLevel(logging.WARNING)
 
 app = Flask(__name__)
 
+# 数据文件所在目录，默认为当前工作目录；网关（gateway.py）在同一进程中托管多个服务时为每个服务分别指定
+DATA_DIR = os.environ.get('COZE_DATA_DIR', '')
+BANWORDS_FILE = os.path.join(DATA_DIR, 'banwords.txt')
+CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
+
 # 定义全局变量
-BANWORDS = set()
-CONFIG = {}
 COZE_API_URL = "https://api.coze.cn/v3/chat" # 将不再被 fast_endpoint 直接使用
-# 全局 Coze 客户端实例
-coze_client = None
 
 # 加载配置
 def load_config():
-    """从 config.json 加载配置并初始化 Coze 客户端"""
-    global CONFIG, coze_client
+    """从 config.json 加载配置并初始化 Coze 客户端，返回包含 config 和 coze_client 的快照"""
     try:
-        with open('config.json', 'r', encoding='utf-8') as config_file:
-            CONFIG = json.load(config_file)
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as config_file:
+            config = json.load(config_file)
             # 检查必要的配置是否存在
             required_keys = ['auth_keys', 'fast_bot_id', 'rejection_message'] 
             for key in required_keys:
-                if key not in CONFIG:
+                if key not in config:
                     raise ValueError(f"Config file 'config.json' is missing required key: {key}")
-            if not isinstance(CONFIG.get('auth_keys'), list):
+            if not isinstance(config.get('auth_keys'), list):
                  raise ValueError("Config key 'auth_keys' must be a list")
 
             # JWT Auth 所需的新配置项
             jwt_required_keys = ['private_key_file_path', 'public_key_id', 'client_id']
             for key in jwt_required_keys:
-                if key not in CONFIG:
+                if key not in config:
                     raise ValueError(f"Config file 'config.json' is missing JWT Auth required key: {key}")
             
             # 确定 Coze API Base URL (config -> env -> default)
-            coze_api_base_url = CONFIG.get('coze_api_base')
+            coze_api_base_url = config.get('coze_api_base')
             if not coze_api_base_url:
                 coze_api_base_url = os.getenv("COZE_API_BASE", COZE_CN_BASE_URL)
-            CONFIG['coze_api_base_for_sdk'] = coze_api_base_url # 存储供 SDK 使用
+            config['coze_api_base_for_sdk'] = coze_api_base_url # 存储供 SDK 使用
 
             print("INFO: Configuration loaded successfully.", file=sys.stderr)
 
             # 初始化 Coze Client
-            private_key_path = CONFIG['private_key_file_path']
+            private_key_path = os.path.join(DATA_DIR, config['private_key_file_path'])
             try:
                 with open(private_key_path, "r") as f:
                     jwt_oauth_private_key = f.read()
@@ -75,13 +88,16 @@ def load_config():
                 raise
 
             jwt_oauth_app = JWTOAuthApp(
-                client_id=CONFIG['client_id'],
+                client_id=config['client_id'],
                 private_key=jwt_oauth_private_key,
-                public_key_id=CONFIG['public_key_id'],
-                base_url=CONFIG['coze_api_base_for_sdk'],
+                public_key_id=config['public_key_id'],
+                base_url=config['coze_api_base_for_sdk'],
             )
-            coze_client = Coze(auth=JWTAuth(oauth_app=jwt_oauth_app), base_url=CONFIG['coze_api_base_for_sdk'])
+            coze_client = Coze(auth=JWTAuth(oauth_app=jwt_oauth_app), base_url=config['coze_api_base_for_sdk'])
             print("INFO: Coze client initialized successfully.", file=sys.stderr)
+            # 每个调用方请求 Coze 的限速（配置不合法时抛出 AdmissionError，即 ValueError）
+            admission = AdmissionPolicy(config.get('admission'))
+            return SimpleNamespace(config=config, coze_client=coze_client, admission=admission)
 
     except FileNotFoundError:
         print("ERROR: Config file 'config.json' not found.", file=sys.stderr)
@@ -98,140 +114,107 @@ def load_config():
 
 # 加载敏感词
 def load_banwords():
-    """从 banwords.txt 加载敏感词"""
-    global BANWORDS
-    try:
-        # 检查 banwords.txt 是否存在
-        if not os.path.exists('banwords.txt'):
-             print("WARNING: Banwords file 'banwords.txt' not found. No banwords will be loaded.", file=sys.stderr)
-             BANWORDS = set()
-             return
-
-        with open('banwords.txt', 'r', encoding='utf-8') as file:
-            BANWORDS = {line.strip() for line in file if line.strip()}
-        print(f"INFO: Loaded {len(BANWORDS)} banwords.", file=sys.stderr)
-    except Exception as e:
-        print(f"ERROR: Failed to load banned words list: {str(e)}", file=sys.stderr)
-        # 选择是继续运行（没有敏感词过滤）而不是抛出错误停止服务
-        BANWORDS = set() # 确保 BANWORDS 是一个集合
-
-# 初始化数据
+    """从 banwords.txt 加载敏感词并编译成 Aho-Corasick 自动机，请求时只需单遍扫描"""
+    # 检查 banwords.txt 是否存在
+    if not os.path.exists(BANWORDS_FILE):
+         print("WARNING: Banwords file 'banwords.txt' not found. No banwords will be loaded.", file=sys.stderr)
+         return BanwordMatcher()
+
+    with open(BANWORDS_FILE, 'r', encoding='utf-8') as file:
+        banwords = {line.strip() for line in file if line.strip()}
+    print(f"INFO: Loaded {len(banwords)} banwords.", file=sys.stderr)
+    return shared_matcher(banwords)
+
+# 初始化数据，文件变化时由后台线程热加载并整体替换（加载失败时保留旧版本）
 try:
-    load_config()
-    load_banwords()
+    SETTINGS = Reloadable([CONFIG_FILE], load_config)
 except Exception as e:
     # 如果初始化失败，退出程序
     print(f"CRITICAL: Initialization failed due to: {e}. Application will exit.", file=sys.stderr)
     exit(1) # 关键配置或文件加载失败，直接退出
 
+try:
+    BANWORD_MATCHER = Reloadable([BANWORDS_FILE], load_banwords)
+except Exception as e:
+    print(f"ERROR: Failed to load banned words list: {str(e)}", file=sys.stderr)
+    # 选择是继续运行（没有敏感词过滤）而不是抛出错误停止服务，文件修复后会被热加载
+    BANWORD_MATCHER = Reloadable([BANWORDS_FILE], load_banwords, initial=BanwordMatcher())
+
+start_watcher(SETTINGS, BANWORD_MATCHER)
+
+# 合并并发的相同上游请求：旅行团同时提问时只调用一次 Coze
+INFLIGHT = SingleFlight()
+# Coze 的并发上限和等待队列（网关中与其他服务共用）
+COZE_LIMIT = ADMISSION.upstream('coze')
+
 
-def valid_auth_key(auth_key):
+def valid_auth_key(auth_key, config):
     """验证请求头中的 auth-key (旧版认证，fast_endpoint 将不再使用)"""
-    if not auth_key or not auth_key.startswith('Bearer '):
-        return False
-    key = auth_key.split(' ')[1]
-    # 确保 CONFIG['auth_keys'] 存在且是列表
-    return key in CONFIG.get('auth_keys', [])
-
-def contains_banned_words(query):
-    """检查查询是否包含敏感词"""
-    if not isinstance(query, str): # 确保 query 是字符串
-        return False
-    return any(banword in query for banword in BANWORDS)
+    return check_auth_key(auth_key, config.get('auth_keys', []))
 
-def clean_markdown(text):
-    """清除文本中的 markdown 格式符号"""
-    if not isinstance(text, str):
-        return text
-    
-    # 清除常见的 markdown 格式符号
-    # 标题符号 (#)
-    text = re.sub(r'^#+\s*', '', text, flags=re.MULTILINE)
-    
-    # 更积极地清除所有星号相关的格式
-    # 先处理标准的粗体和斜体格式
-    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)  # **粗体**
-    text = re.sub(r'__([^_]+)__', r'\1', text)      # __粗体__
-    text = re.sub(r'\*([^*]+)\*', r'\1', text)      # *斜体*
-    text = re.sub(r'_([^_]+)_', r'\1', text)        # _斜体_
-    
-    # 清除残留的单独星号（包括不匹配的情况）
-    text = re.sub(r'\*+', '', text)  # 清除所有连续的星号
-    text = re.sub(r'_+', '', text)   # 清除所有连续的下划线
-    
-    # 删除线 (~~)
-    text = re.sub(r'~~([^~]+)~~', r'\1', text)
-    text = re.sub(r'~+', '', text)   # 清除残留的波浪号
-    
-    # 代码块 (```)
-    text = re.sub(r'```[^`]*```', '', text, flags=re.DOTALL)
-    
-    # 内联代码 (`)
-    text = re.sub(r'`([^`]+)`', r'\1', text)
-    text = re.sub(r'`+', '', text)   # 清除残留的反引号
-    
-    # 链接 [text](url)
-    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
-    
-    # 图片 ![alt](url)
-    text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', text)
-    
-    # 引用 (>)
-    text = re.sub(r'^>\s*', '', text, flags=re.MULTILINE)
-    
-    # 列表符号 (-, +, *)
-    text = re.sub(r'^[-+*]\s*', '', text, flags=re.MULTILINE)
-    
-    # 有序列表 (1. 2. 等)
-    text = re.sub(r'^\d+\.\s*', '', text, flags=re.MULTILINE)
-    
-    # 表格分隔符 (|)
-    text = re.sub(r'\|', ' ', text)
-    
-    # 水平分割线 (---, ***)
-    text = re.sub(r'^[-*]{3,}\s*$', '', text, flags=re.MULTILINE)
-    
-    # 清理多余的空白字符
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
-    
-    return text
+def request_caller(config):
+    """限速和公平排队使用的调用方标识：带有合法 auth-key 时为 key，否则为客户端 IP（/ 和 /nav 不要求 auth-key）"""
+    auth_key = request.headers.get('auth-key')
+    if valid_auth_key(auth_key, config):
+        return bearer_key(auth_key)
+    return f'ip:{request.remote_addr}'
+
+def contains_banned_words(query, banword_matcher):
+    """检查查询是否包含敏感词，命中时返回 BanwordMatch（含命中的词），否则返回 None"""
+    if not isinstance(query, str): # 确保 query 是字符串
+        return None
+    return banword_matcher.search(query)
 
 # 新的 SDK 流处理器
 def sdk_stream_processor(sdk_stream, bot_id: str):
     """处理来自 Coze SDK 的流并产生内容部分。"""
     print(f"\n--- SDK Response stream from bot {bot_id} ---", file=sys.stderr)
+    # 流式去除 markdown 格式，跨 chunk 的格式符号也能正确处理
+    stripper = MarkdownStripper()
     try:
         full_content_for_logging = [] 
-        for event in sdk_stream:
-            if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
-                if hasattr(event, 'message') and \
-                   event.message.role == MessageRole.ASSISTANT and \
-                   event.message.type == MessageType.ANSWER and \
-                   event.message.content:
-                    # 清理响应内容中的 markdown 格式
-                    content_part = clean_markdown(event.message.content)
-                    full_content_for_logging.append(content_part)
-                    yield content_part
-            elif event.event == ChatEventType.ERROR:
-                error_detail = event.error if hasattr(event, 'error') else None
-                error_message = "Unknown SDK error"
-                error_code = "N/A"
-                if error_detail:
-                    # 尝试获取更详细的错误信息
-                    if hasattr(error_detail, 'message') and error_detail.message:
-                        error_message = error_detail.message
-                    elif isinstance(error_detail, str):
-                        error_message = error_detail
-                    else:
-                        error_message = str(error_detail)
-
-                    if hasattr(error_detail, 'code') and error_detail.code:
-                        error_code = error_detail.code
+        # 客户端断开（外层关闭生成器）时立即关闭 SDK 的 HTTP 响应，不再接收后续事件
+        with UpstreamGuard(sdk_stream, f'coze bot {bot_id}') as guard:
+            for event in sdk_stream:
+                if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    if hasattr(event, 'message') and \
+                       event.message.role == MessageRole.ASSISTANT and \
+                       event.message.type == MessageType.ANSWER and \
+                       event.message.content:
+                        guard.tick()
+                        # 清理响应内容中的 markdown 格式；暂时无法确定的部分留到后续 chunk 再输出
+                        content_part = stripper.feed(event.message.content)
+                        if content_part:
+                            full_content_for_logging.append(content_part)
+                            yield content_part
+                elif event.event == ChatEventType.ERROR:
+                    error_detail = event.error if hasattr(event, 'error') else None
+                    error_message = "Unknown SDK error"
+                    error_code = "N/A"
+                    if error_detail:
+                        # 尝试获取更详细的错误信息
+                        if hasattr(error_detail, 'message') and error_detail.message:
+                            error_message = error_detail.message
+                        elif isinstance(error_detail, str):
+                            error_message = error_detail
+                        else:
+                            error_message = str(error_detail)
+
+                        if hasattr(error_detail, 'code') and error_detail.code:
+                            error_code = error_detail.code
                 
-                print(f"\nERROR: Coze SDK Error Event: Code={error_code}, Message='{error_message}'", file=sys.stderr)
-                yield f"[ERROR: Coze SDK Error - {error_message}]"
-                break 
+                    print(f"\nERROR: Coze SDK Error Event: Code={error_code}, Message='{error_message}'", file=sys.stderr)
+                    tail = stripper.flush()
+                    if tail:
+                        yield tail
+                    yield f"[ERROR: Coze SDK Error - {error_message}]"
+                    break 
+        
+        # 输出最后暂存的内容（出错时已经输出过，这里为空）
+        tail = stripper.flush()
+        if tail:
+            full_content_for_logging.append(tail)
+            yield tail
         
         if full_content_for_logging:
             print(''.join(full_content_for_logging), file=sys.stderr) # 记录完整的消息
@@ -250,6 +233,10 @@ def sdk_stream_processor(sdk_stream, bot_id: str):
 def fast_endpoint():
     """Coze 快速响应 Bot 接口 (流式) - 使用 SDK 和 JWTAuth"""
     # 1. 认证 - 由 coze_client 通过 JWTAuth 自动处理
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    config = settings.config
+    banword_matcher = BANWORD_MATCHER.current
 
     # 2. 获取 Query (确保是 JSON 请求)
     if not request.is_json:
@@ -261,19 +248,24 @@ def fast_endpoint():
         print("ERROR: Missing or invalid 'query' parameter in JSON request.", file=sys.stderr)
         return {"error": "Missing or invalid 'query' parameter"}, 400 
     query = data['query']
+    # stream_mode：raw（默认）为原始文本，sse 为 SSE 事件，sentence 为逐句的 SSE 事件（TTS 可以逐句合成）
+    stream_mode = data.get('stream_mode', 'raw')
+    if stream_mode not in STREAM_MODES:
+        return {"error": f"stream_mode must be one of {', '.join(STREAM_MODES)}"}, 400
 
     # 3. 敏感词检查
-    if contains_banned_words(query):
-        print(f"INFO: Banned word detected in query from {request.remote_addr}. Query: '{query[:50]}...'", file=sys.stderr)
-        return Response(CONFIG.get('rejection_message', "Query contains restricted content."), mimetype='text/plain', status=200)
+    banned = contains_banned_words(query, banword_matcher)
+    if banned:
+        print(f"INFO: Banned word '{banned.term}' (matched '{query[banned.start:banned.end]}') detected in query from {request.remote_addr}. Query: '{query[:50]}...'", file=sys.stderr)
+        return Response(config.get('rejection_message', "Query contains restricted content."), mimetype='text/plain', status=200)
 
     # 4. 调用 Coze SDK 并流式返回
-    global coze_client # 确保我们引用的是全局客户端
+    coze_client = settings.coze_client
     if not coze_client:
         print("CRITICAL: coze_client is not initialized. Check server configuration and startup logs.", file=sys.stderr)
         return {"error": "Server configuration error - Coze client not ready"}, 500
         
-    bot_id = CONFIG.get('fast_bot_id')
+    bot_id = config.get('fast_bot_id')
     if not bot_id:
          print("ERROR: Server configuration error: 'fast_bot_id' is missing.", file=sys.stderr)
          return {"error": "Server configuration error"}, 500 
@@ -293,15 +285,28 @@ def fast_endpoint():
     )
 
     print(f"INFO: Calling fast bot ({bot_id}) via SDK for {request.remote_addr}. Query: '{query[:50]}...'", file=sys.stderr)
+    caller = request_caller(config)
     
     try:
         # 注意：SDK 的 stream 方法可能不直接接受 stream=True 参数，它本身就是流式方法
-        sdk_stream_iterable = coze_client.chat.stream(
-            bot_id=bot_id,
-            user_id="api_user", # 与旧版行为一致
-            additional_messages=[user_message],
-            auto_save_history=False, 
-        )
+        def open_stream():
+            sdk_stream_iterable = coze_client.chat.stream(
+                bot_id=bot_id,
+                user_id="api_user", # 与旧版行为一致
+                additional_messages=[user_message],
+                auto_save_history=False, 
+            )
+            # 处理生成器还没开始迭代就被关闭时，同样关闭 SDK 的 HTTP 响应
+            return ClosingIterator(sdk_stream_processor(sdk_stream_iterable, bot_id),
+                                   lambda: close_response(sdk_stream_iterable))
+
+        # 并发的相同问题共享同一条上游流，每个请求都从头收到完整内容；新的上游流占用一个 Coze 名额，名额已满时先排队
+        ADMISSION.check_rate('coze', caller, settings.admission.limit(caller))
+        shared_stream = admit_stream(INFLIGHT, ('fast', bot_id, normalize(query)[0]), COZE_LIMIT, caller, open_stream,
+                                     settings.admission.priority('/', STREAM))
+    except Rejected as e:
+        print(f"WARNING: Fast bot request from {request.remote_addr} rejected: {e}", file=sys.stderr)
+        return {"error": e.detail}, 429, e.headers
     except AttributeError as ae: 
         print(f"ERROR: Coze SDK call failed (AttributeError) for bot {bot_id}: {ae}\n{traceback.format_exc()}", file=sys.stderr)
         return {"error": "Server error calling Coze service (SDK structure)"}, 500
@@ -318,13 +323,26 @@ def fast_endpoint():
         print(f"ERROR: Coze SDK call failed for bot {bot_id}: {e}\n{traceback.format_exc()}", file=sys.stderr)
         return {"error": "Internal server error calling Coze service"}, 500
 
-    processed_generator = sdk_stream_processor(sdk_stream_iterable, bot_id)
+    # 模型输出同样经过敏感词过滤，命中时截断为拒绝回答的消息
+    processed_generator = moderate_stream(
+        shared_stream,
+        banword_matcher,
+        config.get('rejection_message', "Query contains restricted content."),
+    )
     
     headers = {
         'Cache-Control': 'no-cache',
         'X-Accel-Buffering': 'no'  
     }
-    return Response(stream_with_context(processed_generator), 
+    # 短时间内到达的片段按 stream_mode 合并成一次写出；客户端断开后不再输出，并关闭上游流
+    if stream_mode == 'sentence':
+        chunks = framed_writes(sentence_events(processed_generator))
+    elif stream_mode == 'sse':
+        chunks = event_writes(processed_generator)
+    else:
+        chunks = text_writes(processed_generator)
+    body = close_on_disconnect(chunks, request.environ)
+    return Response(closing(stream_with_context(body), body), 
                    content_type='text/event-stream', # SSE
                    headers=headers)
 
@@ -333,6 +351,9 @@ def fast_endpoint():
 def nav_endpoint():
     """导航 Bot 接口 (非流式) - 使用 SDK 和 JWTAuth"""
     # 1. 认证 - 由 coze_client 通过 JWTAuth 自动处理
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    config = settings.config
 
     # 2. 获取 Query (确保是 JSON 请求)
     if not request.is_json:
@@ -348,12 +369,12 @@ def nav_endpoint():
     # 3. 跳过敏感词检查 (根据要求)
 
     # 4. 调用 Coze SDK 并返回完整文本
-    global coze_client # 确保我们引用的是全局客户端
+    coze_client = settings.coze_client
     if not coze_client:
         print("CRITICAL: coze_client is not initialized. Check server configuration and startup logs.", file=sys.stderr)
         return {"error": "Server configuration error - Coze client not ready"}, 500
         
-    bot_id = CONFIG.get('nav_bot_id')
+    bot_id = config.get('nav_bot_id')
     if not bot_id:
          print("ERROR: Server configuration error: 'nav_bot_id' is missing.", file=sys.stderr)
          return {"error": "Server configuration error"}, 500 
@@ -373,77 +394,41 @@ def nav_endpoint():
     )
 
     print(f"INFO: Calling nav bot ({bot_id}) via SDK for {request.remote_addr}. Query: '{query[:50]}...'", file=sys.stderr)
+    caller = request_caller(config)
     
     try:
-        # 使用非流式调用
-        chat_response = coze_client.chat.create(
-            bot_id=bot_id,
-            user_id="api_user",
-            additional_messages=[user_message],
-            auto_save_history=True
-        )
-        
-        # 获取完整的响应文本
-        full_content = ""
-        
-        # 等待对话完成
-        max_wait_time = 60  # 最大等待60秒
-        wait_interval = 0.5   # 每0.5秒检查一次
-        waited_time = 0
-        
-        while (hasattr(chat_response, 'status') and 
-               str(chat_response.status) == 'ChatStatus.IN_PROGRESS' and 
-               waited_time < max_wait_time):
-            
-            time.sleep(wait_interval)
-            waited_time += wait_interval
-            
-            # 重新获取对话状态
-            try:
-                chat_response = coze_client.chat.retrieve(
-                    conversation_id=chat_response.conversation_id,
-                    chat_id=chat_response.id
-                )
-            except Exception as e:
-                print(f"ERROR: Failed to retrieve chat status: {e}", file=sys.stderr)
-                break
-        
-        if waited_time >= max_wait_time:
-            print(f"ERROR: Chat timed out after {max_wait_time} seconds", file=sys.stderr)
-            return {"error": "Chat request timed out"}, 504
-        
-        if hasattr(chat_response, 'status') and str(chat_response.status) == 'ChatStatus.COMPLETED':
-            # 对话已完成，获取消息
-            if hasattr(chat_response, 'id') and hasattr(chat_response, 'conversation_id'):
+        ADMISSION.check_rate('coze', caller, settings.admission.limit(caller))
+        # 默认通过流式事件接口等待回答，收到对话完成事件立即返回；
+        # nav_completion_mode 为 "poll" 时直接使用退避轮询。流式接口在收到第一个事件之前出错时也会退回到轮询，
+        # 之后的错误由 answer_via_stream 处理（返回已收到的回答或抛出 ChatFailed），不会再新建一次对话
+        mode = config.get('nav_completion_mode', 'stream')
+        full_content = None
+        # 整个对话（包括退回轮询）占用一个 Coze 名额
+        with COZE_LIMIT.acquire(caller, settings.admission.priority('/nav', NAV)):
+            if mode == 'stream':
                 try:
-                    # 获取对话中的消息
-                    messages = coze_client.chat.messages.list(
-                        conversation_id=chat_response.conversation_id,
-                        chat_id=chat_response.id
+                    full_content = answer_via_stream(
+                        coze_client, bot_id, "api_user", [user_message], auto_save_history=True
                     )
-                    
-                    # 寻找助手的回复消息
-                    for message in messages:
-                        if (hasattr(message, 'role') and message.role == MessageRole.ASSISTANT and 
-                            hasattr(message, 'type') and message.type == MessageType.ANSWER and
-                            hasattr(message, 'content') and message.content):
-                            full_content += message.content
-                            
+                except ChatFailed:
+                    raise
                 except Exception as e:
-                    print(f"ERROR: Failed to retrieve messages for nav bot {bot_id}: {e}", file=sys.stderr)
-                    return {"error": "Failed to retrieve bot response"}, 500
-        else:
-            print(f"ERROR: Chat did not complete successfully. Final status: {chat_response.status}", file=sys.stderr)
-            return {"error": "Chat did not complete successfully"}, 500
-        
-        if not full_content:
-            print(f"WARNING: No valid content received from nav bot {bot_id}", file=sys.stderr)
-            return {"error": "No content received from bot"}, 500
-            
+                    print(f"WARNING: Stream completion failed before the first event for nav bot {bot_id}, falling back to polling: {e}", file=sys.stderr)
+            if full_content is None:
+                full_content = answer_via_polling(
+                    coze_client, bot_id, "api_user", [user_message], auto_save_history=True
+                )
+
         print(f"INFO: Nav bot ({bot_id}) response: {full_content[:100]}...", file=sys.stderr)
         
         return Response(full_content, mimetype='text/plain', status=200)
         
+    except Rejected as e:
+        print(f"WARNING: Nav bot request from {request.remote_addr} rejected: {e}", file=sys.stderr)
+        return {"error": e.detail}, 429, e.headers
+    except ChatFailed as e:
+        print(f"ERROR: Nav bot {bot_id}: {e}", file=sys.stderr)
+        return {"error": str(e)}, e.status
     except AttributeError as ae: 
         print(f"ERROR: Coze SDK call failed (AttributeError) for nav bot {bot_id}: {ae}\n{traceback.format_exc()}", file=sys.stderr)
         return {"error": "Server error calling Coze service (SDK structure)"}, 500
@@ -460,6 +445,14 @@ def nav_endpoint():
         print(f"ERROR: Coze SDK call failed for nav bot {bot_id}: {e}\n{traceback.format_exc()}", file=sys.stderr)
         return {"error": "Internal server error calling Coze service"}, 500
 
+@app.route('/stats', methods=['GET'])
+def stats_endpoint():
+    """返回并发请求合并、上游流取消、准入控制等运行时统计"""
+    if not valid_auth_key(request.headers.get('auth-key', ''), SETTINGS.current.config):
+        return {'detail': 'Invalid key'}, 401
+    return {'inflight': INFLIGHT.stats(), 'cancellations': CANCEL_STATS.stats(), 'writes': WRITE_STATS.stats(),
+            'admission': ADMISSION.stats()}
+
 # --- 启动服务 ---
 if __name__ == '__main__':
     # 从环境变量获取端口，默认为 9000
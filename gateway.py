@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""在一个进程中托管 piaofutong / shuziren / shimenguan / coze 四个服务的网关。
+
+四个服务原来各自是一个 Flask 进程，各有一份大模型客户端（连接池）、敏感词自动机、回答缓存和鉴权代码，
+内存占用是一个进程的四倍，缓存容量也被分成了四份。网关把每个服务原样挂载到自己的路径前缀下：
+    /piaofutong/、/shuziren/、/shimenguan/nav、/coze/nav ……
+接口和返回格式不变，只是多了服务名前缀；GATEWAY_ROOT 指定的服务同时挂载在根路径下，
+原来直接访问该服务的客户端不用修改。同一进程内共享：
+    - 大模型客户端：common.clients 按 api_key 复用，api_key 相同的服务共用一个连接池；
+    - 敏感词自动机：common.banwords.shared_matcher 对相同的词表只编译一次；
+    - 回答缓存和并发请求合并：所有服务使用同一个 ResponseCache / SingleFlight（缓存键中含提示词和知识库，互不冲突）；
+    - 鉴权：common.auth，每个服务仍然只接受自己 config.json 中的 auth_keys。
+每个服务从 <服务名>_DATA_DIR 目录读取 config.json、banwords.txt 等文件，默认使用仓库中的服务目录。
+
+用法（在仓库根目录执行）：
+    python gateway.py
+    GATEWAY_SERVICES=shuziren,shimenguan GATEWAY_ROOT=shimenguan PORT=9000 python gateway.py
+    waitress-serve --host=0.0.0.0 --port=9000 gateway:app
+"""
+import importlib
+import os
+import sys
+
+from werkzeug.exceptions import NotFound
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from common.cache import ResponseCache
+from common.singleflight import SingleFlight
+
+SERVICES = ('piaofutong', 'shuziren', 'shimenguan', 'coze')
+
+
+def load_services(names):
+    """导入各服务的 main 模块，返回 {服务名: 模块}。"""
+    modules = {}
+    for name in names:
+        if name not in SERVICES:
+            raise ValueError(f"Unknown service '{name}', expected one of {', '.join(SERVICES)}")
+        os.environ.setdefault(f'{name.upper()}_DATA_DIR', os.path.join(ROOT, name))
+        modules[name] = importlib.import_module(f'{name}.main')
+    return modules
+
+
+def share_state(modules):
+    """让所有服务使用同一个回答缓存和同一个 SingleFlight（服务在请求时才读取这两个全局变量）。"""
+    response_cache = ResponseCache()
+    inflight = SingleFlight()
+    for module in modules.values():
+        if hasattr(module, 'RESPONSE_CACHE'):
+            module.RESPONSE_CACHE = response_cache
+        if hasattr(module, 'INFLIGHT'):
+            module.INFLIGHT = inflight
+    return response_cache, inflight
+
+
+def create_app(names=None, root=None):
+    """返回挂载了各服务的 WSGI 应用；root 为同时挂载在根路径下的服务名。"""
+    modules = load_services(names or SERVICES)
+    share_state(modules)
+    if root is not None and root not in modules:
+        raise ValueError(f"GATEWAY_ROOT '{root}' is not one of the hosted services")
+    root_app = modules[root].app if root else NotFound()
+    return DispatcherMiddleware(root_app, {f'/{name}': module.app for name, module in modules.items()})
+
+
+def services_from_env():
+    names = os.environ.get('GATEWAY_SERVICES', '')
+    return [name.strip() for name in names.split(',') if name.strip()] or list(SERVICES)
+
+
+app = create_app(services_from_env(), os.environ.get('GATEWAY_ROOT') or None)
+
+if __name__ == '__main__':
+    from werkzeug.serving import run_simple
+    port = int(os.environ.get('PORT', 9000))
+    print(f"INFO: Starting gateway on host 0.0.0.0, port {port}...", file=sys.stderr)
+    run_simple('0.0.0.0', port, app, threaded=True)
@@ -1,9 +1,12 @@
 from mangum import Mangum
+import uvicorn
 from typing import Optional
 from fastapi import FastAPI, HTTPException, Body, Header, Depends
 import json
 from zhipuai import ZhipuAI
 
+from common.banwords import BanwordMatcher
+
 # 从配置文件中读取配置
 with open('config.json', 'r') as config_file:
     config = json.load(config_file)
@@ -17,9 +20,10 @@ auth_keys = []
 
 # 定义全局变量来存储敏感词集合
 BANWORDS = set()
+BANWORD_MATCHER = BanwordMatcher()
 
-def handler(environ, start_response):
-    return mangum_handler(environ, start_response)
+# AWS Lambda 等无服务器环境的入口（event, context）
+handler = Mangum(app)
 
 with open('auth_keys.txt', 'r') as f:
     auth_keys = [line.strip() for line in f.readlines()]
@@ -38,8 +42,9 @@ def valid_auth_key(auth_key: str = Header(...)):  # Use depends to validate and
 async def load_banwords():
     try:
         with open('banwords.txt', 'r', encoding='utf-8') as file:
-            global BANWORDS
+            global BANWORDS, BANWORD_MATCHER
             BANWORDS = set(line.strip() for line in file.readlines())
+            BANWORD_MATCHER = BanwordMatcher(BANWORDS)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to load banned words list.")
 
@@ -53,7 +58,7 @@ async def query_endpoint(key: str = Depends(valid_auth_key),
     prompt: Optional[str] = Body(default=default_prompt, embed=True), 
     query: str = Body(..., embed=True)  # '...' 意味着这是一个必填字段
 ):
-    if any(banword in query for banword in BANWORDS):
+    if BANWORD_MATCHER.search(query):
         return "对不起，我无法回答这个问题。"
 
     try:
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""shimenguan 的异步（ASGI）服务模式：/、/nav、/bot 三个接口。
+
+Flask 版本（main.py）中每个流式请求从开始到上游流结束都占着一个线程，并发流的数量受线程数限制。
+这里的接口与 main.py 的请求参数、返回格式完全相同，但请求是协程：上游调用通过共享的 httpx.AsyncClient
+异步发出（common.aio），流式回答以异步生成器经过 markdown 清理和敏感词过滤后以 SSE 返回，
+等待上游时不占线程，一个进程可以同时保持上千条流。
+
+配置快照、热加载、敏感词、POI 解析、提示词构造和回答缓存都直接复用 main.py 中的实现；
+并发的相同请求由 AsyncSingleFlight 合并。/turn 仍只在 Flask 版本中提供。
+
+/ws 是讲解机的 WebSocket 长连接通道（common.channel）：鉴权一次后，在同一条连接上发送任意多个 /、/nav、/bot 请求，
+回答和导航判断以带请求 ID 的消息推送回来，请求参数和回答内容与 HTTP 接口相同（uvicorn 需要安装 websockets）。
+
+用法（在仓库根目录执行，数据文件目录由 SHIMENGUAN_DATA_DIR 指定，默认为当前工作目录）：
+    SHIMENGUAN_DATA_DIR=shimenguan uvicorn shimenguan.asgi:app --host 0.0.0.0 --port 9000
+"""
+from contextlib import asynccontextmanager
+import os
+import sys
+
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+# 将仓库根目录加入模块搜索路径，以便导入 common 包和 Flask 版本的 shimenguan.main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.admission import ADMISSION, CHAT, NAV, STREAM, Rejected, admit_astream
+from common.aio import AsyncZhipuAI, new_http_client
+from common.auth import bearer_key, valid_auth_key
+from common.banwords import moderate_astream
+from common.cache import DEFAULT_REPLAY_RATE, as_text, record_astream, replay_astream
+from common.channel import CHANNEL_STATS, RequestError, serve_channel
+from common.markdown import clean_markdown, strip_astream
+from common.singleflight import AsyncSingleFlight
+from shimenguan import main as service
+
+# 共享的上游连接池，在应用启动时创建
+HTTP = None
+# 合并并发的相同上游请求（异步版本）
+INFLIGHT = AsyncSingleFlight()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global HTTP
+    HTTP = new_http_client()
+    try:
+        yield
+    finally:
+        await HTTP.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def detail(message, status_code):
+    return JSONResponse({'detail': message}, status_code=status_code)
+
+
+def text(answer):
+    # 与 Flask 返回字符串时相同：text/html; charset=utf-8
+    return HTMLResponse(answer or '')
+
+
+def sse(chunks):
+    return StreamingResponse(chunks, media_type='text/event-stream')
+
+
+def snapshot():
+    """整个请求使用同一份配置快照，热加载不会影响进行中的请求。"""
+    return service.SETTINGS.current, service.BANWORD_MATCHER.current
+
+
+def check_query(data):
+    if not isinstance(data, dict) or 'query' not in data:
+        raise RequestError('Missing query parameter', 400)
+
+
+async def respond(request, handler):
+    """HTTP 接口：校验 auth-key、解析 JSON 请求体后调用 handler，把回答包装成响应。"""
+    settings, banword_matcher = snapshot()
+    auth_key = request.headers.get('auth-key')
+    if not valid_auth_key(auth_key, settings.auth_keys):
+        return detail('Invalid key', 401)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    try:
+        check_query(data)
+        reply = await handler(settings, banword_matcher, data, bearer_key(auth_key))
+    except RequestError as e:
+        return detail(e.detail, e.status_code)
+    except Rejected as e:
+        return JSONResponse({'detail': e.detail}, status_code=429, headers=e.headers)
+    except Exception as e:
+        return detail(str(e), 500)
+    return sse(reply) if hasattr(reply, '__aiter__') else text(reply)
+
+
+def zhipuai(settings):
+    return AsyncZhipuAI(HTTP, settings.api_key)
+
+
+# / 的流式回答：命中缓存时重放，否则请求大模型（并发的相同请求共享同一条上游流，占用一个上游名额）
+async def answer_astream(settings, chat, cached, replay_rate, clean_output, caller):
+    if cached is not None:
+        chunks = replay_astream(cached, replay_rate)
+    else:
+        service.check_rate(settings, caller)
+        chunks = await admit_astream(INFLIGHT, chat.cache_key, service.ZHIPUAI_LIMIT, caller,
+                                     lambda: zhipuai(settings).stream(settings.model, chat.messages, chat.tools),
+                                     settings.admission.priority('/', STREAM))
+        if chat.cacheable:
+            chunks = record_astream(
+                chunks, lambda recorded: service.remember_answer(chat.cache_key, chat.query, recorded, settings))
+    if clean_output:
+        chunks = strip_astream(chunks)
+    return chunks
+
+
+# 以下 answer_* 由 HTTP 接口和 WebSocket 通道共用：返回回答的文本，或者流式回答的异步生成器；
+# caller 为请求的 key，用于限速和公平排队，未被准入时抛出 Rejected
+async def answer_query(settings, banword_matcher, data, caller):
+    query = data.get('query', None)
+    stream = data.get('stream', False)
+    # no_cache 为 true 时跳过缓存查找，直接请求大模型并用新回答刷新缓存
+    no_cache = data.get('no_cache', False)
+    # clean_output 为 true 时去除回答中的 markdown 格式（数字人朗读用）
+    clean_output = settings.config.get('clean_output', False)
+    print(f'query = {query}')
+    print(f'stream = {stream}')
+
+    banned = service.contains_banned_words(query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{query[banned.start:banned.end]}」)，直接返回!")
+        return settings.rejection_message
+
+    chat = service.prepare_chat(settings, query)
+    cached = service.lookup_cached_answer(chat.cache_key, chat.query, settings) if chat.cacheable and not no_cache else None
+    if not stream:
+        if cached is not None:
+            answer = as_text(cached)
+            return clean_markdown(answer) if clean_output else answer
+        service.check_rate(settings, caller)
+        answer = await INFLIGHT.do(chat.cache_key, lambda: service.ZHIPUAI_LIMIT.call_async(
+            caller, lambda: zhipuai(settings).complete(settings.model, chat.messages, chat.tools),
+            settings.admission.priority('/', CHAT)))
+        if chat.cacheable and answer:
+            service.remember_answer(chat.cache_key, chat.query, answer, settings)
+        return clean_markdown(answer) if clean_output else answer
+    chunks = await answer_astream(settings, chat, cached, data.get('replay_rate', DEFAULT_REPLAY_RATE), clean_output,
+                                  caller)
+    return moderate_astream(chunks, banword_matcher, settings.rejection_message)
+
+
+async def answer_nav(settings, banword_matcher, data, caller):
+    query = data.get('query', None)
+    no_cache = data.get('no_cache', False)
+    print(f'query = {query}')
+
+    banned = service.contains_banned_words(query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{query[banned.start:banned.end]}」)，直接返回!")
+        return '{\"NEEDNAV\":\"N\",\"POI\":\"NONE\"}'
+    nav = service.plan_nav(settings, query, no_cache)
+    if nav.answer is not None:
+        return nav.answer
+    service.check_rate(settings, caller)
+    answer = await INFLIGHT.do(nav.cache_key, lambda: service.ZHIPUAI_LIMIT.call_async(
+        caller, lambda: zhipuai(settings).complete(settings.model, nav.messages), settings.admission.priority('/nav', NAV)))
+    if answer:
+        service.RESPONSE_CACHE.put(nav.cache_key, answer)
+    return answer
+
+
+async def bot_astream(response):
+    """逐行解析应用接口的流式响应；结束或提前关闭时释放连接。"""
+    try:
+        async for line in response.aiter_lines():
+            if line:
+                yield service.bot_stream_chunk(line)
+    finally:
+        await response.aclose()
+
+
+async def answer_bot(settings, banword_matcher, data, caller):
+    stream = data.get('stream', False)
+    if not settings.config.get("app_id"):
+        raise RequestError('config中缺少app_id配置', 500)
+    clean_output = settings.config.get('clean_output', False)
+    bot = service.prepare_bot(settings, data['query'], stream)
+
+    banned = service.contains_banned_words(bot.query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{bot.query[banned.start:banned.end]}」)，直接返回!")
+        return settings.rejection_message
+    service.check_rate(settings, caller)
+    if not stream:
+        with await service.ZHIPUAI_LIMIT.acquire_async(caller, settings.admission.priority('/bot', CHAT)):
+            r = await HTTP.post(service.BOT_URL, headers=bot.headers, json=bot.payload)
+        if r.status_code != 200:
+            raise RequestError(r.text, r.status_code)
+        answer = service.bot_message(r.json())
+        return clean_markdown(answer) if clean_output else answer
+    # 上游名额占用到流结束
+    slot = await service.ZHIPUAI_LIMIT.acquire_async(caller, settings.admission.priority('/bot', STREAM))
+    try:
+        r = await HTTP.send(HTTP.build_request('POST', service.BOT_URL, headers=bot.headers, json=bot.payload),
+                            stream=True)
+        if r.status_code != 200:
+            await r.aread()
+            await r.aclose()
+            raise RequestError(r.text, r.status_code)
+    except BaseException:
+        slot.release()
+        raise
+    chunks = slot.ahold(bot_astream(r))
+    if clean_output:
+        chunks = strip_astream(chunks)
+    return moderate_astream(chunks, banword_matcher, settings.rejection_message)
+
+
+@app.post('/')
+async def query_endpoint(request: Request):
+    return await respond(request, answer_query)
+
+
+@app.post('/nav')
+async def query_nav_endpoint(request: Request):
+    return await respond(request, answer_nav)
+
+
+@app.post('/bot')
+async def bot_endpoint(request: Request):
+    return await respond(request, answer_bot)
+
+
+def channel_handler(handler):
+    """WebSocket 通道中的请求：每个请求读取一次配置快照，参数校验与 HTTP 接口相同。"""
+    async def handle(data, auth_key):
+        settings, banword_matcher = snapshot()
+        check_query(data)
+        return await handler(settings, banword_matcher, data, bearer_key(auth_key))
+    return handle
+
+
+CHANNEL_HANDLERS = {'/': channel_handler(answer_query), '/nav': channel_handler(answer_nav),
+                    '/bot': channel_handler(answer_bot)}
+
+
+@app.websocket('/ws')
+async def channel_endpoint(websocket: WebSocket):
+    await serve_channel(websocket, CHANNEL_HANDLERS, lambda: service.SETTINGS.current.auth_keys)
+
+
+@app.get('/stats')
+async def stats_endpoint(request: Request):
+    """返回缓存命中率等运行时统计"""
+    settings = service.SETTINGS.current
+    if not valid_auth_key(request.headers.get('auth-key', ''), settings.auth_keys):
+        return detail('Invalid key', 401)
+    return {
+        'response_cache': service.RESPONSE_CACHE.stats(),
+        'similar_cache': service.SIMILAR_CACHE.stats(),
+        'inflight': INFLIGHT.stats(),
+        'channel': CHANNEL_STATS.stats(),
+        'admission': ADMISSION.stats(),
+        'poi_resolver': settings.poi_resolver.stats(),
+        'intent_classifier': settings.intent_classifier.stats() if settings.intent_classifier is not None else None,
+    }
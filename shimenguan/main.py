@@ -1,105 +1,179 @@
 # -*- coding: utf-8 -*-
 from flask import Flask, Response, stream_with_context, request
-from zhipuai import ZhipuAI
 import json
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import requests
-import csv
 import os
+import sys
+from types import SimpleNamespace
+
+# 将仓库根目录加入模块搜索路径，以便导入各服务共享的 common 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.admission import ADMISSION, CHAT, NAV, STREAM, AdmissionPolicy, Rejected, admit_stream
+from common.auth import bearer_key, valid_auth_key
+from common.banwords import moderate_stream, shared_matcher
+from common.cache import DEFAULT_REPLAY_RATE, ResponseCache, as_text, make_cache_key, record_stream, replay_stream
+from common.cancel import CANCEL_STATS, ClosingIterator, UpstreamGuard, close_on_disconnect, closing
+from common.clients import zhipuai_client
+from common.httppool import PooledSession, iter_stream_lines
+from common.intent import DEFAULT_THRESHOLD, IntentClassifier, IntentModel
+from common.markdown import clean_markdown, strip_stream
+from common.poi import NAV_INTENT_WORDS, PoiIndex, PoiResolver, format_aliases, format_poi_list, read_poi_csv
+from common.reload import Reloadable, start_watcher
+from common.singleflight import SingleFlight
+from common.similarity import SimilarityCache
+from common.sentences import sentence_events
+from common.sse import STREAM_MODES, WRITE_STATS, event_writes, format_event, framed_writes, text_writes
+from common.turn import TurnRunner
 
 app = Flask(__name__)
 
-# 定义全局变量来存储敏感词集合和POI映射
-BANWORDS = set()
-POI_MAPPING = {}
-POI_LIST = []
+# 数据文件所在目录，默认为当前工作目录；网关（gateway.py）在同一进程中托管多个服务时为每个服务分别指定
+DATA_DIR = os.environ.get('SHIMENGUAN_DATA_DIR', '')
+BANWORDS_FILE = os.path.join(DATA_DIR, 'banwords.txt')
+CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
+POI_FILE = os.path.join(DATA_DIR, 'poi.csv')
 
-# 加载POI数据
+# 加载POI数据，返回 (别名→标准名称的映射, 标准名称列表, 标准名称→类别列表)
 def load_poi_data():
-    global POI_MAPPING, POI_LIST
     try:
-        with open('poi.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader, None)  # 跳过标题行
-            for row in reader:
-                if row and len(row) > 0:
-                    standard_name = row[0].strip()
-                    POI_LIST.append(standard_name)
-                    # 将标准名称映射到自身
-                    POI_MAPPING[standard_name] = standard_name
-                    # 将所有别名映射到标准名称
-                    for alias in row[1:]:
-                        if alias.strip():
-                            POI_MAPPING[alias.strip()] = standard_name
+        with open(POI_FILE, 'r', encoding='utf-8') as file:
+            return read_poi_csv(file)
     except Exception as e:
         app.logger.error("Failed to load POI data: %s", str(e))
         raise e
 
 # 程序启动时加载敏感词
 def load_banwords():
-    global BANWORDS
     try:
-        with open('banwords.txt', 'r', encoding='utf-8') as file:
-            BANWORDS = {line.strip() for line in file if line.strip()}
+        with open(BANWORDS_FILE, 'r', encoding='utf-8') as file:
+            banwords = {line.strip() for line in file if line.strip()}
     except Exception as e:
         app.logger.error("Failed to load banned words list: %s", str(e))
         raise e
+    # 编译成自动机，请求时只需单遍扫描
+    return shared_matcher(banwords)
 
-# 初始化数据
-load_banwords()
-load_poi_data()
+# 提示词模板中插入POI列表和别名对应的位置
+DEFAULT_POI_MARKER = "以下是正确的完整地点列表："
+NAV_POI_MARKER = "这是可以作为目的地的完整地点列表。地点列表："
+ALIAS_MARKER = "重要别名对应："
 
-# 从config.json文件中读取配置信息
-with open('config.json', 'r', encoding='utf-8') as config_file:
-    config = json.load(config_file)
-    
-# 从配置信息中提取特定配置并赋值给变量
-api_key = config['api_key']
-knowledge_id = config['knowledge_id']
-auth_keys = config['auth_keys']
-default_prompt = config['default_prompt']
-nav_prompt = config['nav_prompt']
-model = config['model']  # 从配置中读取模型名称
-rejection_message = config['rejection_message']  # 从配置中读取拒绝回答的消息
+# 在提示词模板中填入POI列表和别名对应
+def fill_poi_block(prompt, poi_marker, poi_list, alias_pairs):
+    prompt = prompt.replace(poi_marker, f"{poi_marker}{format_poi_list(poi_list)}。")
+    return prompt.replace(ALIAS_MARKER, f"{ALIAS_MARKER}{format_aliases(alias_pairs)}。")
 
 # 更新提示词中的POI列表
-def update_prompts():
-    global default_prompt, nav_prompt
-    
-    # 更新default_prompt中的POI列表
-    poi_list_str = ", ".join([f'"{poi}"' for poi in POI_LIST])
-    default_prompt = default_prompt.replace("以下是正确的完整地点列表：", f"以下是正确的完整地点列表：{poi_list_str}。")
-    
-    # 更新nav_prompt中的POI列表
-    nav_prompt = nav_prompt.replace("这是可以作为目的地的完整地点列表。地点列表：", f"这是可以作为目的地的完整地点列表。地点列表：{poi_list_str}。")
-    
-    # 更新别名映射信息
-    alias_mapping_str = " ".join([f"{alias}={standard}" for alias, standard in POI_MAPPING.items() if alias != standard])
-    default_prompt = default_prompt.replace("重要别名对应：", f"重要别名对应：{alias_mapping_str}。")
-    nav_prompt = nav_prompt.replace("重要别名对应：", f"重要别名对应：{alias_mapping_str}。")
+def update_prompts(default_prompt, nav_prompt, poi_list, poi_mapping):
+    alias_pairs = [(alias, standard) for alias, standard in poi_mapping.items() if alias != standard]
+    return (fill_poi_block(default_prompt, DEFAULT_POI_MARKER, poi_list, alias_pairs),
+            fill_poi_block(nav_prompt, NAV_POI_MARKER, poi_list, alias_pairs))
 
-# 更新提示词
-update_prompts()
+# 配置了 poi_top_k 时，按问题检索最相关的 k 个POI，只把它们和它们的别名填进提示词；
+# 没有任何相关POI（或未配置）时使用包含全部POI的提示词
+def prompt_for_query(settings, template, poi_marker, full_prompt, query):
+    top_k = settings.config.get('poi_top_k')
+    if not top_k:
+        return full_prompt
+    pois = settings.poi_index.top(query, top_k)
+    if not pois:
+        return full_prompt
+    return fill_poi_block(template, poi_marker, pois, settings.poi_index.alias_pairs(pois))
 
-# 使用配置信息初始化ZhipuAI的客户端
-client = ZhipuAI(api_key=api_key)
+# 从config.json和poi.csv构建一份完整的配置快照
+def load_settings():
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    poi_mapping, poi_list, poi_categories = load_poi_data()
+    # 更新提示词
+    default_prompt, nav_prompt = update_prompts(config['default_prompt'], config['nav_prompt'], poi_list, poi_mapping)
+    poi_resolver = PoiResolver(poi_mapping, config.get('nav_intent_words', NAV_INTENT_WORDS))
+    # 配置了 intent_model（由 benchmarks/eval_intent.py 训练的权重文件）时，/nav 在本地拦下明显不需要导航的问题
+    intent_classifier = None
+    if config.get('intent_model'):
+        intent_model = IntentModel.load(os.path.join(DATA_DIR, config['intent_model']))
+        intent_classifier = IntentClassifier(intent_model, poi_resolver, config.get('intent_threshold', DEFAULT_THRESHOLD))
+    return SimpleNamespace(
+        config=config,
+        api_key=config['api_key'],
+        knowledge_id=config['knowledge_id'],
+        auth_keys=config['auth_keys'],
+        # 每个 key 调用大模型的限速
+        admission=AdmissionPolicy(config.get('admission')),
+        default_prompt=default_prompt,
+        nav_prompt=nav_prompt,
+        model=config['model'],  # 从配置中读取模型名称
+        rejection_message=config['rejection_message'],  # 从配置中读取拒绝回答的消息
+        poi_mapping=poi_mapping,
+        poi_list=poi_list,
+        # 别名 → 标准名称，按别名长度从长到短排列，供近似问题缓存归一化问题用
+        poi_aliases=sorted(((alias, standard) for alias, standard in poi_mapping.items() if alias != standard),
+                           key=lambda item: -len(item[0])),
+        # 本地导航解析：问题明确要去某个 POI 时 /nav 不调用大模型
+        poi_resolver=poi_resolver,
+        intent_classifier=intent_classifier,
+        # 按问题检索相关POI的 BM25 索引，用于缩短提示词
+        poi_index=PoiIndex(poi_list, poi_mapping, poi_categories),
+        # 使用配置信息初始化ZhipuAI的客户端
+        client=zhipuai_client(config['api_key']),
+    )
 
-def valid_auth_key(auth_key):
-    """验证授权key"""
-    if not auth_key.startswith('Bearer '):
-        return False
-    
-    key = auth_key.split(' ')[1]
-    # 假设auth_keys是一个有效的授权keys列表
-    if key in auth_keys:
-        return True
-    else:
-        return False
+# 初始化数据，文件变化时由后台线程热加载并整体替换
+BANWORD_MATCHER = Reloadable([BANWORDS_FILE], load_banwords)
+SETTINGS = Reloadable([CONFIG_FILE, POI_FILE], load_settings)
+start_watcher(BANWORD_MATCHER, SETTINGS)
+
+# 大模型回答的缓存（LRU + TTL），流式与非流式请求共用
+RESPONSE_CACHE = ResponseCache()
+# 合并并发的相同上游请求：旅行团同时提问时只调用一次大模型
+INFLIGHT = SingleFlight()
+# 近似问题缓存：不同说法的同一问题（“厕所在哪”“洗手间在哪里”）复用同一个回答
+SIMILAR_CACHE = SimilarityCache()
+# /bot 调用智能体应用接口使用的长连接池，连接数和超时可通过 HTTP_POOL_SIZE 等环境变量调整
+HTTP_SESSION = PooledSession()
+# /turn 并发执行导航判断和回答的线程池，线程数可通过 TURN_WORKERS、等待上游的最长秒数可通过 TURN_TIMEOUT 环境变量调整
+TURNS = TurnRunner()
+# 智谱的并发上限和等待队列（对话补全和 /bot 的应用接口共用，网关中与其他服务共用）
+ZHIPUAI_LIMIT = ADMISSION.upstream('zhipuai')
+
+# 调用大模型前按 key 限速，没有令牌时抛出 Rejected
+def check_rate(settings, caller):
+    ADMISSION.check_rate('shimenguan', caller, settings.admission.limit(caller))
 
-# 检查查询是否包含敏感词
-def contains_banned_words(query):
-    return any(banword in query for banword in BANWORDS)
+# 检查查询是否包含敏感词，命中时返回 BanwordMatch（含命中的词），否则返回 None
+def contains_banned_words(query, banword_matcher):
+    return banword_matcher.search(query)
+
+# 把问题里的POI别名替换成标准名称，让不同叫法的同一问题在近似缓存里更接近
+def canonicalize_poi(query, poi_aliases):
+    for alias, standard in poi_aliases:
+        if alias in query:
+            query = query.replace(alias, standard)
+    return query
+
+# 近似问题缓存的上下文：cache_key 去掉最后的问题部分，再加上问题提到的 POI，
+# 提到的地点不同（“东门停车场”“西门停车场”）的问题不会互相命中
+def similar_context(cache_key, query, settings):
+    return cache_key[:-1], tuple(sorted(settings.poi_resolver.mentions(query)))
+
+# 先查精确缓存，再查近似问题缓存（只用于 / 的回答，/nav 的导航判断只用精确缓存）
+def lookup_cached_answer(cache_key, query, settings):
+    cached = RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    match = SIMILAR_CACHE.lookup(similar_context(cache_key, query, settings), canonicalize_poi(query, settings.poi_aliases),
+                                 settings.config.get('similarity_threshold'))
+    if match is not None:
+        print(f"相似问题命中：「{query}」≈「{match.query}」(相似度 {match.score:.2f})")
+        return match.value
+    return None
+
+# 把回答同时写入精确缓存和近似问题缓存
+def remember_answer(cache_key, query, value, settings):
+    RESPONSE_CACHE.put(cache_key, value)
+    SIMILAR_CACHE.add(similar_context(cache_key, query, settings), canonicalize_poi(query, settings.poi_aliases), value,
+                      threshold=settings.config.get('similarity_threshold'))
 
 # 获取当前时间格式化字符串
 def get_formatted_time():
@@ -107,6 +181,182 @@ def get_formatted_time():
     now = datetime.now(tz)
     return now.strftime("(现在时间是%H点%M分)")
 
+# 构造 / 的大模型请求：系统提示词（附当前时间）、消息、知识库检索工具和缓存键
+def prepare_chat(settings, query):
+    prompt = settings.default_prompt
+    # 获取当前时间
+    formatted_time = get_formatted_time()
+    # 发给大模型的提示词只包含与问题相关的POI（配置了 poi_top_k 时）
+    query_prompt = prompt_for_query(settings, settings.config['default_prompt'], DEFAULT_POI_MARKER, prompt, query)
+    prompt_with_time = f"{query_prompt}{formatted_time}"
+    # 与时间相关的问题会附带当前时间，回答随时间变化，不进入缓存。
+    # 其余问题的缓存键使用不带时间、包含全部POI的系统提示词，避免每分钟变化的时间戳让缓存失效。
+    cacheable = True
+    if "路线" in query or "目前" in query or "现在" in query or "当前" in query or "时间" in query or "几点" in query:
+        query = f"{query}{formatted_time}"
+        cacheable = False
+        print(query)
+    # 创建消息列表和工具配置
+    messages = [
+        {"role": "system", "content": prompt_with_time},
+        {"role": "user", "content": query}
+    ]
+    tools_list = [
+        {
+            "type": "retrieval",
+            "retrieval": {
+                "knowledge_id": settings.knowledge_id,
+                "prompt_template": ("请优先从景区知识库里\n\"\"\"\n{{knowledge}}\n\"\"\"\n中找问题\n\"\"\"\n{{question}}\n\"\"\"\n的答案，找到答案就参考知识库中语句回答问题，"
+                                            "找不到答案就用自身知识回答。\n不要复述问题，直接开始回答。你只能回答跟景区旅游相关的问题，不要回答其他方面的问题。"
+                )
+            }
+        }
+    ]
+    return SimpleNamespace(
+        query=query,
+        messages=messages,
+        tools=tools_list,
+        cache_key=make_cache_key(None, settings.model, prompt, settings.knowledge_id, query),
+        cacheable=cacheable,
+    )
+
+# / 的流式回答：命中缓存时重放，否则请求大模型（并发的相同请求共享同一条上游流，占用一个上游名额）；
+# caller 为请求的 key，用于限速和公平排队
+def answer_stream(settings, chat, cached, replay_rate, clean_output, caller):
+    def generate():
+        response = settings.client.chat.completions.create(
+            model=settings.model,
+            messages=chat.messages,
+            tools=chat.tools,
+            stream=True
+        )
+        # 客户端断开（外层关闭生成器）时立即关闭上游响应，不再读完整个回答
+        with UpstreamGuard(response, 'shimenguan /') as guard:
+            for chunk in response:
+                guard.tick()
+                yield chunk.choices[0].delta.content
+
+    if cached is not None:
+        # 命中缓存时直接重放之前的回答，可按 replay_rate（字符/秒）限速输出
+        print('cached answer, replaying stream')
+        chunks = replay_stream(cached, replay_rate)
+    else:
+        # 并发的相同请求共享同一条上游流；完整结束的流会被记录进缓存
+        check_rate(settings, caller)
+        chunks = admit_stream(INFLIGHT, chat.cache_key, ZHIPUAI_LIMIT, caller, generate,
+                              settings.admission.priority('/', STREAM))
+        if chat.cacheable:
+            chunks = record_stream(chunks, lambda recorded: remember_answer(chat.cache_key, chat.query, recorded, settings))
+    # 缓存中保存原始回答，去除 markdown 格式只作用于本次输出
+    if clean_output:
+        chunks = strip_stream(chunks)
+    return chunks
+
+# /nav 中不需要大模型的部分：本地解析、本地意图判断、缓存。
+# 返回 answer 不为 None 时直接使用；否则按 messages 请求大模型，结果以 cache_key 写入缓存
+def plan_nav(settings, query, no_cache):
+    prompt = settings.nav_prompt
+    # 明确要去唯一 POI 的问题（“带我去东门”）在本地直接给出结果，其余交给大模型判断；
+    # 配置 local_nav 为 false 时关闭
+    if settings.config.get('local_nav', True):
+        match = settings.poi_resolver.resolve(query)
+        if match is not None:
+            print(f'本地解析导航目的地：{match.poi}（{match.method}）')
+            answer = json.dumps({"NEEDNAV": "Y", "POI": match.poi}, ensure_ascii=False, separators=(',', ':'))
+            return SimpleNamespace(answer=answer)
+    # 明显与导航无关的问题（“门票多少钱”）在本地判为不需要导航，拿不准的才交给大模型
+    if settings.intent_classifier is not None and settings.intent_classifier.is_chat(query):
+        print('本地判断不需要导航')
+        return SimpleNamespace(answer='{\"NEEDNAV\":\"N\",\"POI\":\"NONE\"}')
+    
+    # 发给大模型的提示词只包含与问题相关的POI（配置了 poi_top_k 时），缓存键仍使用完整的提示词
+    query_prompt = prompt_for_query(settings, settings.config['nav_prompt'], NAV_POI_MARKER, prompt, query)
+    print(f'prompt = {query_prompt}')
+
+    # 相同的导航问题直接返回缓存的判断结果；导航目的地差一个字就完全不同，不查近似问题缓存
+    cache_key = make_cache_key('nav', settings.model, prompt, None, query)
+    if not no_cache:
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            print(f'cached answer = {cached}')
+            return SimpleNamespace(answer=cached)
+    messages = [
+        {"role": "system", "content": query_prompt},
+        {"role": "user", "content": query}
+    ]
+    return SimpleNamespace(answer=None, messages=messages, cache_key=cache_key)
+
+# /nav 的导航判断：本地解析、本地意图判断、缓存，最后才请求大模型；返回 JSON 文本
+def decide_nav(settings, query, no_cache, caller):
+    nav = plan_nav(settings, query, no_cache)
+    if nav.answer is not None:
+        return nav.answer
+
+    # 假设client.chat.completions.create是有效的调用代码
+    def ask():
+        response = settings.client.chat.completions.create(
+            model=settings.model,
+            messages=nav.messages
+        )
+        # 假设response.choices[0].message.content返回有效答案
+        return response.choices[0].message.content
+    # 并发的相同导航请求只调用一次大模型（以最高的 nav 优先级占用一个上游名额）
+    check_rate(settings, caller)
+    anwser = INFLIGHT.do(nav.cache_key, lambda: ZHIPUAI_LIMIT.call(caller, ask, settings.admission.priority('/nav', NAV)))
+    print(anwser)
+    if anwser:
+        RESPONSE_CACHE.put(nav.cache_key, anwser)
+    return anwser
+
+# 导航判断的结果是否表示这一轮要导航（无法解析时视为不需要）
+def needs_navigation(nav):
+    try:
+        result = json.loads(nav[nav.index('{'):nav.rindex('}') + 1])
+    except (AttributeError, ValueError):
+        return False
+    return isinstance(result, dict) and str(result.get('NEEDNAV', '')).upper() == 'Y'
+
+# /bot 调用的智能体应用接口
+BOT_URL = 'https://open.bigmodel.cn/api/llm-application/open/v3/application/invoke'
+
+# 构造 /bot 的应用接口请求；与时间相关的问题附带当前时间
+def prepare_bot(settings, query, stream):
+    if "路线" in query or "目前" in query or "现在" in query or "当前" in query or "时间" in query or "几点" in query:
+        query = f"{query}{get_formatted_time()}"
+        print(query)
+    headers_bigmodel = {
+        'Authorization': settings.api_key,
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        "app_id": settings.config["app_id"],
+        "stream": stream,
+        "send_log_event": False,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "value": query,
+                        "type": "input"
+                    }
+                ]
+            }
+        ]
+    }
+    return SimpleNamespace(query=query, headers=headers_bigmodel, payload=payload)
+
+# 从应用接口返回的 JSON 中提取答案，其中答案位于 choices[0].messages.content.msg 字段
+def bot_message(r_json):
+    return r_json.get("choices", [{}])[0].get("messages", {}).get("content", {}).get("msg", "")
+
+# 流式返回的一行 JSON → 回答片段，无法解析时为空串
+def bot_stream_chunk(line):
+    try:
+        return bot_message(json.loads(line.decode("utf-8") if isinstance(line, bytes) else line))
+    except Exception:
+        return ""
+
 @app.route('/bot', methods=['POST'])
 def bot_endpoint():
     """
@@ -118,7 +368,10 @@ def bot_endpoint():
     """
     # 验证请求头中的授权key
     auth_key = request.headers.get('auth-key')
-    if not valid_auth_key(auth_key):
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    banword_matcher = BANWORD_MATCHER.current
+    if not valid_auth_key(auth_key, settings.auth_keys):
         return {'detail': 'Invalid key'}, 401
 
     # 获取请求体中的JSON数据
@@ -128,66 +381,73 @@ def bot_endpoint():
 
     query = data['query']
     stream = data.get('stream', False)
-
-    formatted_time = get_formatted_time()
-    if "路线" in query or "目前" in query or "现在" in query or "当前" in query or "时间" in query or "几点" in query:
-        query = f"{query}{formatted_time}"
-        print(query)
+    # stream_mode：raw（默认）为原始文本，sse 为 SSE 事件，sentence 为逐句的 SSE 事件（TTS 可以逐句合成）
+    stream_mode = data.get('stream_mode', 'raw')
+    if stream_mode not in STREAM_MODES:
+        return {'detail': f"stream_mode must be one of {', '.join(STREAM_MODES)}"}, 400
 
     # 从 config.json 中读取 app_id 配置，确保配置中包含 app_id
-    app_id = config.get("app_id")
-    if not app_id:
+    if not settings.config.get("app_id"):
         return {'detail': 'config中缺少app_id配置'}, 500
+    # clean_output 为 true 时去除回答中的 markdown 格式（数字人朗读用）
+    clean_output = settings.config.get('clean_output', False)
+    bot = prepare_bot(settings, query, stream)
 
     # 检查敏感词
-    if contains_banned_words(query):
-        print("检测到敏感词，直接返回!")
-        return rejection_message
-    # 构造调用大模型接口的请求
-    url = 'https://open.bigmodel.cn/api/llm-application/open/v3/application/invoke'
-    headers_bigmodel = {
-        'Authorization': api_key,
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "app_id": app_id,
-        "stream": stream,
-        "send_log_event": False,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "value": query,
-                        "type": "input"
-                    }
-                ]
-            }
-        ]
-    }
+    banned = contains_banned_words(bot.query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{bot.query[banned.start:banned.end]}」)，直接返回!")
+        return settings.rejection_message
+    caller = bearer_key(auth_key)
 
     try:
+        check_rate(settings, caller)
         if not stream:
-            r = requests.post(url, headers=headers_bigmodel, json=payload)
+            with ZHIPUAI_LIMIT.acquire(caller, settings.admission.priority('/bot', CHAT)):
+                r = HTTP_SESSION.post(BOT_URL, headers=bot.headers, json=bot.payload)
             if r.status_code != 200:
                 return {'detail': r.text}, r.status_code
-            r_json = r.json()
-            # 从返回的 JSON 中提取答案，其中答案位于 choices[0].messages.content.msg 字段
-            answer = r_json.get("choices", [{}])[0].get("messages", {}).get("content", {}).get("msg", "")
+            answer = bot_message(r.json())
+            if clean_output:
+                answer = clean_markdown(answer)
             return answer
         else:
-            # 流式返回
-            r = requests.post(url, headers=headers_bigmodel, json=payload, stream=True)
+            # 流式返回，上游名额占用到流结束
+            slot = ZHIPUAI_LIMIT.acquire(caller, settings.admission.priority('/bot', STREAM))
+            try:
+                r = HTTP_SESSION.post(BOT_URL, headers=bot.headers, json=bot.payload, stream=True)
+            except BaseException:
+                slot.release()
+                raise
+            if r.status_code != 200:
+                detail = r.text
+                r.close()
+                slot.release()
+                return {'detail': detail}, r.status_code
             def generate():
-                for line in r.iter_lines():
-                    if line:
-                        try:
-                            data_line = json.loads(line.decode("utf-8"))
-                            chunk = data_line.get("choices", [{}])[0].get("messages", {}).get("content", {}).get("msg", "")
-                            yield chunk
-                        except Exception:
-                            yield ""
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+                # 读完后连接回到连接池；客户端提前断开时关闭响应，释放连接
+                with UpstreamGuard(r, 'shimenguan /bot') as guard:
+                    for line in iter_stream_lines(r):
+                        if line:
+                            guard.tick()
+                            yield bot_stream_chunk(line)
+            # generate() 还没开始迭代就被关闭时，同样关闭上游响应
+            chunks = slot.hold(ClosingIterator(generate(), r.close))
+            if clean_output:
+                chunks = strip_stream(chunks)
+            # 模型输出同样经过敏感词过滤，命中时截断为拒绝回答的消息；短时间内到达的片段按 stream_mode 合并写出，客户端断开后不再输出
+            chunks = moderate_stream(chunks, banword_matcher, settings.rejection_message)
+            if stream_mode == 'sentence':
+                chunks = framed_writes(sentence_events(chunks))
+            elif stream_mode == 'sse':
+                chunks = event_writes(chunks)
+            else:
+                chunks = text_writes(chunks)
+            body = close_on_disconnect(chunks, request.environ)
+            return Response(closing(stream_with_context(body), body),
+                            content_type='text/event-stream')
+    except Rejected as e:
+        return {'detail': e.detail}, 429, e.headers
     except Exception as e:
         return {'detail': str(e)}, 500
 
@@ -196,7 +456,10 @@ def query_endpoint():
     # 获取请求头中的授权key
     auth_key = request.headers.get('auth-key')
 
-    if not valid_auth_key(auth_key):
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    banword_matcher = BANWORD_MATCHER.current
+    if not valid_auth_key(auth_key, settings.auth_keys):
         return {'detail': 'Invalid key'}, 401
 
     # 获取请求体的JSON数据
@@ -206,66 +469,70 @@ def query_endpoint():
         return {'detail': 'Missing query parameter'}, 400
     
     # 解析请求体中的数据
-    prompt = default_prompt
     query = data.get('query', None)
     stream = data.get('stream', False)
+    # stream_mode：raw（默认）为原始文本，sse 为 SSE 事件，sentence 为逐句的 SSE 事件（TTS 可以逐句合成）
+    stream_mode = data.get('stream_mode', 'raw')
+    if stream_mode not in STREAM_MODES:
+        return {'detail': f"stream_mode must be one of {', '.join(STREAM_MODES)}"}, 400
+    # no_cache 为 true 时跳过缓存查找，直接请求大模型并用新回答刷新缓存
+    no_cache = data.get('no_cache', False)
+    # clean_output 为 true 时去除回答中的 markdown 格式（数字人朗读用）
+    clean_output = settings.config.get('clean_output', False)
     
     print(f'query = {query}')
     print(f'stream = {stream}')
     
     # 检查查询是否包含敏感词
-    if contains_banned_words(query):
-        print("检测到敏感词，直接返回!")
-        return rejection_message
-    
-    # 获取当前时间
-    formatted_time = get_formatted_time()
-    prompt_with_time = f"{prompt}{formatted_time}"
-    if "路线" in query or "目前" in query or "现在" in query or "当前" in query or "时间" in query or "几点" in query:
-        query = f"{query}{formatted_time}"
-        print(query)
-    # 创建消息列表和工具配置
-    messages = [
-        {"role": "system", "content": prompt_with_time},
-        {"role": "user", "content": query}
-    ]
-    tools_list = [
-        {
-            "type": "retrieval",
-            "retrieval": {
-                "knowledge_id": config['knowledge_id'],
-                "prompt_template": ("请优先从景区知识库里\n\"\"\"\n{{knowledge}}\n\"\"\"\n中找问题\n\"\"\"\n{{question}}\n\"\"\"\n的答案，找到答案就参考知识库中语句回答问题，"
-                                            "找不到答案就用自身知识回答。\n不要复述问题，直接开始回答。你只能回答跟景区旅游相关的问题，不要回答其他方面的问题。"
-                )
-            }
-        }
-    ]
+    banned = contains_banned_words(query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{query[banned.start:banned.end]}」)，直接返回!")
+        return settings.rejection_message
     
-    try:
-        def generate():
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                tools=tools_list,
-                stream=True
-            )
-            for chunk in response:
-                print(f'chunk = {chunk.choices[0].delta.content}')
-                yield chunk.choices[0].delta.content
+    chat = prepare_chat(settings, query)
+    # 先查缓存；流式与非流式请求共用同一份缓存
+    cached = lookup_cached_answer(chat.cache_key, chat.query, settings) if chat.cacheable and not no_cache else None
+    caller = bearer_key(auth_key)
 
+    try:
         if not stream:
+            # 常见问题直接返回缓存的回答
+            if cached is not None:
+                answer = as_text(cached)
+                print(f'cached answer = {answer}')
+                return clean_markdown(answer) if clean_output else answer
             # 直接返回第一个生成的响应，而不使用stream。
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                tools=tools_list,
-            )
-            answer = response.choices[0].message.content
+            def ask():
+                response = settings.client.chat.completions.create(
+                    model=settings.model,
+                    messages=chat.messages,
+                    tools=chat.tools,
+                )
+                return response.choices[0].message.content
+            # 并发的相同请求只调用一次大模型（占用一个上游名额），其余请求等待并共享结果
+            check_rate(settings, caller)
+            answer = INFLIGHT.do(chat.cache_key, lambda: ZHIPUAI_LIMIT.call(caller, ask, settings.admission.priority('/', CHAT)))
             print(f'answer = {answer}')
-            return answer
+            if chat.cacheable and answer:
+                remember_answer(chat.cache_key, chat.query, answer, settings)
+            return clean_markdown(answer) if clean_output else answer
         else:
-            # 对于流请求，返回生成器的输出。
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+            chunks = answer_stream(settings, chat, cached, data.get('replay_rate', DEFAULT_REPLAY_RATE), clean_output,
+                                   caller)
+            # 对于流请求，返回生成器的输出（经过敏感词过滤，命中时截断为拒绝回答的消息）；
+            # 短时间内到达的 delta 按 stream_mode 合并成一次写出，客户端断开后不再输出
+            chunks = moderate_stream(chunks, banword_matcher, settings.rejection_message)
+            if stream_mode == 'sentence':
+                chunks = framed_writes(sentence_events(chunks))
+            elif stream_mode == 'sse':
+                chunks = event_writes(chunks)
+            else:
+                chunks = text_writes(chunks)
+            body = close_on_disconnect(chunks, request.environ)
+            return Response(closing(stream_with_context(body), body),
+                            content_type='text/event-stream')
+    except Rejected as e:
+        return {'detail': e.detail}, 429, e.headers
     except Exception as e:
         return {'detail': str(e)}, 500
     
@@ -274,7 +541,10 @@ def query_nav_endpoint():
     # 获取请求头中的授权key
     auth_key = request.headers.get('auth-key')
 
-    if not valid_auth_key(auth_key):
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    banword_matcher = BANWORD_MATCHER.current
+    if not valid_auth_key(auth_key, settings.auth_keys):
         return {'detail': 'Invalid key'}, 401
 
     # 获取请求体的JSON数据
@@ -284,32 +554,101 @@ def query_nav_endpoint():
         return {'detail': 'Missing query parameter'}, 400
     
     # 解析请求体中的数据
-    prompt = nav_prompt
     query = data.get('query', None)
+    # no_cache 为 true 时跳过缓存查找，直接请求大模型并用新回答刷新缓存
+    no_cache = data.get('no_cache', False)
     print(f'query = {query}')
     
     # 检查查询是否包含敏感词
-    if contains_banned_words(query):
-        print("检测到敏感词，直接返回!")
+    banned = contains_banned_words(query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{query[banned.start:banned.end]}」)，直接返回!")
         return '{\"NEEDNAV\":\"N\",\"POI\":\"NONE\"}'
-    
-    print(f'prompt = {prompt}')
 
-    # 假设client.chat.completions.create是有效的调用代码
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": query}
-            ]
-        )
-        # 假设response.choices[0].message.content返回有效答案
-        anwser = response.choices[0].message.content
-        print(anwser)
-        return anwser
+        return decide_nav(settings, query, no_cache, bearer_key(auth_key))
+    except Rejected as e:
+        return {'detail': e.detail}, 429, e.headers
     except Exception as e:
         return {'detail': str(e)}, 500
 
+# 一轮对话：导航判断和回答同时请求，回答以 SSE 流式返回，导航判断一出来就作为 nav 事件发出
+@app.route('/turn', methods=['POST'])
+def turn_endpoint():
+    # 获取请求头中的授权key
+    auth_key = request.headers.get('auth-key')
+
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    banword_matcher = BANWORD_MATCHER.current
+    if not valid_auth_key(auth_key, settings.auth_keys):
+        return {'detail': 'Invalid key'}, 401
+
+    # 获取请求体的JSON数据
+    data = request.get_json()
+    print(data)
+    if not data or 'query' not in data:
+        return {'detail': 'Missing query parameter'}, 400
+
+    query = data.get('query', None)
+    # no_cache 为 true 时跳过缓存查找，直接请求大模型并用新回答刷新缓存
+    no_cache = data.get('no_cache', False)
+    # keep_answer 为 true 时即使需要导航也继续输出回答，否则导航判断为 Y 时取消回答
+    keep_answer = data.get('keep_answer', False)
+    # clean_output 为 true 时去除回答中的 markdown 格式（数字人朗读用）
+    clean_output = settings.config.get('clean_output', False)
+    print(f'query = {query}')
+
+    # 检查查询是否包含敏感词
+    banned = contains_banned_words(query, banword_matcher)
+    if banned:
+        print(f"检测到敏感词「{banned.term}」(原文「{query[banned.start:banned.end]}」)，直接返回!")
+        events = [format_event('{\"NEEDNAV\":\"N\",\"POI\":\"NONE\"}', 'nav'),
+                  format_event(settings.rejection_message, 'answer'),
+                  format_event('{"cancelled": false}', 'done')]
+        return Response(events, content_type='text/event-stream')
+
+    chat = prepare_chat(settings, query)
+    cached = lookup_cached_answer(chat.cache_key, chat.query, settings) if chat.cacheable and not no_cache else None
+
+    caller = bearer_key(auth_key)
+
+    # 未被准入的导航判断或回答作为 error 事件返回
+    def open_answer():
+        chunks = answer_stream(settings, chat, cached, data.get('replay_rate', DEFAULT_REPLAY_RATE), clean_output,
+                               caller)
+        return moderate_stream(chunks, banword_matcher, settings.rejection_message)
+
+    def replaces_answer(nav):
+        return not keep_answer and needs_navigation(nav)
+
+    try:
+        events = TURNS.run(lambda: decide_nav(settings, query, no_cache, caller), open_answer, replaces_answer)
+    except Rejected as e:
+        # 同时进行的轮数已满，不在线程池里排队
+        return {'detail': e.detail}, 429, e.headers
+    body = close_on_disconnect(events, request.environ)
+    return Response(closing(stream_with_context(body), body), content_type='text/event-stream')
+
+@app.route('/stats', methods=['GET'])
+def stats_endpoint():
+    """返回缓存命中率等运行时统计"""
+    auth_key = request.headers.get('auth-key', '')
+    settings = SETTINGS.current
+    if not valid_auth_key(auth_key, settings.auth_keys):
+        return {'detail': 'Invalid key'}, 401
+    return {
+        'response_cache': RESPONSE_CACHE.stats(),
+        'similar_cache': SIMILAR_CACHE.stats(),
+        'inflight': INFLIGHT.stats(),
+        'http_pool': HTTP_SESSION.stats(),
+        'poi_resolver': settings.poi_resolver.stats(),
+        'turn': TURNS.stats(),
+        'cancellations': CANCEL_STATS.stats(),
+        'writes': WRITE_STATS.stats(),
+        'admission': ADMISSION.stats(),
+        'intent_classifier': settings.intent_classifier.stats() if settings.intent_classifier is not None else None,
+    }
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=9000)
\ No newline at end of file
@@ -1,65 +1,80 @@
 from flask import Flask, Response, stream_with_context, request
-from zhipuai import ZhipuAI
 import json
+import os
+import sys
+from types import SimpleNamespace
+
+# 将仓库根目录加入模块搜索路径，以便导入各服务共享的 common 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.admission import ADMISSION, CHAT, STREAM, AdmissionPolicy, Rejected, admit_stream
+from common.auth import bearer_key, valid_auth_key
+from common.banwords import moderate_stream, shared_matcher
+from common.cache import DEFAULT_REPLAY_RATE, ResponseCache, as_text, record_stream, replay_stream
+from common.cancel import CANCEL_STATS, UpstreamGuard, close_on_disconnect, closing
+from common.clients import zhipuai_client
+from common.markdown import clean_markdown, strip_stream
+from common.profiles import ProfileRegistry
+from common.reload import Reloadable, start_watcher
+from common.sentences import sentence_events
+from common.singleflight import SingleFlight
+from common.sse import STREAM_MODES, WRITE_STATS, event_writes, framed_writes, text_writes
 
 app = Flask(__name__)
 
-# 定义全局变量来存储敏感词集合
-BANWORDS = set()
+# 数据文件所在目录，默认为当前工作目录；网关（gateway.py）在同一进程中托管多个服务时为每个服务分别指定
+DATA_DIR = os.environ.get('SHUZIREN_DATA_DIR', '')
+BANWORDS_FILE = os.path.join(DATA_DIR, 'banwords.txt')
+CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
 
 # 程序启动时加载敏感词
-try:
-    with open('banwords.txt', 'r', encoding='utf-8') as file:
-        BANWORDS = {line.strip() for line in file if line.strip()}
-except Exception as e:
-    app.logger.error("Failed to load banned words list: %s", str(e))
-    raise e
+def load_banwords():
+    try:
+        with open(BANWORDS_FILE, 'r', encoding='utf-8') as file:
+            banwords = {line.strip() for line in file if line.strip()}
+    except Exception as e:
+        app.logger.error("Failed to load banned words list: %s", str(e))
+        raise e
+    # 将敏感词编译成 Aho-Corasick 自动机，请求时只需单遍扫描
+    return shared_matcher(banwords)
 
-# 创建一个全局变量来存储配置信息
-configs = None
+# 知识库检索的提示词模板，所有 profile 共用
+RETRIEVAL_PROMPT_TEMPLATE = (
+    "从你的知识库\n\"\"\"\n{{knowledge}}\n\"\"\"\n中找问题\n\"\"\"\n{{question}}\n\"\"\"\n的答案，并参考知识库进行回答，"
+    "不要让用户知道有知识库的存在。知识库里找不到答案，就直接用自身知识回答。\n不要复述问题，直接开始回答。"
+)
 
 def load_configs_from_file():
-    # 全局变量声明，表明我们要修改这个全局变量
-    global configs
-    
-    # 只在程序开始时读取一次配置文件
-    with open('config.json', 'r', encoding='utf-8') as config_file:
+    # 读取所有配置（多套 profile），校验后编译成请求模板并创建对应的客户端，作为一份完整快照返回；
+    # 任何 profile 不合法时抛出 ProfileError，热加载会保留旧的快照
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as config_file:
         configs = json.load(config_file)
-
-def get_config(config_name):
-    # 检查是否存在指定的配置名
-    if config_name in configs:
-        # 如果存在，返回找到的配置
-        return configs[config_name]
-    else:
-        # 如果不存在，返回错误标记，例如使用None表示找不到配置
-        return None
-
-# 在程序启动的时候，加载所有配置到内存中
-load_configs_from_file()
-
-auth_keys = configs['auth_keys']
-api_key = configs['api_key']
-client = ZhipuAI(api_key=api_key)
-
-def valid_auth_key(auth_key):
-    """验证授权key"""
-    if not auth_key.startswith('Bearer '):
-        return False
-    
-    key = auth_key.split(' ')[1]
-    # 假设auth_keys是一个有效的授权keys列表
-    if key in auth_keys:
-        return True
-    else:
-        return False
+    return SimpleNamespace(
+        auth_keys=configs['auth_keys'],
+        # 每个 key 调用大模型的限速，profile 中的 admission 优先
+        admission=AdmissionPolicy(configs.get('admission')),
+        profiles=ProfileRegistry(configs, zhipuai_client, RETRIEVAL_PROMPT_TEMPLATE),
+    )
+
+# 在程序启动的时候加载敏感词和所有配置，文件变化时由后台线程热加载并整体替换
+BANWORD_MATCHER = Reloadable([BANWORDS_FILE], load_banwords)
+SETTINGS = Reloadable([CONFIG_FILE], load_configs_from_file)
+start_watcher(BANWORD_MATCHER, SETTINGS)
+
+# 大模型回答的缓存（LRU + TTL），流式与非流式请求共用，键中包含配置名，不同 profile 互不影响
+RESPONSE_CACHE = ResponseCache()
+# 合并并发的相同上游请求：旅行团同时提问时只调用一次大模型
+INFLIGHT = SingleFlight()
+# 智谱的并发上限和等待队列（网关中与其他服务共用）
+ZHIPUAI_LIMIT = ADMISSION.upstream('zhipuai')
 
 @app.route('/', methods=['POST'])
 def query_endpoint():
     # 获取请求头中的授权key
     auth_key = request.headers.get('auth-key')
 
-    if not valid_auth_key(auth_key):
+    # 整个请求使用同一份配置快照，热加载不会影响进行中的请求
+    settings = SETTINGS.current
+    if not valid_auth_key(auth_key, settings.auth_keys):
         return {'detail': 'Invalid key'}, 401
 
     # 获取请求体的JSON数据
@@ -67,69 +82,126 @@ def query_endpoint():
     if not data or 'query' not in data:
         return {'detail': 'Missing query parameter'}, 400
 
-    # 获取当前有效的配置
+    # 获取当前有效的配置（加载时已编译好的请求模板）
     config_name = data.get('config', 'default')
-    config = get_config(config_name)
+    plan = settings.profiles.get(config_name)
     print(f'config  = {config_name}')
-    if config is None:
+    if plan is None:
         return {'detail': 'Config name not found'}, 404
 
     # 设置模型和查询
-    model = data.get('model', config['model'])
+    model = data.get('model', plan.model)
     query = data['query']
     stream = data.get('stream', False)
+    # stream_mode：raw（默认）为原始文本，sse 为 SSE 事件，sentence 为逐句的 SSE 事件（TTS 可以逐句合成）
+    stream_mode = data.get('stream_mode', 'raw')
+    if stream_mode not in STREAM_MODES:
+        return {'detail': f"stream_mode must be one of {', '.join(STREAM_MODES)}"}, 400
+    # no_cache 为 true 时跳过缓存查找，直接请求大模型并用新回答刷新缓存
+    no_cache = data.get('no_cache', False)
+    # 配置中 clean_output 为 true 时去除回答中的 markdown 格式（数字人朗读用）
+    clean_output = plan.clean_output
     print(f'query = {query}')
     print(f'stream = {stream}')
 
     # 检查查询是否包含敏感词
-    if any(banword in query for banword in BANWORDS):
-        print(f'检测到敏感词')
+    banword_matcher = BANWORD_MATCHER.current
+    banned = banword_matcher.search(query)
+    if banned:
+        print(f'检测到敏感词「{banned.term}」(原文「{query[banned.start:banned.end]}」)')
         return "对不起，我无法回答这个问题。"
 
-    # 创建消息列表和工具配置
-    messages = [
-        {"role": "system", "content": config['default_prompt']},
-        {"role": "user", "content": query}
-    ]
-    tools_list = [
-        {
-            "type": "retrieval",
-            "retrieval": {
-                "knowledge_id": config['knowledge_id'],
-                "prompt_template": (
-                    "从你的知识库\n\"\"\"\n{{knowledge}}\n\"\"\"\n中找问题\n\"\"\"\n{{question}}\n\"\"\"\n的答案，并参考知识库进行回答，"
-                    "不要让用户知道有知识库的存在。知识库里找不到答案，就直接用自身知识回答。\n不要复述问题，直接开始回答。"
-                )
-            }
-        }
-    ]
+    # profile 在加载时已校验并编译好；tools 是共享的只读结构，SDK 发请求前自己会复制成普通字典
+    messages = plan.messages(query)
+    tools = list(plan.tools)
+    client = plan.client
+
+    # 先查缓存；流式与非流式请求共用同一份缓存
+    cache_key = plan.cache_key(query, model)
+    cached = RESPONSE_CACHE.get(cache_key) if not no_cache else None
+    # 调用大模型前按 key 限速；配置了 admission 的 profile 使用独立的令牌桶
+    caller = bearer_key(auth_key)
+    rate_scope = f'shuziren/{plan.name}' if plan.admission is not None else 'shuziren'
+    rate_limit = settings.admission.limit(caller, plan.admission)
 
     try:
         def generate():
             response = client.chat.completions.create(
                 model=model,
                 messages=messages,
-                tools=tools_list,
+                tools=tools,
                 stream=True
             )
-            for chunk in response:
-                yield chunk.choices[0].delta.content
+            # 客户端断开（外层关闭生成器）时立即关闭上游响应，不再读完整个回答
+            with UpstreamGuard(response, f'shuziren / ({plan.name})') as guard:
+                for chunk in response:
+                    guard.tick()
+                    yield chunk.choices[0].delta.content
 
         if not stream:
+            # 常见问题直接返回缓存的回答
+            if cached is not None:
+                answer = as_text(cached)
+                print(f'cached answer = {answer}')
+                return clean_markdown(answer) if clean_output else answer
             # 直接返回第一个生成的响应，而不使用stream。
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                tools=tools_list,
-            )
-            answer = response.choices[0].message.content
+            def ask():
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    tools=tools,
+                )
+                return response.choices[0].message.content
+            # 并发的相同请求只调用一次大模型（占用一个上游名额），其余请求等待并共享结果
+            ADMISSION.check_rate(rate_scope, caller, rate_limit)
+            answer = INFLIGHT.do(cache_key, lambda: ZHIPUAI_LIMIT.call(
+                caller, ask, settings.admission.priority('/', CHAT, plan.admission)))
             print(f'answer = {answer}')
-            return answer
+            if answer:
+                RESPONSE_CACHE.put(cache_key, answer)
+            return clean_markdown(answer) if clean_output else answer
         else:
-            # 对于流请求，返回生成器的输出。
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+            if cached is not None:
+                # 命中缓存时直接重放之前的回答，可按 replay_rate（字符/秒）限速输出
+                print('cached answer, replaying stream')
+                chunks = replay_stream(cached, data.get('replay_rate', DEFAULT_REPLAY_RATE))
+            else:
+                # 并发的相同请求共享同一条上游流（占用一个上游名额，名额已满时先排队）；完整结束的流会被记录进缓存
+                ADMISSION.check_rate(rate_scope, caller, rate_limit)
+                chunks = admit_stream(INFLIGHT, cache_key, ZHIPUAI_LIMIT, caller, generate,
+                                      settings.admission.priority('/', STREAM, plan.admission))
+                chunks = record_stream(chunks, lambda recorded: RESPONSE_CACHE.put(cache_key, recorded))
+            # 缓存中保存原始回答，去除 markdown 格式只作用于本次输出
+            if clean_output:
+                chunks = strip_stream(chunks)
+            # 对于流请求，返回生成器的输出（经过敏感词过滤，命中时截断为拒绝回答的消息）。
+            # 客户端断开后不再输出，并关闭上游流
+            chunks = moderate_stream(chunks, banword_matcher, "对不起，我无法回答这个问题。")
+            # 短时间内到达的 delta 合并成一次写出；SSE 流空闲时发送心跳
+            if stream_mode == 'sentence':
+                chunks = framed_writes(sentence_events(chunks))
+            elif stream_mode == 'sse':
+                chunks = event_writes(chunks)
+            else:
+                chunks = text_writes(chunks)
+            body = close_on_disconnect(chunks, request.environ)
+            return Response(closing(stream_with_context(body), body),
+                            content_type='text/event-stream')
+    except Rejected as e:
+        return {'detail': e.detail}, 429, e.headers
     except Exception as e:
         return {'detail': str(e)}, 500
 
+@app.route('/stats', methods=['GET'])
+def stats_endpoint():
+    """返回缓存命中率等运行时统计"""
+    auth_key = request.headers.get('auth-key', '')
+    if not valid_auth_key(auth_key, SETTINGS.current.auth_keys):
+        return {'detail': 'Invalid key'}, 401
+    profiles = SETTINGS.current.profiles
+    return {'response_cache': RESPONSE_CACHE.stats(), 'inflight': INFLIGHT.stats(), 'cancellations': CANCEL_STATS.stats(),
+            'writes': WRITE_STATS.stats(), 'admission': ADMISSION.stats(),
+            'profiles': {'names': profiles.names(), 'clients': profiles.client_count}}
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=9000)
\ No newline at end of file
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# 测试从仓库根目录导入 common 及各服务的包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import types
+
+import pytest
+from flask import Flask, Response, stream_with_context
+
+from common import admission
+from common.admission import (CHAT, NAV, STREAM, AdmissionError, AdmissionPolicy, RateLimit, Rejected, TokenBuckets,
+                              UpstreamLimit, admit_stream)
+from common.banwords import BanwordMatcher, moderate_stream
+from common.cache import record_stream
+from common.cancel import close_on_disconnect, closing
+from common.markdown import strip_stream
+from common.singleflight import SingleFlight
+from common.sse import text_writes
+
+
+class Upstream:
+    """记录是否被关闭的上游流。"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def open_response(app, inflight, limit, upstream, key='问题'):
+    """与服务中的流式接口相同的包装链，返回 Flask Response。"""
+    chunks = admit_stream(inflight, key, limit, 'kiosk', lambda: upstream)
+    chunks = record_stream(strip_stream(chunks), lambda text: None)
+    chunks = text_writes(moderate_stream(chunks, BanwordMatcher(['违禁词']), '拒绝回答'))
+    body = close_on_disconnect(chunks, {})
+    return Response(closing(stream_with_context(body), body), content_type='text/event-stream')
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def test_response_closed_before_iteration_releases_everything(app):
+    limit = UpstreamLimit('test', max_concurrent=1)
+    inflight = SingleFlight()
+    upstream = Upstream(['你', '好'])
+    with app.test_request_context('/'):
+        response = open_response(app, inflight, limit, upstream)
+    assert limit.active == 1
+    assert inflight.streaming('问题')
+    # 客户端在第一个片段之前断开，WSGI 服务器直接关闭 Response
+    response.close()
+    assert limit.active == 0
+    assert not inflight.streaming('问题')
+    assert upstream.closed
+
+
+def test_follower_closed_before_iteration_keeps_the_shared_stream(app):
+    limit = UpstreamLimit('test', max_concurrent=1)
+    inflight = SingleFlight()
+    upstream = Upstream(['你', '好'])
+    with app.test_request_context('/'):
+        leader = open_response(app, inflight, limit, upstream)
+        follower = open_response(app, inflight, limit, Upstream([]))
+    follower.close()
+    assert inflight.streaming('问题')
+    assert not upstream.closed
+    with app.test_request_context('/'):
+        assert ''.join(chunk for chunk in leader.response) == '你好'
+    leader.close()
+    assert limit.active == 0
+    assert not inflight.streaming('问题')
+
+
+def test_response_closed_while_iterating_releases_everything(app):
+    limit = UpstreamLimit('test', max_concurrent=1)
+    inflight = SingleFlight()
+    upstream = Upstream(['你'] * 10)
+    with app.test_request_context('/'):
+        response = open_response(app, inflight, limit, upstream)
+        assert next(iter(response.response))
+    response.close()
+    assert limit.active == 0
+    assert not inflight.streaming('问题')
+    assert upstream.closed
+
+
+class Queue:
+    """在 limit 上排队的请求：每个请求得到名额后记下自己的名字并立即归还，记录的顺序就是得到名额的顺序。"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.order = []
+        self.threads = []
+
+    def add(self, name, client, priority):
+        expected = self.limit.queued + 1
+
+        def run():
+            with self.limit.acquire(client, priority):
+                self.order.append(name)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        deadline = time.monotonic() + 5
+        while self.limit.queued < expected and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(5)
+        return self.order
+
+
+def test_higher_priority_goes_first():
+    limit = UpstreamLimit('test', max_concurrent=1, reserved=0, aging=0)
+    busy = limit.acquire('a', STREAM)
+    queue = Queue(limit)
+    queue.add('stream', 'a', STREAM)
+    queue.add('chat', 'b', CHAT)
+    queue.add('nav', 'c', NAV)
+    busy.release()
+    assert queue.join() == ['nav', 'chat', 'stream']
+    assert limit.active == 0
+
+
+def test_clients_take_turns_within_a_priority():
+    limit = UpstreamLimit('test', max_concurrent=1, reserved=0, aging=0)
+    busy = limit.acquire('flood')
+    queue = Queue(limit)
+    for i in range(3):
+        queue.add(f'flood{i}', 'flood', CHAT)
+    queue.add('kiosk0', 'kiosk', CHAT)
+    queue.add('kiosk1', 'kiosk', CHAT)
+    busy.release()
+    assert queue.join() == ['flood0', 'kiosk0', 'flood1', 'kiosk1', 'flood2']
+
+
+def test_reserved_slots_are_only_for_nav():
+    limit = UpstreamLimit('test', max_concurrent=2, reserved=1, max_wait=0.01)
+    stream = limit.acquire('a', STREAM)
+    with pytest.raises(Rejected) as e:
+        limit.acquire('b', CHAT)
+    assert e.value.reason == 'queue_timeout'
+    nav = limit.acquire('c', NAV)
+    assert limit.active == 2
+    nav.release()
+    stream.release()
+    # 并发上限为 1 时不预留，否则其他调用永远得不到名额
+    assert UpstreamLimit('test', max_concurrent=1, reserved=2).reserved == 0
+
+
+def test_aging_lets_a_waiting_stream_overtake_new_navs(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(admission, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    limit = UpstreamLimit('test', max_concurrent=1, reserved=0, aging=2)
+    busy = limit.acquire('a', STREAM)
+    queue = Queue(limit)
+    queue.add('stream', 'a', STREAM)
+    # 等待不到 2 个 aging 时仍然比 nav 低
+    clock.now = 3.9
+    queue.add('nav0', 'b', NAV)
+    queue.add('chat', 'c', CHAT)
+    busy.release()
+    # stream 已提升一级，与 chat 同级时原来的优先级高的先得到名额
+    assert queue.join() == ['nav0', 'chat', 'stream']
+    assert limit.stats()['priorities']['chat']['aged'] == 0
+
+    busy = limit.acquire('a', STREAM)
+    queue = Queue(limit)
+    queue.add('stream', 'a', STREAM)
+    clock.now += 6
+    queue.add('nav1', 'b', NAV)
+    busy.release()
+    # 等待 3 个 aging 后 stream 排到新的 nav 前面
+    assert queue.join() == ['stream', 'nav1']
+    assert limit.stats()['priorities']['stream']['aged'] == 1
+
+
+def test_full_queue_rejects():
+    limit = UpstreamLimit('test', max_concurrent=1, queue_size=1, reserved=0)
+    busy = limit.acquire('a')
+    queue = Queue(limit)
+    queue.add('b', 'b', CHAT)
+    with pytest.raises(Rejected) as e:
+        limit.acquire('c')
+    assert e.value.reason == 'queue_full'
+    assert int(e.value.headers['Retry-After']) >= 1
+    busy.release()
+    assert queue.join() == ['b']
+    assert limit.stats()['rejected_queue_full'] == 1
+
+
+def test_token_buckets():
+    clock = types.SimpleNamespace(now=0.0)
+    buckets = TokenBuckets(clock=lambda: clock.now)
+    limit = RateLimit(0.5, 2)
+    buckets.take('shimenguan', 'kiosk', limit)
+    buckets.take('shimenguan', 'kiosk', limit)
+    with pytest.raises(Rejected) as e:
+        buckets.take('shimenguan', 'kiosk', limit)
+    assert e.value.retry_after == 2
+    # 其他 key 和其他范围有自己的桶
+    buckets.take('shimenguan', 'other', limit)
+    buckets.take('coze', 'kiosk', limit)
+    clock.now = 2
+    buckets.take('shimenguan', 'kiosk', limit)
+    buckets.take('shimenguan', 'kiosk', None)
+
+
+def test_policy():
+    policy = AdmissionPolicy({'rate': 1, 'keys': {'fast': {'rate': 5, 'burst': 10}, 'free': {'rate': 0}},
+                              'priorities': {'/bot': 'stream'}})
+    profile = AdmissionPolicy({'keys': {'fast': {'rate': 2}}})
+    assert policy.limit('slow') == RateLimit(1.0, 1)
+    assert policy.limit('fast') == RateLimit(5.0, 10)
+    assert policy.limit('fast', profile) == RateLimit(2.0, 2)
+    assert policy.limit('free') is None
+    assert policy.priority('/bot', CHAT) == STREAM
+    assert policy.priority('/', CHAT) == CHAT
+    with pytest.raises(AdmissionError):
+        AdmissionPolicy({'priorities': {'/': 'urgent'}})
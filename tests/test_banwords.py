@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from common.banwords import BanwordMatch, BanwordMatcher, BanwordStreamFilter, moderate_stream, shared_matcher
+
+WORDS = ['违禁词', '赌博', 'abc', 'bcd']
+
+
+@pytest.fixture
+def matcher():
+    return BanwordMatcher(WORDS)
+
+
+def run(matcher, chunks):
+    """逐个 chunk 喂给过滤器，返回 (放行的文本, 命中结果)。"""
+    stream_filter = BanwordStreamFilter(matcher)
+    text = ''.join(stream_filter.feed(chunk) for chunk in chunks)
+    return text + stream_filter.flush(), stream_filter.match
+
+
+def test_search(matcher):
+    assert matcher.search('这里有违禁词吗') == BanwordMatch('违禁词', 3, 6)
+    assert matcher.search('这里没有') is None
+    assert matcher.search(None) is None
+    assert '网上赌博' in matcher
+    assert len(matcher) == 4
+
+
+def test_search_normalizes(matcher):
+    # 全角、大小写和分隔符都折叠后再匹配，位置对应原文
+    assert matcher.search('说 ＡＢ-Ｃ 了') == BanwordMatch('abc', 2, 6)
+    assert BanwordMatcher(['abc'], normalize=False).search('ABC') is None
+
+
+@pytest.mark.parametrize('chunks', [
+    ['这是违', '禁词'],
+    ['这是违禁', '词，后面'],
+    ['这是', '违', '禁', '词'],
+    ['这是违禁词'],
+])
+def test_match_across_chunks(matcher, chunks):
+    text, match = run(matcher, chunks)
+    assert match == BanwordMatch('违禁词', 2, 5)
+    # 命中之前放行的只有敏感词前面的文字（与敏感词同一个 chunk 的不再放行）
+    assert '这是'.startswith(text)
+
+
+def test_only_a_possible_prefix_is_held_back(matcher):
+    stream_filter = BanwordStreamFilter(matcher)
+    assert stream_filter.feed('你好违') == '你好'
+    assert stream_filter.feed('反规定') == '违反规定'
+    assert stream_filter.flush() == ''
+    assert stream_filter.match is None
+
+
+def test_overlapping_words(matcher):
+    # "ab" 之后的 "c" 不构成 abc 时要沿失败指针找到 bcd
+    text, match = run(matcher, ['xab', 'cd'])
+    assert match == BanwordMatch('abc', 1, 4)
+    text, match = run(matcher, ['xa', 'bd', 'bc', 'd'])
+    assert match == BanwordMatch('bcd', 4, 7)
+    assert text == 'xabd'
+
+
+def test_unfinished_prefix_is_released_on_flush(matcher):
+    assert run(matcher, ['结尾是违禁']) == ('结尾是违禁', None)
+
+
+def test_stream_matches_whole_text_search(matcher):
+    rng = random.Random(0)
+    alphabet = '违禁词赌博abcdx好 '
+    for _ in range(2000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 4)))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        released, match = run(matcher, chunks)
+        expected = matcher.search(text)
+        assert match == expected
+        assert released == (text if expected is None else text[:len(released)])
+        if expected is not None:
+            assert len(released) <= expected.start
+
+
+def test_moderate_stream(matcher):
+    assert ''.join(moderate_stream(iter(['你好', None, '世界']), matcher, '拒绝')) == '你好世界'
+    assert list(moderate_stream(iter(['你好违', '禁词', '后面']), matcher, '拒绝')) == ['你好', '拒绝']
+
+
+def test_shared_matcher_is_reused():
+    first = shared_matcher(['甲', ' 乙 '])
+    assert shared_matcher(['乙', '甲']) is first
+    assert shared_matcher(['甲']) is not first
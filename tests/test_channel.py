@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+from common.admission import Rejected
+from common.channel import CLOSE_UNAUTHORIZED, RequestError, serve_channel
+
+
+class FakeWebSocket:
+    """starlette WebSocket 的替身：客户端消息放进 incoming，服务端消息记录在 sent。"""
+
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.close_code is not None:
+            raise RuntimeError('closed')
+        await self.sent.put(json.loads(text))
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+    def client_send(self, message):
+        self.incoming.put_nowait({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    def disconnect(self):
+        self.incoming.put_nowait({'type': 'websocket.disconnect'})
+
+    async def next(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+
+class Upstream:
+    """记录是否被关闭的流式回答；gate 打开之前停在第一个片段之后。"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.gate = asyncio.Event()
+        self.closed = False
+
+    def __aiter__(self):
+        return self._generate()
+
+    async def _generate(self):
+        try:
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    await self.gate.wait()
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def run(test, headers=None, keys=('kiosk',), **kwargs):
+    async def main():
+        websocket = FakeWebSocket(headers)
+        state = {}
+        upstream = Upstream(['你', '好'])
+
+        async def answer(data, auth_key):
+            if data.get('stream'):
+                state['upstream'] = upstream
+                return upstream.__aiter__()
+            if data.get('query') == 'busy':
+                raise Rejected('rate_limited', 'Rate limit exceeded', 3)
+            if not data.get('query'):
+                raise RequestError('Missing query parameter', 400)
+            return f"回答：{data['query']}"
+
+        handlers = {'/': answer}
+        server = asyncio.ensure_future(serve_channel(websocket, handlers, lambda: keys, **kwargs))
+        try:
+            await test(websocket, upstream)
+        finally:
+            websocket.disconnect()
+            await asyncio.wait_for(server, 5)
+        return upstream
+
+    return asyncio.run(main())
+
+
+def test_auth_message_and_requests():
+    async def test(ws, upstream):
+        ws.client_send({'type': 'auth', 'auth_key': 'Bearer kiosk'})
+        assert await ws.next() == {'type': 'ready'}
+        ws.client_send({'id': 1, 'path': '/', 'query': '门票'})
+        assert await ws.next() == {'id': 1, 'type': 'result', 'data': '回答：门票'}
+        ws.client_send({'id': 2, 'path': '/'})
+        assert await ws.next() == {'id': 2, 'type': 'error', 'status': 400, 'detail': 'Missing query parameter'}
+        ws.client_send({'id': 3, 'path': '/', 'query': 'busy'})
+        assert await ws.next() == {'id': 3, 'type': 'error', 'status': 429, 'detail': 'Rate limit exceeded',
+                                   'retry_after': 3}
+        ws.client_send({'id': 4, 'path': '/missing'})
+        assert (await ws.next())['status'] == 404
+
+    run(test)
+
+
+def test_stream_deltas_and_end():
+    async def test(ws, upstream):
+        assert await ws.next() == {'type': 'ready'}
+        upstream.gate.set()
+        ws.client_send({'id': 'a', 'path': '/', 'query': '门票', 'stream': True})
+        assert await ws.next() == {'id': 'a', 'type': 'delta', 'data': '你'}
+        assert await ws.next() == {'id': 'a', 'type': 'delta', 'data': '好'}
+        assert await ws.next() == {'id': 'a', 'type': 'end'}
+
+    assert run(test, headers={'auth-key': 'Bearer kiosk'}).closed
+
+
+def test_cancel_closes_the_upstream():
+    async def test(ws, upstream):
+        assert await ws.next() == {'type': 'ready'}
+        ws.client_send({'id': 'a', 'path': '/', 'query': '门票', 'stream': True})
+        assert await ws.next() == {'id': 'a', 'type': 'delta', 'data': '你'}
+        ws.client_send({'type': 'cancel', 'id': 'a'})
+        assert await ws.next() == {'id': 'a', 'type': 'end', 'cancelled': True}
+        assert upstream.closed
+        # 取消之后同一个 ID 可以再次使用
+        ws.client_send({'id': 'a', 'path': '/', 'query': '门票'})
+        assert await ws.next() == {'id': 'a', 'type': 'result', 'data': '回答：门票'}
+
+    run(test, headers={'auth-key': 'Bearer kiosk'})
+
+
+def test_disconnect_closes_the_upstream():
+    async def test(ws, upstream):
+        assert await ws.next() == {'type': 'ready'}
+        ws.client_send({'id': 'a', 'path': '/', 'query': '门票', 'stream': True})
+        assert await ws.next() == {'id': 'a', 'type': 'delta', 'data': '你'}
+        assert not upstream.closed
+
+    # run 在测试结束后断开连接，并等待 serve_channel 返回
+    assert run(test, headers={'auth-key': 'Bearer kiosk'}).closed
+
+
+def test_max_inflight():
+    async def test(ws, upstream):
+        assert await ws.next() == {'type': 'ready'}
+        ws.client_send({'id': 'a', 'path': '/', 'query': '门票', 'stream': True})
+        assert (await ws.next())['type'] == 'delta'
+        ws.client_send({'id': 'a', 'path': '/', 'query': '门票'})
+        assert await ws.next() == {'id': 'a', 'type': 'error', 'status': 400, 'detail': 'Duplicate request id'}
+        ws.client_send({'id': 'b', 'path': '/', 'query': '门票'})
+        assert await ws.next() == {'id': 'b', 'type': 'error', 'status': 429, 'detail': 'Too many requests in flight'}
+
+    run(test, headers={'auth-key': 'Bearer kiosk'}, max_inflight=1)
+
+
+def test_invalid_key_closes_the_connection():
+    async def test(ws, upstream):
+        await asyncio.sleep(0.05)
+        assert ws.close_code == CLOSE_UNAUTHORIZED
+        assert ws.sent.empty()
+
+    run(test, headers={'auth-key': 'Bearer stranger'})
+
+
+def test_auth_timeout():
+    async def test(ws, upstream):
+        await asyncio.sleep(0.1)
+        assert ws.close_code == CLOSE_UNAUTHORIZED
+
+    run(test, auth_timeout=0.01)
+
+
+def test_revoked_key_closes_the_connection():
+    keys = {'kiosk'}
+
+    async def test(ws, upstream):
+        assert await ws.next() == {'type': 'ready'}
+        keys.clear()
+        ws.client_send({'id': 1, 'path': '/', 'query': '门票'})
+        assert await ws.next() == {'id': 1, 'type': 'error', 'status': 401, 'detail': 'Invalid key'}
+        await asyncio.sleep(0.01)
+        assert ws.close_code == CLOSE_UNAUTHORIZED
+
+    run(test, headers={'auth-key': 'Bearer kiosk'}, keys=keys)
+
+
+def test_invalid_messages():
+    async def test(ws, upstream):
+        assert await ws.next() == {'type': 'ready'}
+        ws.incoming.put_nowait({'type': 'websocket.receive', 'text': '{'})
+        assert await ws.next() == {'type': 'error', 'status': 400, 'detail': 'Invalid message'}
+        ws.client_send({'path': '/'})
+        assert await ws.next() == {'type': 'error', 'status': 400, 'detail': 'Missing request id'}
+
+    run(test, headers={'auth-key': 'Bearer kiosk'})
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+import types
+
+import httpx
+import pytest
+from cozepy import ChatEventType, MessageRole, MessageType
+
+from common.coze_chat import ChatFailed, answer_via_stream
+
+
+def answer(event, content):
+    message = types.SimpleNamespace(role=MessageRole.ASSISTANT, type=MessageType.ANSWER, content=content)
+    return types.SimpleNamespace(event=event, message=message, chat=None)
+
+
+def completed(content):
+    return answer(ChatEventType.CONVERSATION_MESSAGE_COMPLETED, content)
+
+
+def delta(content):
+    return answer(ChatEventType.CONVERSATION_MESSAGE_DELTA, content)
+
+
+CHAT_COMPLETED = types.SimpleNamespace(event=ChatEventType.CONVERSATION_CHAT_COMPLETED, message=None, chat=None)
+# 不含回答的其他事件
+PING = types.SimpleNamespace(event='ping', message=None, chat=None)
+
+
+class Response:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Stream:
+    """cozepy Stream 的替身：依次产出 events，其中的异常被抛出。"""
+
+    def __init__(self, events):
+        self._events = events
+        self._raw_response = Response()
+        self.read = 0
+
+    def __iter__(self):
+        for event in self._events:
+            self.read += 1
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+
+class Client:
+    def __init__(self, stream):
+        self.chat = types.SimpleNamespace(stream=lambda **kwargs: stream)
+
+
+def test_answers_are_joined_until_the_chat_completes():
+    stream = Stream([delta('你'), completed('你好'), completed('，欢迎'), CHAT_COMPLETED, completed('后面的')])
+    assert answer_via_stream(Client(stream), 'bot', 'user', []) == '你好，欢迎'
+    assert stream.read == 4
+    assert stream._raw_response.closed
+
+
+def test_deltas_are_used_without_completed_answers():
+    assert answer_via_stream(Client(Stream([delta('你'), delta('好')])), 'bot', 'user', []) == '你好'
+
+
+def test_error_before_the_first_event_is_raised():
+    with pytest.raises(ConnectionError):
+        answer_via_stream(Client(Stream([ConnectionError('reset')])), 'bot', 'user', [])
+
+
+def test_error_after_events_returns_what_was_received():
+    stream = Stream([completed('你好'), ConnectionError('reset')])
+    assert answer_via_stream(Client(stream), 'bot', 'user', []) == '你好'
+    with pytest.raises(ChatFailed) as e:
+        answer_via_stream(Client(Stream([PING, ConnectionError('reset')])), 'bot', 'user', [])
+    assert e.value.status == 502
+
+
+@pytest.fixture
+def stalled_response():
+    """真实的 httpx 流式响应：服务端发出一个事件后不再发送数据。"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    release = threading.Event()
+
+    def serve():
+        conn, _ = server.accept()
+        conn.recv(4096)
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n'
+                     b'6\r\nping\n\n\r\n')
+        release.wait(10)
+        conn.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    client = httpx.Client(timeout=600)
+    response = client.send(client.build_request('GET', f'http://127.0.0.1:{server.getsockname()[1]}/'), stream=True)
+    yield response
+    release.set()
+    thread.join(5)
+    client.close()
+    server.close()
+
+
+def test_stalled_stream_times_out_at_max_wait(stalled_response):
+    class StalledStream(Stream):
+        def __iter__(self):
+            for line in self._raw_response.iter_lines():
+                if line:
+                    yield PING
+
+    stream = StalledStream([])
+    stream._raw_response = stalled_response
+    start = time.monotonic()
+    with pytest.raises(ChatFailed) as e:
+        answer_via_stream(Client(stream), 'bot', 'user', [], max_wait=0.2)
+    assert e.value.status == 504
+    # 不等 SDK 的读超时，到达 max_wait 后立即返回
+    assert time.monotonic() - start < 2
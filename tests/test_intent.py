@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from common.intent import IntentClassifier, IntentModel
+from common.poi import PoiResolver
+
+NAV = ['带我去游客中心', '厕所在哪里', '餐厅怎么走', '我要去停车场', '想上厕所', '最近的洗手间', '我饿了想吃饭',
+       '想上洗手间', '饿了有吃的吗']
+CHAT = ['门票多少钱', '景区几点开门', '讲个笑话', '你好', '谢谢你', '学生票有优惠吗', '今天天气怎么样', '给我讲个故事',
+        '老人免票吗', '石门关有什么历史']
+
+
+@pytest.fixture(scope='module')
+def model():
+    return IntentModel.train([(query, True) for query in NAV] + [(query, False) for query in CHAT])
+
+
+@pytest.fixture
+def classifier(model):
+    return IntentClassifier(model, PoiResolver({'观音阁': '观音阁', '游客中心': '游客中心'}))
+
+
+def test_trained_model_separates_the_examples(model):
+    for query in NAV:
+        assert model.probability(query) > 0.5
+    for query in CHAT:
+        assert model.probability(query) < 0.5
+
+
+@pytest.mark.parametrize('query', ['门票多少钱', '讲个故事吧', '学生票多少钱'])
+def test_obvious_chat_stays_local(classifier, query):
+    assert classifier.escalation_reason(query) is None
+    assert classifier.is_chat(query)
+
+
+@pytest.mark.parametrize('query', ['门票在哪买', '附近有什么好玩的', '带我看看', '东门怎么走'])
+def test_nav_hints_always_escalate(classifier, query):
+    assert classifier.escalation_reason(query) == 'rule'
+
+
+def test_poi_mentions_always_escalate(classifier):
+    # 没有导航说法，但字面提到了 POI
+    assert classifier.escalation_reason('观音阁有什么故事') == 'rule'
+
+
+def test_model_escalates_uncertain_queries(classifier):
+    assert classifier.escalation_reason('想上洗手间') == 'model'
+    assert classifier.escalation_reason(None) == 'rule'
+
+
+def test_untrained_model_escalates_everything():
+    # 没有权重时概率为 0.5，高于阈值
+    assert IntentClassifier(IntentModel()).escalation_reason('门票多少钱') == 'model'
+
+
+def test_stats(classifier):
+    classifier.is_chat('门票多少钱')
+    classifier.is_chat('带我去观音阁')
+    stats = classifier.stats()
+    assert (stats['local'], stats['escalated_by_rule'], stats['escalated_by_model']) == (1, 1, 0)
+    assert stats['local_rate'] == 0.5
+
+
+def test_save_load_round_trip(model, tmp_path):
+    path = tmp_path / 'intent_model.json'
+    model.save(path)
+    loaded = IntentModel.load(path)
+    assert loaded.weights == model.weights
+    assert loaded.bias == model.bias
+    for query in NAV + CHAT:
+        assert loaded.probability(query) == model.probability(query)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import sys
+
+import pytest
+
+from common.markdown import MAX_LINK_HOLD, MarkdownStripper, clean_markdown
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_markdown import EDGE_CASES, PATHOLOGICAL, SAMPLES, legacy_clean_markdown, split_deltas
+
+# 模糊测试使用的字符：各种格式符号、空白和普通文字
+FUZZ_ALPHABET = list('#*_~`[]()!>-+|.1 \n\t\r') + ['字', '文', 'a', '2', '　', '３']
+
+
+def stream(text, rng):
+    stripper = MarkdownStripper()
+    return ''.join(stripper.feed(chunk) for chunk in split_deltas(text, rng)) + stripper.flush()
+
+
+@pytest.mark.parametrize('text', SAMPLES + EDGE_CASES + list(PATHOLOGICAL.values()))
+def test_golden_corpus_matches_regex_chain(text):
+    expected = legacy_clean_markdown(text)
+    assert clean_markdown(text) == expected
+    assert stream(text, random.Random(0)) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('`1`. 第一步', '第一步'),
+    ('*# 不是标题', '# 不是标题'),
+    ('-\n > 引用', '> 引用'),
+    ('> ` + 列表', '列表'),
+    ('[> 链接](http://x)', '链接'),
+    ('[!](x)[](y)', ''),
+    ('[a```](y)```b](z)', 'ab'),
+    ('---', '--'),
+    ('- ---\n正文', '正文'),
+])
+def test_rules_apply_in_regex_chain_order(text, expected):
+    assert legacy_clean_markdown(text) == expected
+    assert clean_markdown(text) == expected
+
+
+@pytest.mark.parametrize('seed, max_length', [(1, 12), (2, 40)])
+def test_fuzz_matches_regex_chain(seed, max_length):
+    rng = random.Random(seed)
+    for _ in range(3000):
+        text = ''.join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(1, max_length)))
+        expected = legacy_clean_markdown(text)
+        assert clean_markdown(text) == expected, text
+        assert stream(text, rng) == expected, text
+
+
+def test_bold_split_across_chunks():
+    stripper = MarkdownStripper()
+    assert stripper.feed('开放时间是**早上') == '开放时间是早上'
+    assert stripper.feed('8:00**。') == '8:00。'
+    assert stripper.flush() == ''
+
+
+def test_unclosed_link_is_released_after_hold_limit():
+    stripper = MarkdownStripper()
+    assert stripper.feed('[') == ''
+    assert stripper.feed('字' * MAX_LINK_HOLD) == '[' + '字' * MAX_LINK_HOLD
+
+
+def test_non_string_is_returned_unchanged():
+    assert clean_markdown(None) is None
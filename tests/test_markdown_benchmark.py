@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""clean_markdown 的 pytest-benchmark 基准（未安装 pytest-benchmark 时跳过），与 benchmarks/bench_markdown.py 的输入相同。"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from common.markdown import clean_markdown
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_markdown import LONG, PATHOLOGICAL, SHORT
+
+CASES = {'short': SHORT, 'long': LONG, **PATHOLOGICAL}
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_clean_markdown(benchmark, name):
+    benchmark(clean_markdown, CASES[name])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from common import poi
+from common.poi import PoiIndex, PoiMatch, PoiResolver
+
+MAPPING = {
+    '游客中心': '游客中心',
+    '服务中心': '游客中心',
+    '一号停车场': '一号停车场',
+    '二号停车场': '二号停车场',
+    '东广场': '东广场',
+    '观音阁': '观音阁',
+    '东门': '东门',
+    '东大门': '东门',
+    '卫生间': '卫生间',
+    '厕所': '卫生间',
+}
+
+
+@pytest.fixture
+def resolver():
+    return PoiResolver(MAPPING)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('带我去游客中心', '游客中心'),
+    ('请问服务中心在哪里', '游客中心'),
+    ('东大门怎么走', '东门'),
+    ('我想去厕所', '卫生间'),
+    ('带我去二号停车场', '二号停车场'),
+])
+def test_exact(resolver, query, expected):
+    assert resolver.resolve(query) == PoiMatch(expected, 'exact')
+
+
+@pytest.mark.parametrize('query', [
+    '游客中心开门了吗',  # 没有导航意图词
+    '先去东门再去厕所',  # 多个 POI
+    '不想去观音阁',  # 剩下无法识别的字
+    '带我去吃饭',
+    None,
+])
+def test_deferred(resolver, query):
+    assert resolver.resolve(query) is None
+
+
+def test_edit_fallback(resolver, monkeypatch):
+    monkeypatch.setattr(resolver, '_pinyin_trie', None)
+    assert resolver.resolve('带我去观音阁楼') is None  # 字面命中 POI 时不纠正剩下的字
+    assert resolver.resolve('带我去观音各') == PoiMatch('观音阁', 'edit')
+    assert resolver.resolve('带我去游客中兴') == PoiMatch('游客中心', 'edit')
+
+
+@pytest.mark.parametrize('query', [
+    '带我去三号停车场',
+    '带我去3号停车场',
+    '带我去号停车场',
+    '带我去西广场',
+    '带我去南广场',
+    '带我去广场',
+])
+def test_edit_fallback_keeps_numbers_and_directions(resolver, monkeypatch, query):
+    monkeypatch.setattr(resolver, '_pinyin_trie', None)
+    assert resolver.resolve(query) is None
+
+
+@pytest.mark.skipif(poi.lazy_pinyin is None, reason='pypinyin 未安装')
+def test_pinyin(resolver):
+    assert resolver.resolve('带我去游克中心') == PoiMatch('游客中心', 'pinyin')
+
+
+def test_stats(resolver):
+    resolver.resolve('带我去游客中心')
+    resolver.resolve('游客中心开门了吗')
+    stats = resolver.stats()
+    assert stats['aliases'] == len(MAPPING)
+    assert stats['exact'] == 1 and stats['deferred'] == 1
+    assert stats['resolve_rate'] == 0.5
+
+
+def test_mentions(resolver):
+    assert resolver.mentions('东大门离厕所远吗') == {'东门', '卫生间'}
+    assert resolver.mentions(None) == set()
+
+
+def test_index_top():
+    index = PoiIndex(['游客中心', '东门', '卫生间'], MAPPING, {'卫生间': ['厕所']})
+    assert index.top('厕所在哪', 1) == ['卫生间']
+    assert index.top('东大门', 2)[0] == '东门'
+    assert index.top('天气', 3) == []
+    assert sorted(index.aliases('东门')) == ['东大门']
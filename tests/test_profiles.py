@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from common.cache import make_cache_key
+from common.profiles import ProfileError, ProfileRegistry
+
+CONFIG = {
+    'api_key': 'key',
+    'auth_keys': ['kiosk'],
+    'admission': {'rate': 1},
+    'guide': {'model': 'glm-4', 'default_prompt': '你是讲解员', 'knowledge_id': 'kb1'},
+    'child': {'model': 'glm-4', 'default_prompt': '你是儿童讲解员', 'knowledge_id': 'kb2', 'api_key': 'other'},
+}
+
+
+@pytest.fixture
+def registry():
+    return ProfileRegistry(CONFIG, lambda api_key: f'client:{api_key}', '模板')
+
+
+def test_plans(registry):
+    assert sorted(registry.names()) == ['child', 'guide']
+    assert registry.client_count == 2
+    plan = registry.get('guide')
+    assert plan.client == 'client:key'
+    assert plan.messages('门票') == [{'role': 'system', 'content': '你是讲解员'}, {'role': 'user', 'content': '门票'}]
+    assert list(plan.tools) == [{'type': 'retrieval', 'retrieval': {'knowledge_id': 'kb1', 'prompt_template': '模板'}}]
+    assert plan.cache_key('门票') == make_cache_key('guide', 'glm-4', '你是讲解员', 'kb1', '门票')
+    assert registry.get('missing') is None
+
+
+def test_plan_is_immutable(registry):
+    plan = registry.get('guide')
+    with pytest.raises(AttributeError):
+        plan.model = 'glm-3'
+    with pytest.raises(AttributeError):
+        del plan.prompt
+
+
+def test_shared_parts_are_read_only(registry):
+    plan = registry.get('guide')
+    assert plan.tools is plan.tools
+    with pytest.raises(TypeError):
+        plan.tools[0]['retrieval']['knowledge_id'] = 'kb9'
+    with pytest.raises(TypeError):
+        plan.system_message['content'] = '改掉的提示词'
+
+
+def test_messages_can_be_modified_by_the_sdk(registry):
+    # zhipuai SDK 会就地改写每条消息的 content
+    plan = registry.get('guide')
+    messages = plan.messages('门票')
+    messages[0]['content'] = '改掉的提示词'
+    messages.append({'role': 'assistant', 'content': '...'})
+    assert plan.messages('门票') == [{'role': 'system', 'content': '你是讲解员'}, {'role': 'user', 'content': '门票'}]
+
+
+def test_problems_are_listed_together():
+    config = {
+        'a': {'model': 'glm-4', 'default_prompt': '', 'knowledge_id': 'kb'},
+        'b': {'model': 'glm-4', 'default_prompt': 'p', 'knowledge_id': 'kb', 'clean_output': 'yes'},
+    }
+    with pytest.raises(ProfileError) as e:
+        ProfileRegistry(config, lambda api_key: None, '')
+    message = str(e.value)
+    assert "profile 'a': missing or empty default_prompt" in message
+    assert "profile 'b': no api_key" in message
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from common.sentences import SentenceSegmenter, sentence_events, sentence_stream
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def segment(chunks, **kwargs):
+    kwargs.setdefault('max_latency', 60)
+    return list(sentence_stream(chunks, **kwargs))
+
+
+@pytest.mark.parametrize('chunks, expected', [
+    (['你好。我是讲解员！'], ['你好。', '我是讲解员！']),
+    (['门票', '多少', '钱？', '六十', '元。'], ['门票多少钱？', '六十元。']),
+    (['他说：“走吧。”然后', '走了'], ['他说：“走吧。”', '然后走了']),
+    (['真的吗？！', '是的……', '好'], ['真的吗？！', '是的……', '好']),
+    (['嗯，好的，我们出发吧'], ['嗯，好的，', '我们出发吧']),
+    (['Hello. ', 'World'], ['Hello. ', 'World']),
+    (['票价 3', '.5 元'], ['票价 3.5 元']),
+    (['例如e.g.学生'], ['例如e.g.学生']),
+    (['共 1,000 人，8:30 开门'], ['共 1,000 人，', '8:30 开门']),
+    (['。。', '你好'], ['。。你好']),
+])
+def test_segmentation(chunks, expected):
+    assert segment(chunks) == expected
+
+
+def test_segments_join_to_the_original():
+    rng = random.Random(0)
+    alphabet = '你好景区门票。！？，、：,:.… \n3”）a'
+    for _ in range(500):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 5)))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        assert ''.join(segment(chunks, min_chars=2)) == text
+
+
+def test_max_latency_flushes_on_the_next_delta():
+    clock = Clock()
+    segmenter = SentenceSegmenter(max_latency=1.0, clock=clock)
+    assert segmenter.feed('这是一个很长的') == []
+    clock.now = 0.5
+    assert segmenter.feed('句子') == []
+    # 超时只在下一个 delta 到达时检查
+    clock.now = 1.5
+    assert segmenter.feed(None) == ['这是一个很长的句子']
+    clock.now = 1.6
+    assert segmenter.feed('后面的') == []
+    assert segmenter.flush() == ['后面的']
+
+
+def test_max_latency_restarts_after_a_sentence():
+    clock = Clock()
+    segmenter = SentenceSegmenter(max_latency=1.0, clock=clock)
+    assert segmenter.feed('你好') == []
+    clock.now = 0.5
+    assert segmenter.feed('。这是') == ['你好。']
+    clock.now = 1.2
+    assert segmenter.feed('一个') == []
+    clock.now = 1.6
+    assert segmenter.feed('') == ['这是一个']
+
+
+def test_punctuation_only_is_not_flushed_on_latency():
+    clock = Clock()
+    segmenter = SentenceSegmenter(max_latency=0, clock=clock)
+    assert segmenter.feed('……') == []
+    assert segmenter.feed('好') == ['……好']
+
+
+def test_sentence_events():
+    assert list(sentence_events(['你好。世界'], max_latency=60)) == ['data: 你好。\n\n', 'data: 世界\n\n']
+
+
+def test_close_before_iteration_closes_the_upstream():
+    class Upstream:
+        closed = False
+
+        def __iter__(self):
+            return iter(['你好'])
+
+        def close(self):
+            self.closed = True
+
+    upstream = Upstream()
+    sentence_events(upstream).close()
+    assert upstream.closed
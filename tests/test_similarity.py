@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from common.similarity import SimilarityCache, anchors, jaccard, shingles
+
+CONTEXT = ('default', 'glm-4')
+
+
+@pytest.mark.parametrize('cached, query', [
+    ('请带我去东门停车场', '请带我去西门停车场'),
+    ('东门停车场几点开门', '西门停车场几点开门'),
+    ('一号停车场在哪里', '二号停车场在哪里'),
+    ('1号停车场在哪里', '2号停车场在哪里'),
+    ('第三个路口左转吗', '第四个路口左转吗'),
+])
+def test_differing_anchor_never_hits(cached, query):
+    # 只差一个数字或方位的问题字面相似度很高，即使阈值放低也不能命中
+    assert jaccard(shingles(cached), shingles(query)) >= 0.5
+    assert anchors(cached) != anchors(query)
+    cache = SimilarityCache(threshold=0.5)
+    cache.add(CONTEXT, cached, 'answer')
+    assert cache.lookup(CONTEXT, query) is None
+    assert cache.lookup(CONTEXT, cached).value == 'answer'
+
+
+def test_paraphrase_hits():
+    cache = SimilarityCache()
+    cache.add(CONTEXT, '游客中心在哪里', 'answer')
+    match = cache.lookup(CONTEXT, '请问，游客中心在哪里呀？')
+    assert match is not None
+    assert match.value == 'answer'
+    assert match.query == '游客中心在哪里'
+
+
+def test_context_separates_entries():
+    cache = SimilarityCache()
+    cache.add(CONTEXT + (('东门',),), '这里怎么走', 'east')
+    assert cache.lookup(CONTEXT + (('西门',),), '这里怎么走') is None
+    assert cache.lookup(CONTEXT + (('东门',),), '这里怎么走').value == 'east'
+
+
+def test_add_replaces_near_duplicates():
+    cache = SimilarityCache()
+    cache.add(CONTEXT, '游客中心在哪里', 'old')
+    cache.add(CONTEXT, '请问游客中心在哪里', 'new')
+    assert len(cache) == 1
+    assert cache.lookup(CONTEXT, '游客中心在哪里').value == 'new'
+    # 锚点不同的问题不算近似，各自保留
+    cache.add(CONTEXT, '东门停车场在哪里', 'east')
+    cache.add(CONTEXT, '西门停车场在哪里', 'west')
+    assert len(cache) == 3
+
+
+def test_expired_entries_are_not_returned():
+    cache = SimilarityCache(ttl=0)
+    cache.add(CONTEXT, '游客中心在哪里', 'answer')
+    assert cache.lookup(CONTEXT, '游客中心在哪里') is None
+    assert len(cache) == 0
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.cancel import AbortScope, StreamAborted
+from common.singleflight import AsyncSingleFlight, SingleFlight
+
+
+class Upstream:
+    """记录拉取次数和是否被关闭的上游流；gate 不为空时每个 chunk 都要等 gate 打开。"""
+
+    def __init__(self, chunks, gate=None):
+        self._chunks = iter(chunks)
+        self._gate = gate
+        self.pulled = 0
+        self.pulling = threading.Event()
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.pulling.set()
+        if self._gate is not None:
+            self._gate.wait(5)
+        chunk = next(self._chunks)
+        self.pulled += 1
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_do_runs_concurrent_calls_once():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return '回答'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', fn)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', fn))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.stats()['followers'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == ['回答'] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'leaders': 1, 'followers': 3, 'in_flight': 0}
+    # 调用结束后相同的 key 重新发起
+    assert flight.do('k', lambda: '新回答') == '新回答'
+
+
+def test_do_raises_the_error():
+    def fail():
+        raise ValueError('boom')
+
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_late_subscriber_gets_the_whole_stream():
+    flight = SingleFlight()
+    upstream = Upstream(['一', '二', '三'])
+    first = flight.stream('k', lambda: upstream)
+    assert next(first) == '一'
+    second = flight.stream('k', lambda: pytest.fail('不应再次调用上游'))
+    assert list(second) == ['一', '二', '三']
+    assert list(first) == ['二', '三']
+    assert upstream.pulled == 3
+    assert not flight.streaming('k')
+
+
+def test_one_subscriber_leaving_keeps_the_stream():
+    flight = SingleFlight()
+    upstream = Upstream(['一', '二'])
+    first = flight.stream('k', lambda: upstream)
+    second = flight.stream('k', lambda: upstream)
+    assert next(first) == '一'
+    first.close()
+    assert not upstream.closed
+    assert list(second) == ['一', '二']
+
+
+def test_last_subscriber_leaving_closes_the_upstream():
+    flight = SingleFlight()
+    upstream = Upstream(['一', '二'])
+    first = flight.stream('k', lambda: upstream)
+    second = flight.stream('k', lambda: upstream)
+    assert next(first) == '一'
+    first.close()
+    # 没开始迭代就被关闭同样算离开
+    second.close()
+    second.close()
+    assert upstream.closed
+    assert not flight.streaming('k')
+    assert list(flight.stream('k', lambda: Upstream(['新']))) == ['新']
+
+
+def test_upstream_error_reaches_every_subscriber():
+    def chunks():
+        yield '一'
+        raise RuntimeError('boom')
+
+    flight = SingleFlight()
+    first = flight.stream('k', chunks)
+    second = flight.stream('k', chunks)
+    with pytest.raises(RuntimeError):
+        list(first)
+    with pytest.raises(RuntimeError):
+        list(second)
+    assert not flight.streaming('k')
+
+
+def test_concurrent_subscribers_pull_once():
+    flight = SingleFlight()
+    gate = threading.Event()
+    upstream = Upstream([str(i) for i in range(20)], gate)
+    results = [None] * 8
+    streams = [flight.stream('k', lambda: upstream) for _ in results]
+
+    def read(i):
+        results[i] = list(streams[i])
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [[str(i) for i in range(20)]] * 8
+    assert upstream.pulled == 20
+
+
+def test_aborted_subscriber_leaves_without_waiting():
+    flight = SingleFlight()
+    gate = threading.Event()
+    upstream = Upstream(['一', '二'], gate)
+    scope = AbortScope()
+    errors = []
+    first = flight.stream('k', lambda: upstream)
+    with scope:
+        second = flight.stream('k', lambda: upstream)
+
+    def read():
+        try:
+            list(second)
+        except StreamAborted as e:
+            errors.append(e)
+
+    # first 正在拉取（等 gate），second 在等待 first 拉到的片段
+    puller = threading.Thread(target=lambda: next(first))
+    puller.start()
+    upstream.pulling.wait(5)
+    reader = threading.Thread(target=read)
+    reader.start()
+    scope.abort()
+    reader.join(1)
+    assert not reader.is_alive()
+    assert len(errors) == 1
+    # 其他订阅者不受影响
+    gate.set()
+    puller.join(5)
+    assert list(first) == ['二']
+    assert not upstream.closed
+
+
+def test_async_stream_is_shared():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            for chunk in ['一', '二', '三']:
+                await asyncio.sleep(0)
+                yield chunk
+
+        async def read():
+            return [chunk async for chunk in flight.stream('k', upstream)]
+
+        results = await asyncio.gather(read(), read(), read())
+        assert results == [['一', '二', '三']] * 3
+        assert len(calls) == 1
+        assert not flight.streaming('k')
+
+    asyncio.run(main())
+
+
+def test_async_do_survives_a_cancelled_caller():
+    async def main():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return '回答'
+
+        first = asyncio.ensure_future(flight.do('k', fn))
+        second = asyncio.ensure_future(flight.do('k', fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        assert await second == '回答'
+        assert flight.leaders == 1 and flight.followers == 1
+
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from common.sse import HEARTBEAT, coalesce, event_writes, format_event, text_writes
+
+
+class Upstream:
+    """记录是否被关闭的上游 delta 流。"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_format_event_splits_lines():
+    assert format_event('a\r\nb', 'answer') == 'event: answer\ndata: a\ndata: b\n\n'
+
+
+def test_sparse_deltas_are_written_immediately():
+    assert list(coalesce(['你', None, '好'], window=0)) == [['你'], ['好']]
+
+
+def test_dense_deltas_are_merged():
+    upstream = Upstream(['你', '', '好', '呀'])
+    assert list(coalesce(upstream, window=60)) == [['你'], ['好', '呀']]
+    assert upstream.closed
+
+
+def test_max_chars_writes_early():
+    assert list(coalesce(['ab', 'cd', 'ef', 'g'], window=60, max_chars=4)) == [['ab'], ['cd', 'ef'], ['g']]
+
+
+def timed(writes):
+    """读完 writes，返回 [(写出时距开始的秒数, 内容)]。"""
+    start = time.monotonic()
+    return [(time.monotonic() - start, write) for write in writes]
+
+
+def pausing(pause):
+    yield 'a'
+    yield 'b'
+    time.sleep(pause)
+    yield 'c'
+
+
+def test_buffered_text_is_written_within_the_window():
+    writes = timed(event_writes(pausing(0.5), window=0.03, heartbeat=60))
+    assert [write for _, write in writes] == [format_event('a'), format_event('b'), format_event('c')]
+    # "b" 在上游停顿期间按窗口写出，不等到 "c" 到达
+    assert writes[1][0] < 0.25
+    assert writes[2][0] >= 0.5
+
+
+def test_heartbeats_while_the_upstream_is_silent():
+    writes = timed(event_writes(pausing(0.5), window=0.03, heartbeat=0.1))
+    heartbeats = [at for at, write in writes if write == HEARTBEAT]
+    assert len(heartbeats) >= 3
+    assert all(0.05 < at < 0.55 for at in heartbeats)
+    assert ''.join(write for write in [w for _, w in writes] if write != HEARTBEAT) == \
+        format_event('a') + format_event('b') + format_event('c')
+
+
+def test_raw_text_has_no_heartbeats():
+    assert list(text_writes(pausing(0.2), window=0.03)) == ['a', 'b', 'c']
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_close_stops_the_pump_and_closes_upstream():
+    upstream = Upstream(['a', 'b', 'c'])
+    writes = text_writes(upstream)
+    assert next(writes) == 'a'
+    writes.close()
+    assert wait_for(lambda: upstream.closed)
+    assert wait_for(lambda: not any(thread.name == 'sse-pump' for thread in threading.enumerate()))
+
+
+def test_close_does_not_wait_for_a_stalled_upstream():
+    gate = threading.Event()
+    closed = threading.Event()
+
+    def stalled():
+        try:
+            yield 'a'
+            gate.wait(5)
+            yield 'b'
+        finally:
+            closed.set()
+
+    writes = event_writes(stalled(), window=0.03, heartbeat=60)
+    assert next(writes) == format_event('a')
+    start = time.monotonic()
+    writes.close()
+    assert time.monotonic() - start < 0.1
+    # 读取线程在上游返回下一个 chunk 后退出并关闭上游
+    gate.set()
+    assert closed.wait(5)
+
+
+def test_close_before_iteration_closes_upstream_without_a_thread():
+    upstream = Upstream(['a'])
+    threads = threading.active_count()
+    text_writes(upstream).close()
+    assert upstream.closed
+    assert threading.active_count() == threads
+
+
+def test_upstream_error_is_raised_after_buffered_text():
+    def failing():
+        yield 'a'
+        yield 'b'
+        raise RuntimeError('upstream failed')
+
+    writes = coalesce(failing(), window=60)
+    assert next(writes) == ['a']
+    assert next(writes) == ['b']
+    with pytest.raises(RuntimeError):
+        next(writes)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+
+import pytest
+
+from common.admission import Rejected
+from common.cancel import CancelStats, UpstreamGuard
+from common.singleflight import SingleFlight
+from common.turn import TurnRunner
+
+NAV_N = '{"NEEDNAV":"N","POI":"NONE"}'
+NAV_Y = '{"NEEDNAV":"Y","POI":"东门"}'
+
+
+def parse(events):
+    """SSE 事件 → [(event, data)]。"""
+    parsed = []
+    for event in events:
+        lines = event.strip().split('\n')
+        parsed.append((lines[0][len('event: '):], '\n'.join(line[len('data: '):] for line in lines[1:])))
+    return parsed
+
+
+class Upstream:
+    def __init__(self, chunks, gate=None):
+        self._chunks = iter(chunks)
+        self._gate = gate
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._gate is not None:
+            self._gate.wait(5)
+        return next(self._chunks)
+
+    def close(self):
+        self.closed.set()
+
+
+class StalledResponse:
+    """SDK 流的替身：不发任何片段，直到底层响应被关闭。"""
+
+    def __init__(self):
+        self.response = self
+        self.reading = threading.Event()
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.reading.set()
+        if not self.closed.wait(5):
+            pytest.fail('上游没有被中断')
+        raise ConnectionError('response closed')
+
+    def close(self):
+        self.closed.set()
+
+
+def stalled_answer(stats):
+    """与服务中相同的回答生成器：UpstreamGuard 包着读取 SDK 流的循环。"""
+    response = StalledResponse()
+
+    def generate():
+        with UpstreamGuard(response, 'test', stats) as guard:
+            for chunk in response:
+                guard.tick()
+                yield chunk
+
+    return response, generate
+
+
+def wait_until_idle(runner):
+    deadline = time.monotonic() + 1
+    while runner.stats()['active'] and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return runner.stats()['active'] == 0
+
+
+def test_nav_and_answer_are_merged():
+    runner = TurnRunner(max_workers=4)
+    events = parse(runner.run(lambda: NAV_N, lambda: Upstream(['你', '好']), lambda nav: False))
+    assert ('nav', NAV_N) in events
+    assert [data for kind, data in events if kind == 'answer'] == ['你', '好']
+    assert events[-1] == ('done', '{"cancelled": false}')
+
+
+def test_navigation_cancels_the_answer():
+    runner = TurnRunner(max_workers=4)
+    gate = threading.Event()
+    upstream = Upstream(['你', '好'], gate)
+    events = parse(runner.run(lambda: NAV_Y, lambda: upstream, lambda nav: 'Y' in nav))
+    gate.set()
+    assert events == [('nav', NAV_Y), ('done', '{"cancelled": true}')]
+    assert upstream.closed.wait(5)
+    assert runner.stats()['answers_cancelled'] == 1
+
+
+def test_nav_error_is_reported():
+    def fail():
+        raise RuntimeError('boom')
+
+    runner = TurnRunner(max_workers=4)
+    events = parse(runner.run(fail, lambda: Upstream(['你']), lambda nav: False))
+    assert ('error', '{"detail": "boom"}') in events
+    assert events[-1] == ('done', '{"cancelled": false}')
+
+
+def test_timeout_ends_the_turn_with_an_error():
+    runner = TurnRunner(max_workers=4, timeout=0.05)
+    gate = threading.Event()
+    upstream = Upstream(['你'], gate)
+    events = parse(runner.run(lambda: NAV_N, lambda: upstream, lambda nav: False))
+    gate.set()
+    assert events[-2] == ('error', json.dumps({'detail': 'Timed out waiting for answer'}))
+    assert events[-1] == ('done', '{"cancelled": true}')
+    assert upstream.closed.wait(5)
+    assert runner.stats()['timed_out'] == 1
+
+
+def test_saturated_pool_rejects():
+    runner = TurnRunner(max_workers=2)
+    gate = threading.Event()
+    first = runner.run(lambda: gate.wait(5) and NAV_N, lambda: Upstream(['你']), lambda nav: False)
+    with pytest.raises(Rejected) as e:
+        runner.run(lambda: NAV_N, lambda: Upstream(['你']), lambda nav: False)
+    assert e.value.headers == {'Retry-After': '1'}
+    gate.set()
+    list(first)
+    # 两个任务都结束后名额归还
+    for _ in range(100):
+        if runner.stats()['active'] == 0:
+            break
+        time.sleep(0.01)
+    assert runner.stats()['active'] == 0
+    assert runner.stats()['rejected'] == 1
+    assert parse(runner.run(lambda: NAV_N, lambda: Upstream([]), lambda nav: False))[-1][0] == 'done'
+
+
+def test_closed_before_iteration_cancels_the_answer():
+    runner = TurnRunner(max_workers=4)
+    gate = threading.Event()
+    upstream = Upstream(['你', '好'], gate)
+    events = runner.run(lambda: NAV_N, lambda: upstream, lambda nav: False)
+    events.close()
+    gate.set()
+    assert upstream.closed.wait(5)
+
+
+def test_navigation_before_the_first_token_aborts_the_upstream():
+    runner = TurnRunner(max_workers=4)
+    stats = CancelStats()
+    response, generate = stalled_answer(stats)
+    # 回答线程阻塞在等待第一个片段时给出导航判断
+    events = parse(runner.run(lambda: response.reading.wait(5) and NAV_Y, generate, lambda nav: 'Y' in nav))
+    assert events == [('nav', NAV_Y), ('done', '{"cancelled": true}')]
+    # 不等上游的下一个片段，回答线程立即退出
+    assert response.closed.wait(1)
+    assert wait_until_idle(runner)
+    assert stats.stats()['cancelled'] == 1
+
+
+def test_navigation_aborts_a_shared_answer_stream():
+    runner = TurnRunner(max_workers=4)
+    inflight = SingleFlight()
+    response, generate = stalled_answer(CancelStats())
+    # 回答线程从共享流拉取第一个片段时给出导航判断
+    events = parse(runner.run(lambda: response.reading.wait(5) and NAV_Y, lambda: inflight.stream('问题', generate),
+                              lambda nav: 'Y' in nav))
+    assert events[-1] == ('done', '{"cancelled": true}')
+    assert response.closed.wait(1)
+    assert wait_until_idle(runner)
+    assert not inflight.streaming('问题')